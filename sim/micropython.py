@@ -0,0 +1,56 @@
+"""! @file micropython.py
+
+Host-side stand-in for the MicroPython micropython module. Code emitter
+decorators are passed through unchanged and memory functions do nothing.
+"""
+
+
+def native(function):
+    """!
+        Pass-through for the native code emitter decorator
+    """
+    return function
+
+
+def viper(function):
+    """!
+        Pass-through for the viper code emitter decorator
+    """
+    return function
+
+
+def const(value):
+    """!
+        Pass-through for compile time constants
+    """
+    return value
+
+
+def alloc_emergency_exception_buf(size):
+    """!
+        No emergency buffer is needed on the host
+    """
+    pass
+
+
+def schedule(function, argument):
+    """!
+        Runs a scheduled callback immediately, as the host has no soft interrupts
+    """
+    function(argument)
+    return True
+
+
+def heap_lock():
+    """!
+        Does nothing, as the host heap cannot be locked
+    """
+    pass
+
+
+def heap_unlock():
+    """!
+        Does nothing, as the host heap is never locked
+        @return 0, the lock depth after unlocking
+    """
+    return 0
@@ -0,0 +1,141 @@
+"""! @file plant.py
+
+Physical model of a brushed DC motor with a quadrature encoder, driven by the
+simulated IHM04A1 PWM outputs and read back through a simulated encoder timer.
+The model is integrated lazily: whenever an output changes or the encoder is
+read, the motor state is stepped forward to the current virtual time.
+"""
+
+import math
+import pyb
+from sim_clock import clock
+
+
+class DCMotorPlant:
+    """!
+    Brushed DC motor with rotor inertia, viscous damping and Coulomb friction.
+    Armature inductance is neglected, so the winding current follows the
+    terminal voltage and back EMF instantly. Driving both H-bridge inputs with
+    the same duty shorts the winding (braking); pulling the enable pin low
+    leaves it open (coasting).
+    """
+
+    def __init__(self,
+                 motor_timer_num=2, in1_channel=1, in2_channel=2,
+                 enable_pin="PC1", encoder_timer_num=4,
+                 supply_voltage=12.0,
+                 resistance=3.0,
+                 torque_constant=0.24,
+                 inertia=9.5e-4,
+                 damping=1e-4,
+                 coulomb_friction=0.02,
+                 counts_per_rev=4096,
+                 encoder_polarity=-1,
+                 step_us=50):
+        """!
+            Creates a motor model and wires it to simulated timers and pins
+            @param motor_timer_num Timer generating both H-bridge PWM inputs
+            @param in1_channel Timer channel driving H-bridge input 1 (reverse)
+            @param in2_channel Timer channel driving H-bridge input 2 (forward)
+            @param enable_pin Board name of the H-bridge enable pin
+            @param encoder_timer_num Timer counting the quadrature encoder
+            @param supply_voltage Motor supply voltage in V
+            @param resistance Winding resistance in ohms
+            @param torque_constant Torque and back EMF constant in N*m/A
+            @param inertia Rotor and load inertia in kg*m^2
+            @param damping Viscous friction in N*m*s/rad
+            @param coulomb_friction Dry friction torque in N*m
+            @param counts_per_rev Encoder counts per output revolution
+            @param encoder_polarity Sign of the hardware count for forward motion.
+                The drivers treat a falling timer count as a rising position.
+            @param step_us Integration step in microseconds
+        """
+        self.__motor_timer_num = motor_timer_num
+        self.__in1_channel = in1_channel
+        self.__in2_channel = in2_channel
+        self.__enable_pin = enable_pin
+
+        self.supply_voltage = supply_voltage
+        self.resistance = resistance
+        self.torque_constant = torque_constant
+        self.inertia = inertia
+        self.damping = damping
+        self.coulomb_friction = coulomb_friction
+        self.counts_per_rev = counts_per_rev
+        self.encoder_polarity = encoder_polarity
+        self.step_us = step_us
+
+        ## Shaft angle in radians
+        self.angle = 0.0
+        ## Shaft speed in radians per second
+        self.speed = 0.0
+        self.__time_us = clock.now_us
+
+        pyb.timer(encoder_timer_num).attach_encoder(self.raw_count)
+        pyb.add_output_listener(self.update)
+
+
+    def __duty(self, channel_num):
+        channel = pyb.timer(self.__motor_timer_num).channel(channel_num)
+        if channel is None:
+            return 0.0
+        return channel.duty()
+
+
+    def __step(self, dt, enabled, voltage):
+        if enabled:
+            current = (voltage - self.torque_constant * self.speed) / self.resistance
+        else:
+            current = 0.0
+        drive_torque = self.torque_constant * current - self.damping * self.speed
+
+        if self.speed == 0.0 and abs(drive_torque) <= self.coulomb_friction:
+            return
+
+        friction = math.copysign(self.coulomb_friction,
+                                 self.speed if self.speed != 0.0 else drive_torque)
+        new_speed = self.speed + (drive_torque - friction) * dt / self.inertia
+
+        # Dry friction stops the shaft rather than reversing it
+        if self.speed != 0.0 and (new_speed > 0.0) != (self.speed > 0.0):
+            new_speed = 0.0
+
+        self.angle += 0.5 * (self.speed + new_speed) * dt
+        self.speed = new_speed
+
+
+    def update(self):
+        """!
+            Integrates the motor up to the current virtual time using the
+            outputs that have been applied since the previous update
+        """
+        elapsed_us = clock.now_us - self.__time_us
+        if elapsed_us <= 0:
+            return
+
+        enabled = pyb.pin(self.__enable_pin).value() != 0
+        voltage = self.supply_voltage * (self.__duty(self.__in2_channel)
+                                         - self.__duty(self.__in1_channel))
+
+        while elapsed_us > 0:
+            step = min(self.step_us, elapsed_us)
+            self.__step(step * 1e-6, enabled, voltage)
+            elapsed_us -= step
+
+        self.__time_us = clock.now_us
+
+
+    def raw_count(self):
+        """!
+            @return Signed quadrature count seen by the encoder timer
+        """
+        self.update()
+        return self.encoder_polarity * int(self.angle * self.counts_per_rev / (2 * math.pi))
+
+
+    def position_counts(self):
+        """!
+            @return Shaft position in encoder counts, positive for forward motion
+        """
+        self.update()
+        return int(self.angle * self.counts_per_rev / (2 * math.pi))
@@ -0,0 +1,516 @@
+"""! @file pyb.py
+
+Host-side stand-in for the parts of MicroPython's pyb module used by the
+drivers in src/. Timers support PWM output and quadrature encoder counting,
+pins remember their values, and the USB virtual COM port is backed by a pair
+of in-memory buffers that the simulation harness reads and writes through
+usb_host. Anything a simulated plant needs to observe is looked up through
+timer() and pin().
+"""
+
+from sim_clock import clock
+
+
+## Clock feeding every timer on the NUCLEO-L476RG, in Hz
+TIMER_SOURCE_FREQ = 80000000
+
+_timers = {}
+_pins = {}
+_output_listeners = []
+
+
+def add_output_listener(listener):
+    """!
+        Registers a callable invoked just before any simulated output changes,
+        so lazily integrated plants can catch up using the previous outputs
+        @param listener Callable taking no arguments
+    """
+    _output_listeners.append(listener)
+
+
+def clear_output_listeners():
+    """!
+        Removes all registered output listeners
+    """
+    del _output_listeners[:]
+
+
+def _outputs_changing():
+    for listener in _output_listeners:
+        listener()
+
+
+def timer(timer_num):
+    """!
+        @param timer_num Timer number
+        @return The simulated timer with that number, creating it if needed
+    """
+    if timer_num not in _timers:
+        _timers[timer_num] = Timer(timer_num)
+    return _timers[timer_num]
+
+
+def pin(name):
+    """!
+        @param name Board name of a pin such as "PC1"
+        @return The simulated pin with that name, creating it if needed
+    """
+    if name not in _pins:
+        _pins[name] = Pin(name)
+    return _pins[name]
+
+
+def reset():
+    """!
+        Forgets every timer, pin and listener and empties the USB buffers
+    """
+    _timers.clear()
+    _pins.clear()
+    clear_output_listeners()
+    usb_host.reset()
+
+
+class Pin:
+    """!
+    Simulated GPIO pin. Constructing a pin with the same name twice returns
+    the same object, as both refer to the same physical pin.
+    """
+
+    IN = 0
+    OUT_PP = 1
+    OUT_OD = 17
+    AF_PP = 2
+    AF_OD = 18
+    ANALOG = 3
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    AF1_TIM1 = 1
+    AF1_TIM2 = 1
+    AF2_TIM3 = 2
+    AF2_TIM4 = 2
+    AF2_TIM5 = 2
+    AF3_TIM8 = 3
+    AF14_TIM15 = 14
+    AF14_TIM16 = 14
+    AF14_TIM17 = 14
+
+    def __new__(cls, id, *args, **kwargs):
+        name = id.name() if isinstance(id, Pin) else str(id)
+        existing = _pins.get(name)
+        if existing is not None:
+            return existing
+        new_pin = super().__new__(cls)
+        new_pin.__name = name
+        new_pin.__value = 0
+        new_pin.__mode = Pin.IN
+        new_pin.__af = None
+        _pins[name] = new_pin
+        return new_pin
+
+    def __init__(self, id, mode=None, pull=None, af=None, value=None):
+        if mode is not None:
+            self.init(mode, pull, af, value)
+
+    def init(self, mode=IN, pull=None, af=None, value=None):
+        self.__mode = mode
+        self.__af = af
+        if value is not None:
+            self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return self.__value
+        _outputs_changing()
+        self.__value = 1 if value else 0
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+    on = high
+    off = low
+
+    def name(self):
+        return self.__name
+
+    def mode(self):
+        return self.__mode
+
+    def af(self):
+        return self.__af
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def __repr__(self):
+        return "Pin(Pin.cpu.{})".format(self.__name)
+
+
+class _BoardPins(type):
+    """!
+    Namespace of board pin names, resolving any attribute to a pin
+    """
+
+    def __getattr__(cls, name):
+        return Pin(name)
+
+
+Pin.board = _BoardPins("board", (), {})
+Pin.cpu = Pin.board
+
+
+class TimerChannel:
+    """!
+    Simulated timer channel. PWM channels keep a compare value from which the
+    output duty fraction is derived.
+    """
+
+    def __init__(self, timer, channel, mode, pin):
+        self.__timer = timer
+        self.__channel = channel
+        self.__mode = mode
+        self.__pin = pin
+        self.__compare = 0
+        self.__callback = None
+
+    def mode(self):
+        return self.__mode
+
+    def compare(self, value=None):
+        if value is None:
+            return self.__compare
+        _outputs_changing()
+        self.__compare = int(value)
+
+    def pulse_width(self, value=None):
+        return self.compare(value)
+
+    def pulse_width_percent(self, value=None):
+        span = self.__timer.period() + 1
+        if value is None:
+            return self.__compare * 100 / span
+        self.compare(value * span / 100)
+
+    def capture(self, value=None):
+        return self.compare(value)
+
+    def callback(self, function):
+        self.__callback = function
+
+    def duty(self):
+        """!
+            @return Fraction of each PWM period the output is high, from 0 to 1
+        """
+        span = self.__timer.period() + 1
+        fraction = self.__compare / span
+        if fraction < 0:
+            return 0.0
+        if fraction > 1:
+            return 1.0
+        return fraction
+
+
+class Timer:
+    """!
+    Simulated hardware timer. Encoder mode counters are driven by a count
+    source attached by a plant model; other timers count from the virtual clock.
+    Update callbacks are fired from the virtual clock at the timer's rate, with
+    further events held off while a callback runs, as interrupts would be.
+    """
+
+    UP = 0
+    DOWN = 16
+    CENTER = 32
+    PWM = 0
+    PWM_INVERTED = 1
+    OC_TIMING = 2
+    OC_ACTIVE = 3
+    OC_INACTIVE = 4
+    OC_TOGGLE = 5
+    OC_FORCED_ACTIVE = 6
+    OC_FORCED_INACTIVE = 7
+    IC = 8
+    ENC_A = 9
+    ENC_B = 10
+    ENC_AB = 11
+    HIGH = 0
+    LOW = 2
+    RISING = 0
+    FALLING = 2
+    BOTH = 10
+
+    def __new__(cls, id, *args, **kwargs):
+        existing = _timers.get(id)
+        if existing is not None:
+            return existing
+        new_timer = super().__new__(cls)
+        new_timer.__id = id
+        new_timer.__prescaler = 0
+        new_timer.__period = 0xFFFF
+        new_timer.__channels = {}
+        new_timer.__encoder_source = None
+        new_timer.__offset = 0
+        new_timer.__callback = None
+        new_timer.__generation = 0
+        new_timer.__next_tick_us = 0.0
+        _timers[id] = new_timer
+        return new_timer
+
+    def __init__(self, id, freq=None, prescaler=None, period=None, mode=UP,
+                 div=1, callback=None, deadtime=0):
+        if freq is not None or prescaler is not None or period is not None:
+            self.init(freq=freq, prescaler=prescaler, period=period,
+                      mode=mode, div=div, callback=callback, deadtime=deadtime)
+
+    def init(self, freq=None, prescaler=None, period=None, mode=UP, div=1,
+             callback=None, deadtime=0):
+        if freq is not None:
+            total = TIMER_SOURCE_FREQ / freq
+            prescaler = 0
+            while total / (prescaler + 1) > 0x10000:
+                prescaler += 1
+            period = max(int(round(total / (prescaler + 1))) - 1, 0)
+        if prescaler is not None:
+            self.__prescaler = prescaler
+        if period is not None:
+            self.__period = period
+        if callback is not None:
+            self.callback(callback)
+
+    def deinit(self):
+        self.callback(None)
+        self.__channels = {}
+
+    def channel(self, channel, mode=None, pin=None, pulse_width=None,
+                pulse_width_percent=None, compare=None, polarity=None,
+                callback=None):
+        if mode is None:
+            return self.__channels.get(channel)
+        new_channel = TimerChannel(self, channel, mode, pin)
+        self.__channels[channel] = new_channel
+        if pulse_width is not None:
+            new_channel.pulse_width(pulse_width)
+        if pulse_width_percent is not None:
+            new_channel.pulse_width_percent(pulse_width_percent)
+        if compare is not None:
+            new_channel.compare(compare)
+        return new_channel
+
+    def attach_encoder(self, source):
+        """!
+            Drives this timer's counter from a quadrature count source
+            @param source Callable returning the raw signed count seen by the encoder
+        """
+        self.__encoder_source = source
+        self.__offset = 0
+
+    def __raw_count(self):
+        if self.__encoder_source is not None:
+            return self.__encoder_source()
+        return (clock.now_us * (TIMER_SOURCE_FREQ // 1000000)) // (self.__prescaler + 1)
+
+    def counter(self, value=None):
+        if value is None:
+            return (self.__raw_count() - self.__offset) % (self.__period + 1)
+        self.__offset = self.__raw_count() - value
+
+    def period(self, value=None):
+        if value is None:
+            return self.__period
+        self.__period = value
+
+    def prescaler(self, value=None):
+        if value is None:
+            return self.__prescaler
+        self.__prescaler = value
+
+    def freq(self, value=None):
+        if value is None:
+            return TIMER_SOURCE_FREQ / (self.__prescaler + 1) / (self.__period + 1)
+        self.init(freq=value)
+
+    def source_freq(self):
+        return TIMER_SOURCE_FREQ
+
+    def callback(self, function):
+        self.__callback = function
+        self.__generation += 1
+        if function is not None:
+            self.__next_tick_us = float(clock.now_us)
+            self.__schedule_tick(self.__generation)
+
+    def __schedule_tick(self, generation):
+        period_us = (self.__prescaler + 1) * (self.__period + 1) * 1000000 / TIMER_SOURCE_FREQ
+        self.__next_tick_us += period_us
+        clock.call_at(int(round(self.__next_tick_us)), lambda: self.__tick(generation))
+
+    def __tick(self, generation):
+        if generation != self.__generation or self.__callback is None:
+            return
+        self.__schedule_tick(generation)
+        self.__callback(self)
+
+    def __repr__(self):
+        return "Timer({})".format(self.__id)
+
+
+class _VCPBuffers:
+    """!
+    Host side of the simulated USB virtual COM port
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.rx = bytearray()
+        self.tx = bytearray()
+
+    def send(self, data):
+        """!
+            Queues bytes for the board to read, as if sent by the PC
+            @param data Bytes or string to queue
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        self.rx.extend(data)
+
+    def take_output(self):
+        """!
+            Removes and returns everything the board has written so far
+            @return Bytes written by the board
+        """
+        data = bytes(self.tx)
+        del self.tx[:]
+        return data
+
+
+## Host end of the simulated USB link, used by the simulation harness
+usb_host = _VCPBuffers()
+
+
+class USB_VCP:
+    """!
+    Simulated USB virtual COM port. Every instance shares the same buffers.
+    """
+
+    def __init__(self, id=0):
+        pass
+
+    def init(self, flow=-1):
+        pass
+
+    def setinterrupt(self, chr):
+        pass
+
+    def isconnected(self):
+        return True
+
+    def any(self):
+        return len(usb_host.rx) > 0
+
+    def read(self, nbytes=None):
+        if not usb_host.rx:
+            return None
+        if nbytes is None:
+            nbytes = len(usb_host.rx)
+        data = bytes(usb_host.rx[:nbytes])
+        del usb_host.rx[:nbytes]
+        return data
+
+    def readinto(self, buf, maxlen=None):
+        if not usb_host.rx:
+            return None
+        count = len(buf) if maxlen is None else min(maxlen, len(buf))
+        count = min(count, len(usb_host.rx))
+        buf[:count] = usb_host.rx[:count]
+        del usb_host.rx[:count]
+        return count
+
+    def readline(self):
+        end = usb_host.rx.find(b"\n")
+        if end < 0:
+            return None
+        return self.read(end + 1)
+
+    def write(self, buf):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        data = bytes(memoryview(buf))
+        usb_host.tx.extend(data)
+        return len(data)
+
+    def send(self, data, timeout=5000):
+        if isinstance(data, int):
+            data = bytes((data,))
+        return self.write(data)
+
+    def recv(self, data, timeout=5000):
+        if isinstance(data, int):
+            return self.read(data)
+        return self.readinto(data)
+
+
+class LED:
+    """!
+    Simulated on-board LED
+    """
+
+    def __init__(self, id):
+        self.__state = 0
+
+    def on(self):
+        self.__state = 1
+
+    def off(self):
+        self.__state = 0
+
+    def toggle(self):
+        self.__state ^= 1
+
+    def intensity(self, value=None):
+        if value is None:
+            return 255 * self.__state
+        self.__state = 1 if value else 0
+
+
+def millis():
+    return (clock.read_us() // 1000) & 0x3FFFFFFF
+
+
+def micros():
+    return clock.read_us() & 0x3FFFFFFF
+
+
+def elapsed_millis(start):
+    return (millis() - start) & 0x3FFFFFFF
+
+
+def elapsed_micros(start):
+    return (micros() - start) & 0x3FFFFFFF
+
+
+def delay(ms):
+    clock.advance(ms * 1000)
+
+
+def udelay(us):
+    clock.advance(us)
+
+
+def disable_irq():
+    return True
+
+
+def enable_irq(state=True):
+    pass
+
+
+def freq():
+    return (TIMER_SOURCE_FREQ, TIMER_SOURCE_FREQ, TIMER_SOURCE_FREQ, TIMER_SOURCE_FREQ)
@@ -0,0 +1,307 @@
+"""! @file run_sim.py
+
+Runs src/main.py unmodified on a PC against the simulated pyb and utime
+modules and a DC motor model, then reports step response quality and how fast
+the simulation ran compared to real time.
+
+Usage: python sim/run_sim.py [--kp 0.03] [--duration 3] [--poll-cost 5]
+                             [--set NAME=VALUE ...] [--trace-heap]
+
+--set replaces the value of a module level constant in main.py before it runs,
+for example --set LOOP_MODE='"fused"'. --trace-heap models MicroPython's heap
+filling with garbage, see sim_gc.py, so allocation tracking and garbage
+collection can be tried out; it makes the simulation several times slower.
+
+cotask.py and task_share.py are taken from the path if present, otherwise from
+the me405_support package that the drivers already fall back to on a PC.
+"""
+
+import argparse
+import ast
+import io
+import os
+import re
+import struct
+import sys
+import time
+
+
+## Directory holding this file and the simulated MicroPython modules
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+## Directory holding the code that runs on the board
+SRC_DIR = os.path.join(os.path.dirname(SIM_DIR), "src")
+
+for _path in (SRC_DIR, SIM_DIR):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+import tracemalloc
+import pyb
+import plant
+import sim_gc
+from sim_clock import clock
+
+
+def install_support_modules():
+    """!
+        Makes cotask and task_share importable by name, as main.py expects,
+        and puts the simulated gc module in place of CPython's
+    """
+    sys.modules["gc"] = sim_gc
+    try:
+        import cotask
+        import task_share
+    except ImportError:
+        from me405_support import cotask, task_share
+        sys.modules["cotask"] = cotask
+        sys.modules["task_share"] = task_share
+
+
+class _VCPWriter(io.TextIOBase):
+    """!
+    Text stream sending print() output to the simulated USB port, as the
+    MicroPython REPL does on the board
+    """
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        pyb.usb_host.tx.extend(text.encode())
+        return len(text)
+
+
+def load_program(main_path, overrides=None):
+    """!
+        Reads a program, replacing module level constant assignments
+        @param main_path Path of the program
+        @param overrides Dictionary of constant names and replacement values
+        @return Compiled code object
+    """
+    with open(main_path) as source_file:
+        source = source_file.read()
+
+    for name, value in (overrides or {}).items():
+        source, found = re.subn(r"^{}\s*=.*$".format(re.escape(name)),
+                                "{} = {!r}".format(name, value),
+                                source, count=1, flags=re.MULTILINE)
+        if not found:
+            raise KeyError("{} is not assigned in {}".format(name, main_path))
+
+    return compile(source, main_path, "exec")
+
+
+def simulate(main_path=os.path.join(SRC_DIR, "main.py"),
+             commands=((100, "0.03\n"),),
+             duration_s=3.0,
+             poll_cost_us=5,
+             plant_kwargs=None,
+             overrides=None,
+             trace_heap=False):
+    """!
+        Runs a main program in the simulator until the duration elapses
+        @param main_path Path of the program to run as __main__
+        @param commands Sequence of (time in ms, text) pairs sent over USB
+        @param duration_s Simulated run time in seconds
+        @param poll_cost_us Simulated microseconds charged per clock read
+        @param plant_kwargs Keyword arguments for the DCMotorPlant
+        @param overrides Dictionary of module level constants to replace
+        @param trace_heap Model the heap filling with garbage, see sim_gc.py
+        @return Tuple of (bytes written by the board, program globals,
+            wall clock seconds taken, motor plant)
+    """
+    code = load_program(main_path, overrides)
+    install_support_modules()
+    pyb.reset()
+    clock.reset()
+    clock.poll_cost_us = poll_cost_us
+    sim_gc.reset()
+    if trace_heap:
+        tracemalloc.start()
+
+    motor = plant.DCMotorPlant(**(plant_kwargs or {}))
+
+    for send_ms, text in commands:
+        clock.call_at(send_ms * 1000, lambda text=text: pyb.usb_host.send(text))
+    clock.stop_at(int(duration_s * 1000000))
+
+    stdout = sys.stdout
+    sys.stdout = _VCPWriter()
+    wall_start = time.perf_counter()
+    try:
+        program = {"__name__": "__main__", "__file__": main_path}
+        exec(code, program)
+    finally:
+        wall_s = time.perf_counter() - wall_start
+        sys.stdout = stdout
+        if trace_heap:
+            tracemalloc.stop()
+
+    return pyb.usb_host.take_output(), program, wall_s, motor
+
+
+def parse_step_lines(output):
+    """!
+        Extracts "time,position" lines from the board's text output
+        @param output Bytes written by the board
+        @return Tuple of lists (times in ms, positions in counts)
+    """
+    times = []
+    positions = []
+    for line in output.decode(errors="replace").splitlines():
+        fields = line.strip().split(",")
+        if len(fields) != 2:
+            continue
+        try:
+            times.append(float(fields[0]))
+            positions.append(float(fields[1]))
+        except ValueError:
+            pass
+    return times, positions
+
+
+def parse_telemetry_frames(output):
+    """!
+        Extracts binary telemetry frames from the board's output, skipping
+        any text printed between them
+        @param output Bytes written by the board
+        @return Tuple of lists (times in ms, positions in counts)
+    """
+    import telemetry
+
+    times = []
+    positions = []
+    sync = bytes((telemetry.SYNC_1, telemetry.SYNC_2))
+    index = output.find(sync)
+    while 0 <= index <= len(output) - telemetry.FRAME_SIZE:
+        end = index + telemetry.FRAME_SIZE
+        if telemetry.checksum(output, index + 2, end - 1) == output[end - 1]:
+            _, _, time_us, position, _, _, _ = struct.unpack_from(telemetry.FRAME_FORMAT,
+                                                                  output, index)
+            times.append(time_us / 1000)
+            positions.append(position)
+            index = output.find(sync, end)
+        else:
+            index = output.find(sync, index + 1)
+    return times, positions
+
+
+def parse_capture_dump(output):
+    """!
+        Extracts the samples of a bulk capture dump from the board's output
+        @param output Bytes written by the board
+        @return Tuple of lists (times in ms, positions in counts)
+    """
+    import capture
+
+    header = bytes((capture.CAPTURE_SYNC, capture.CAPTURE_MARKER))
+    header_size = struct.calcsize(capture.HEADER_FORMAT)
+    index = output.find(header)
+
+    # The header bytes can also occur inside the sample data, so take the
+    # first header followed by a complete dump
+    while index >= 0 and index + header_size <= len(output):
+        _, _, count, item_size = struct.unpack_from(capture.HEADER_FORMAT, output, index)
+        start = index + header_size
+        if item_size in (4, 8) and start + count * (2 * item_size + 4) <= len(output):
+            int_format = "<{}{}".format(count, "i" if item_size == 4 else "q")
+            times = struct.unpack_from(int_format, output, start)
+            positions = struct.unpack_from(int_format, output, start + count * item_size)
+            return [t / 1000 for t in times], list(positions)
+        index = output.find(header, index + 1)
+
+    return [], []
+
+
+def step_summary(times, positions, target):
+    """!
+        Computes basic step response figures without third party packages
+        @param times Sample times in ms
+        @param positions Sample positions
+        @param target Step size
+        @return Dictionary of rise time, overshoot, settling time and final error
+    """
+    if not times:
+        return {}
+
+    rise_start = rise_end = None
+    for t, x in zip(times, positions):
+        if rise_start is None and x >= 0.1 * target:
+            rise_start = t
+        if rise_end is None and x >= 0.9 * target:
+            rise_end = t
+            break
+
+    settle = None
+    for t, x in zip(reversed(times), reversed(positions)):
+        if abs(x - target) > 0.02 * abs(target):
+            break
+        settle = t
+
+    return {
+        "rise_ms": None if rise_end is None or rise_start is None else rise_end - rise_start,
+        "overshoot_pct": max(0.0, (max(positions) - target) / target * 100),
+        "settling_ms": settle,
+        "final_error": target - positions[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--main", default=os.path.join(SRC_DIR, "main.py"))
+    parser.add_argument("--kp", default="0.03", help="Gain sent to the board")
+    parser.add_argument("--duration", type=float, default=3.0, help="Simulated seconds")
+    parser.add_argument("--poll-cost", type=int, default=5,
+                        help="Simulated microseconds per clock read")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="Replace a constant in main.py with a Python literal")
+    parser.add_argument("--show-output", action="store_true",
+                        help="Echo everything the board printed")
+    parser.add_argument("--trace-heap", action="store_true",
+                        help="Model garbage filling the heap")
+    args = parser.parse_args()
+
+    overrides = {}
+    for assignment in args.set:
+        name, _, value = assignment.partition("=")
+        overrides[name.strip()] = ast.literal_eval(value.strip())
+
+    output, program, wall_s, motor = simulate(args.main,
+                                              commands=((100, args.kp + "\n"),),
+                                              duration_s=args.duration,
+                                              poll_cost_us=args.poll_cost,
+                                              overrides=overrides,
+                                              trace_heap=args.trace_heap)
+    if args.show_output:
+        print(output.decode(errors="replace"))
+
+    if program.get("CAPTURE_STEP_RESPONSE"):
+        times, positions = parse_capture_dump(output)
+    elif program.get("TELEMETRY_BINARY"):
+        times, positions = parse_telemetry_frames(output)
+    else:
+        times, positions = parse_step_lines(output)
+    axis = program["axes"][0]
+    target = axis.config["target"]
+    period_ms = axis.control_period_ms
+    control_ticks = args.duration * 1000 / period_ms
+
+    print("Simulated {:.3f} s in {:.3f} s wall ({:.1f}x real time)".format(
+        args.duration, wall_s, args.duration / wall_s))
+    print("Clock reads: {}, wall time per control period: {:.1f} us".format(
+        clock.reads, wall_s * 1e6 / control_ticks))
+    print("Samples: {}, final shaft position: {} counts".format(
+        len(times), motor.position_counts()))
+    for name, value in step_summary(times, positions, target).items():
+        print("{}: {}".format(name, value))
+
+    print("Sensor to actuator latency ({}): {}".format(axis.loop_mode, axis.probe.stats))
+    if axis.loop_mode == "timer":
+        print("Timer jitter: {}".format(axis.loop.jitter))
+        print("Timer update time: {}".format(axis.loop.isr_time))
+    if args.trace_heap:
+        print("Collections: {}, {}".format(sim_gc.collections, program["collector"]))
+
+
+if __name__ == "__main__":
+    main()
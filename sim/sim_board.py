@@ -0,0 +1,153 @@
+"""! @file sim_board.py
+
+Host-side stand-in for a board on a serial port, so the PC tools can drive
+simulated boards alongside or instead of real ones. SimulatedBoard has the
+parts of the pyserial Serial interface the tools use. The simulator cannot be
+paused to wait for the next command, so each test is a whole simulated
+session. Lines that change a setting, such as "period controller 20", are
+kept and sent again at the start of every session. A line that starts a test,
+gains or "start", runs main.py through a session in a worker process, and
+everything the board wrote becomes readable when the session ends. Lines that
+only print, such as "stats", therefore print in the next session.
+
+Each board has its own worker process, as the simulator keeps its clock and
+hardware in module globals, so several boards simulate at the same time.
+"""
+
+import concurrent.futures
+import os
+import time
+import run_sim
+
+
+## Simulated time before the first command of a session is sent, in ms
+BOOT_MS = 50
+
+## Simulated time between the commands of a session, in ms
+COMMAND_SPACING_MS = 10
+
+## Simulated time a session runs on after its test starts, in ms; longer than
+## TIMEOUT_MS in main.py, so the run ends and its data is sent
+RUN_MS = 2500
+
+
+def _is_test_command(line):
+    if line.split(" ")[0] == "start":
+        return True
+    try:
+        float(line.split(",")[0])
+    except ValueError:
+        return False
+    return True
+
+
+def _session(main_path, commands, duration_s, overrides):
+    # Runs in the worker process; only the output can be sent back
+    output, _, _, _ = run_sim.simulate(main_path, commands=commands,
+                                       duration_s=duration_s, overrides=overrides)
+    return output
+
+
+class SimulatedBoard:
+    """!
+    Simulated board behind a pyserial-like interface
+    """
+
+    def __init__(self, name="sim", main_path=os.path.join(run_sim.SRC_DIR, "main.py"),
+                 overrides=None, timeout=0.1):
+        """!
+            Starts the worker process of a board
+            @param name Name of the board, in place of a serial device name
+            @param main_path Path of the program the board runs
+            @param overrides Dictionary of module level constants of the
+                program to replace, as for run_sim.simulate
+            @param timeout Longest time read() waits for data, in seconds
+        """
+        ## Name of the board, like the device name of a serial port
+        self.port = name
+        self.timeout = timeout
+        self.is_open = True
+        self.__main_path = main_path
+        self.__overrides = overrides
+        self.__settings = []
+        self.__output = bytearray()
+        self.__session = None
+        self.__executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+
+
+    def __collect(self, wait_s=0):
+        # Moves the output of a finished session into the read buffer
+        if self.__session is None:
+            return
+        try:
+            output = self.__session.result(timeout=wait_s)
+        except concurrent.futures.TimeoutError:
+            return
+        self.__session = None
+        self.__output.extend(output)
+
+
+    @property
+    def in_waiting(self):
+        """!
+            @return Number of bytes that can be read without waiting
+        """
+        self.__collect()
+        return len(self.__output)
+
+
+    def write(self, data):
+        """!
+            Sends lines to the board. Setting lines are kept for every later
+            session and a test line starts a new session.
+            @param data Bytes of one or more lines
+            @return Number of bytes written
+        """
+        for line in data.decode().splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if not _is_test_command(line):
+                self.__settings.append(line)
+                continue
+
+            lines = self.__settings + [line]
+            commands = [(BOOT_MS + index * COMMAND_SPACING_MS, text + "\n")
+                        for index, text in enumerate(lines)]
+            duration_s = (commands[-1][0] + RUN_MS) / 1000
+            self.__collect(None)
+            self.__session = self.__executor.submit(_session, self.__main_path, commands,
+                                                    duration_s, self.__overrides)
+        return len(data)
+
+
+    def read(self, size=1):
+        """!
+            Reads what the board has written, waiting up to the timeout for a
+            session to finish if nothing is waiting
+            @param size Largest number of bytes to read
+            @return Bytes read, empty if none arrived in time
+        """
+        if not self.__output:
+            if self.__session is not None:
+                self.__collect(self.timeout)
+            elif self.timeout:
+                time.sleep(self.timeout)
+        chunk = bytes(self.__output[:size])
+        del self.__output[:size]
+        return chunk
+
+
+    def reset_input_buffer(self):
+        """!
+            Discards everything written by the board and not read yet
+        """
+        self.__output.clear()
+
+
+    def close(self):
+        """!
+            Stops the worker process, abandoning a session still running
+        """
+        self.is_open = False
+        self.__executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,104 @@
+"""! @file sim_clock.py
+
+Virtual clock shared by the host-side simulation modules. Simulated time only
+moves forward when code reads the clock or sleeps, so the scheduler and every
+task generator run unmodified but many times faster than real time.
+"""
+
+import heapq
+
+
+## Mask applied to tick values, matching MicroPython's 30 bit tick counters
+TICKS_MAX = (1 << 30) - 1
+## Half of the tick period, used to resolve wrapped tick differences
+TICKS_HALF = (TICKS_MAX + 1) // 2
+
+
+class VirtualClock:
+    """!
+    Monotonic microsecond clock driven by the code that reads it.
+    Every read costs a configurable number of simulated microseconds, which
+    stands in for the time the board would spend executing between two reads.
+    Events may be scheduled at absolute simulated times and are fired as the
+    clock passes them.
+    """
+
+    def __init__(self, poll_cost_us=5):
+        """!
+            Creates a clock starting at time zero
+            @param poll_cost_us Simulated time in microseconds added on every read
+        """
+        self.poll_cost_us = poll_cost_us
+        self.reset()
+
+
+    def reset(self):
+        """!
+            Returns the clock to time zero and drops all pending events
+        """
+        self.now_us = 0
+        self.reads = 0
+        self.stop_us = None
+        self.__events = []
+        self.__sequence = 0
+        self.__firing = False
+
+
+    def stop_at(self, time_us):
+        """!
+            Raises KeyboardInterrupt once the clock passes the given time,
+            exactly as if Ctrl-C had been pressed on the REPL
+            @param time_us Absolute simulated time in microseconds, or None to run forever
+        """
+        self.stop_us = time_us
+
+
+    def call_at(self, time_us, function):
+        """!
+            Schedules a function to be called once the clock reaches a time
+            @param time_us Absolute simulated time in microseconds
+            @param function Callable taking no arguments
+        """
+        heapq.heappush(self.__events, (time_us, self.__sequence, function))
+        self.__sequence += 1
+
+
+    def advance(self, delta_us):
+        """!
+            Moves the clock forward, firing any events that come due
+            @param delta_us Number of simulated microseconds to advance
+        """
+        target = self.now_us + delta_us
+
+        # Events are fired at their own timestamps so that callbacks which read
+        # the clock see the time they were scheduled for
+        while self.__events and self.__events[0][0] <= target and not self.__firing:
+            event_time, _, function = heapq.heappop(self.__events)
+            if event_time > self.now_us:
+                self.now_us = event_time
+            self.__firing = True
+            try:
+                function()
+            finally:
+                self.__firing = False
+
+        if target > self.now_us:
+            self.now_us = target
+
+        if self.stop_us is not None and self.now_us >= self.stop_us:
+            self.stop_us = None
+            raise KeyboardInterrupt
+
+
+    def read_us(self):
+        """!
+            Reads the clock, charging the configured poll cost
+            @return Current simulated time in microseconds
+        """
+        self.reads += 1
+        self.advance(self.poll_cost_us)
+        return self.now_us
+
+
+## Clock instance shared by the simulated pyb and utime modules
+clock = VirtualClock()
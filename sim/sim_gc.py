@@ -0,0 +1,104 @@
+"""! @file sim_gc.py
+
+Host-side stand-in for the MicroPython gc module. CPython's gc is built in,
+so a file named gc.py on the path would never be imported; run_sim installs
+this module in sys.modules under that name instead. Anything it does not
+define is taken from CPython's gc.
+
+MicroPython keeps garbage on the heap until a collection, while CPython frees
+most objects as soon as they are dropped. When tracemalloc is tracing, every
+call to mem_alloc() or mem_free() adds the most memory allocated since the
+previous call to a simulated pile of garbage, which only collect() clears.
+That includes CPython's own temporary objects, such as the integer returned
+by every clock read, which MicroPython does not allocate, so the simulated
+heap fills much faster than the board's. The figures show which code
+allocates and exercise garbage collection rather than predict the board.
+Without tracing, the heap reads as empty. collect() advances the simulated
+clock by a fixed pause, and so does the automatic collection run when the
+garbage fills the heap, wherever the code happens to be.
+"""
+
+import gc as _host_gc
+import tracemalloc
+from sim_clock import clock
+
+
+## Size of the simulated heap in bytes, about what MicroPython has on the NUCLEO-L476RG
+HEAP_BYTES = 96 * 1024
+
+## Simulated duration of one collection in microseconds; an assumed figure,
+## not one measured on the board
+COLLECT_US = 2000
+
+_garbage = 0
+_enabled = True
+## Number of collections run
+collections = 0
+
+
+def __getattr__(name):
+    return getattr(_host_gc, name)
+
+
+def _update():
+    global _garbage, collections
+    if not tracemalloc.is_tracing():
+        return 0
+    current, peak = tracemalloc.get_traced_memory()
+    _garbage += peak - current
+    tracemalloc.reset_peak()
+    if _garbage >= HEAP_BYTES:
+        # Out of heap, so MicroPython would collect inside the allocation
+        _garbage -= HEAP_BYTES
+        collections += 1
+        clock.advance(COLLECT_US)
+    return _garbage
+
+
+def mem_alloc():
+    """!
+        @return Simulated bytes of garbage on the heap
+    """
+    return _update()
+
+
+def mem_free():
+    """!
+        @return Simulated bytes of heap free
+    """
+    return HEAP_BYTES - mem_alloc()
+
+
+def collect():
+    """!
+        Clears the simulated garbage, taking COLLECT_US of simulated time
+    """
+    global _garbage, collections
+    _update()
+    _garbage = 0
+    collections += 1
+    clock.advance(COLLECT_US)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def isenabled():
+    return _enabled
+
+
+def reset():
+    """!
+        Empties the simulated heap, for a new simulation
+    """
+    global _garbage, collections
+    _update()
+    _garbage = 0
+    collections = 0
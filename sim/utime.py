@@ -0,0 +1,74 @@
+"""! @file utime.py
+
+Host-side stand-in for MicroPython's utime module. All functions are backed by
+the simulation's virtual clock rather than the wall clock.
+"""
+
+from sim_clock import clock, TICKS_MAX, TICKS_HALF
+
+
+def ticks_us():
+    """!
+        @return Simulated microseconds since start, wrapped like MicroPython ticks
+    """
+    return clock.read_us() & TICKS_MAX
+
+
+def ticks_ms():
+    """!
+        @return Simulated milliseconds since start, wrapped like MicroPython ticks
+    """
+    return (clock.read_us() // 1000) & TICKS_MAX
+
+
+def ticks_cpu():
+    """!
+        @return Highest resolution tick available, microseconds in the simulation
+    """
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    """!
+        @param ticks Tick value to offset
+        @param delta Signed offset to apply
+        @return Wrapped sum of the tick value and offset
+    """
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    """!
+        @param ticks1 Later tick value
+        @param ticks2 Earlier tick value
+        @return Signed difference between two tick values, accounting for wrap
+    """
+    return ((ticks1 - ticks2 + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+
+def sleep_us(us):
+    """!
+        @param us Simulated microseconds to sleep for
+    """
+    clock.advance(us)
+
+
+def sleep_ms(ms):
+    """!
+        @param ms Simulated milliseconds to sleep for
+    """
+    clock.advance(ms * 1000)
+
+
+def sleep(seconds):
+    """!
+        @param seconds Simulated seconds to sleep for
+    """
+    clock.advance(int(seconds * 1000000))
+
+
+def time():
+    """!
+        @return Simulated seconds since start
+    """
+    return clock.now_us // 1000000
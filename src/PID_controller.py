@@ -1,13 +1,41 @@
 """! @file PID_controller.py
 
-
+Contains a discrete PID controller with feed-forward, a filtered derivative
+acting on the measurement, integrator clamping with anti-windup, and output
+saturation. Gains are per sample: the integral is the running sum of Ki times
+the error and the derivative is the change in the measurement between runs.
+
+run() uses floating point. run_fixed() applies the same control law using only
+integer arithmetic with gains held in fixed point, so it does not allocate and
+may be called from an interrupt.
 """
 
+import math
 import platform
+import micropython
+from axis_state import STATE, POSITION, SETPOINT, POSITION_US, CONTROL_US, CONTROL, take_mean_position
 
 if "MicroPython" not in platform.platform():
     from me405_support import cotask, cqueue, task_share
 
+## Number of fractional bits in the gains used by run_fixed
+FIXED_SHIFT = 16
+## Number of fractional bits in the filtered derivative and its filter coefficient
+FILTER_SHIFT = 8
+## Largest magnitude allowed for intermediate products in run_fixed, keeping
+## them within MicroPython's small integers so they never allocate
+FIXED_LIMIT = (1 << 30) - 1
+## Output and integrator limit used by run_fixed when none is given
+FIXED_DEFAULT_LIMIT = 1 << 12
+
+def _finite(value, name):
+    # Rejects infinite and NaN gains before they are stored, since neither has
+    # a fixed point form and either would poison the floating point output
+    if not math.isfinite(value):
+        raise ValueError("{} must be finite, not {}".format(name, value))
+    return value
+
+
 class PIDController:
     """
     Class representing a PID controller with feed-forward compensation
@@ -19,10 +47,15 @@ class PIDController:
             Setup for the PID controller
 
             @param init_target Initial target value for the PID value to use
-            @param Kp Proportional gain 
-            @param Ki Integral gain 
-            @param Kd Derivative gain 
-            @param Kf Feed-forward gain 
+            @param Kp Proportional gain
+            @param Ki Integral gain
+            @param Kd Derivative gain
+            @param Kf Feed-forward gain, applied to the target value
+            @param out_min Lowest controller output, or None for no limit
+            @param out_max Highest controller output, or None for no limit
+            @param i_limit Largest magnitude of the integral term, or None for no limit
+            @param d_filter Derivative low pass filter coefficient between 0 and 1.
+                1 disables filtering; smaller values filter more heavily.
         """
 
         self.__Kp = Kp
@@ -30,7 +63,75 @@ class PIDController:
         self.__Kd = kwargs.get('Kd', 0)
         self.__Kf = kwargs.get('Kf', 0)
         self.__target_value = init_target
-        self.__accumulated_err  = 0
+        self.__out_min = kwargs.get('out_min', None)
+        self.__out_max = kwargs.get('out_max', None)
+        self.__i_limit = kwargs.get('i_limit', None)
+        self.__d_filter = kwargs.get('d_filter', 1)
+        self.__feedforward = 0
+        self.__capture = None
+        self.__capture_positions = False
+        self.__probe = None
+        self.__profile = None
+
+        self.__update_fixed()
+        self.reset()
+
+
+    def __update_fixed(self):
+        """
+            Recomputes the fixed point gains and limits used by run_fixed
+        """
+        scale = 1 << FIXED_SHIFT
+
+        self.__Kp_fixed = int(self.__Kp * scale)
+        self.__Ki_fixed = int(self.__Ki * scale)
+        self.__Kd_fixed = int(self.__Kd * scale)
+        self.__Kf_fixed = int(self.__Kf * scale)
+        self.__d_filter_fixed = int(self.__d_filter * (1 << FILTER_SHIFT))
+        self.__target_int = int(self.__target_value)
+
+        self.__out_min_int = -FIXED_DEFAULT_LIMIT if self.__out_min is None else int(self.__out_min)
+        self.__out_max_int = FIXED_DEFAULT_LIMIT if self.__out_max is None else int(self.__out_max)
+        i_limit = FIXED_DEFAULT_LIMIT if self.__i_limit is None else int(self.__i_limit)
+        self.__i_limit_fixed = min(i_limit, FIXED_DEFAULT_LIMIT) << FIXED_SHIFT
+
+        # Operands are clamped so no product can exceed FIXED_LIMIT. Past these
+        # limits a term already far exceeds any usable output.
+        self.__p_error_limit = FIXED_LIMIT // max(abs(self.__Kp_fixed), 1)
+        self.__i_error_limit = (FIXED_LIMIT >> 1) // max(abs(self.__Ki_fixed), 1)
+        self.__d_state_limit = FIXED_LIMIT // max(abs(self.__Kd_fixed), 1)
+        self.__d_input_limit = FIXED_LIMIT >> (2 * FILTER_SHIFT + 2)
+        self.__ff_target_limit = FIXED_LIMIT // max(abs(self.__Kf_fixed), 1)
+        self.__update_ff_int()
+
+
+    def __update_ff_int(self):
+        """
+            Recomputes the fixed point feed-forward on the setpoint from the
+            integer setpoint, so a new setpoint does not allocate
+        """
+        target = self.__target_int
+        limit = self.__ff_target_limit
+        if target > limit:
+            target = limit
+        elif target < -limit:
+            target = -limit
+        self.__ff_int = (target * self.__Kf_fixed) >> FIXED_SHIFT
+
+
+    def reset(self):
+        """
+            Clears the integral and derivative history and the feed-forward
+            value, as at the start of a run
+        """
+        self.__integral = 0
+        self.__feedforward = 0
+        self.__d_filtered = 0
+        self.__last_value = None
+        self.__integral_fixed = 0
+        self.__d_filtered_fixed = 0
+        self.__last_int = 0
+        self.__started_fixed = False
 
 
     def set_setpoint(self, target):
@@ -40,6 +141,25 @@ class PIDController:
             @param target Target value for the PID value to use
         """
         self.__target_value = target
+        self.__target_int = int(target)
+        self.__update_ff_int()
+
+    def get_setpoint(self):
+        """
+            Returns the setpoint, truncated to an integer so reading it does not allocate
+
+            @return Setpoint as an integer
+        """
+        return self.__target_int
+
+    def set_feedforward(self, feedforward):
+        """
+            Changes a feed-forward value added to the controller output, such as
+            one from a motion profile
+
+            @param feedforward Integer feed-forward in controller output units
+        """
+        self.__feedforward = feedforward
 
     def set_Kp(self, Kp):
         """
@@ -47,7 +167,8 @@ class PIDController:
 
             @param Kp Proportional gain
         """
-        self.__Kp = Kp
+        self.__Kp = _finite(Kp, "Kp")
+        self.__update_fixed()
 
     def set_Ki(self, Ki):
         """
@@ -55,7 +176,8 @@ class PIDController:
 
             @param Ki Integral gain
         """
-        self.__Ki = Ki
+        self.__Ki = _finite(Ki, "Ki")
+        self.__update_fixed()
 
     def set_Kd(self, Kd):
         """
@@ -63,7 +185,8 @@ class PIDController:
 
             @param Kd Derivative gain
         """
-        self.__Kd = Kd
+        self.__Kd = _finite(Kd, "Kd")
+        self.__update_fixed()
 
     def set_Kf(self, Kf):
         """
@@ -71,7 +194,73 @@ class PIDController:
 
             @param Kf Feed-forward gain
         """
-        self.__Kf = Kf
+        self.__Kf = _finite(Kf, "Kf")
+        self.__update_fixed()
+
+    def set_output_limits(self, out_min, out_max):
+        """
+            Changes the range the controller output is saturated to
+
+            @param out_min Lowest controller output, or None for no limit
+            @param out_max Highest controller output, or None for no limit
+        """
+        self.__out_min = out_min
+        self.__out_max = out_max
+        self.__update_fixed()
+
+    def set_integral_limit(self, i_limit):
+        """
+            Changes the largest magnitude of the integral term
+
+            @param i_limit Integral term limit, or None for no limit
+        """
+        self.__i_limit = i_limit
+        self.__update_fixed()
+
+    def set_derivative_filter(self, d_filter):
+        """
+            Changes the derivative low pass filter coefficient
+
+            @param d_filter Coefficient between 0 and 1, where 1 disables filtering
+        """
+        self.__d_filter = d_filter
+        self.__update_fixed()
+
+    def get_gains(self):
+        """
+            Returns the gains used by the controller
+
+            @return Tuple of (Kp, Ki, Kd, Kf)
+        """
+        return (self.__Kp, self.__Ki, self.__Kd, self.__Kf)
+
+    def set_capture(self, capture, positions=False):
+        """
+            Records every output of run_task into a capture buffer
+
+            @param capture CaptureBuffer to record into, or None to stop recording
+            @param positions True to also record the latest position before
+                each output, for when the encoder is sampled faster than the
+                capture buffer can hold
+        """
+        self.__capture = capture
+        self.__capture_positions = positions
+
+    def set_probe(self, probe):
+        """
+            Marks every output of run_task on a latency probe
+
+            @param probe LatencyProbe to mark, or None to stop measuring
+        """
+        self.__probe = probe
+
+    def set_profile(self, profile):
+        """
+            Takes the setpoint of every run of run_task from a motion profile
+
+            @param profile MotionProfile to play back, or None to hold the setpoint
+        """
+        self.__profile = profile
 
     def run(self, current_value):
 
@@ -80,58 +269,159 @@ class PIDController:
 
             @param current_value Current value of the system being controlled.
                 Should be the same units as the target value.
+            @return Controller output
         """
 
         error = self.__target_value - current_value
 
-        self.__accumulated_err += error
-        
+        # derivative of the measurement rather than the error, so setpoint
+        # steps do not kick the output
+        if self.__last_value is None:
+            self.__last_value = current_value
+        self.__d_filtered += self.__d_filter * ((self.__last_value - current_value) - self.__d_filtered)
+        self.__last_value = current_value
+
+        integral = self.__integral + error * self.__Ki
+        if self.__i_limit is not None:
+            if integral > self.__i_limit:
+                integral = self.__i_limit
+            elif integral < -self.__i_limit:
+                integral = -self.__i_limit
+
+        control_value = (error * self.__Kp + integral
+                         + self.__d_filtered * self.__Kd
+                         + self.__target_value * self.__Kf
+                         + self.__feedforward)
+
+        # anti-windup: the integral only grows while the output is not
+        # saturated in the direction the error is pushing it
+        if self.__out_max is not None and control_value > self.__out_max:
+            control_value = self.__out_max
+            if error < 0:
+                self.__integral = integral
+        elif self.__out_min is not None and control_value < self.__out_min:
+            control_value = self.__out_min
+            if error > 0:
+                self.__integral = integral
+        else:
+            self.__integral = integral
 
-        #proportional control
-        kp_component = error  * self.__Kp
+        return control_value
+
+
+    @micropython.native
+    def run_fixed(self, current_value):
+
+        """
+            Function to run an iteration of the controller using only integer
+            arithmetic, so it does not allocate and may be called from an
+            interrupt. Applies the same control law as run with the gains
+            rounded to FIXED_SHIFT fractional bits. Every term is truncated to
+            an integer, and when no limits are given the output and integral
+            are limited to FIXED_DEFAULT_LIMIT.
+
+            @param current_value Current integer value of the system being controlled.
+            @return Integer controller output
+        """
+
+        error = self.__target_int - current_value
+
+        if not self.__started_fixed:
+            self.__last_int = current_value
+            self.__started_fixed = True
+
+        d_input = self.__last_int - current_value
+        self.__last_int = current_value
+        limit = self.__d_input_limit
+        if d_input > limit:
+            d_input = limit
+        elif d_input < -limit:
+            d_input = -limit
+        d_filtered = self.__d_filtered_fixed
+        d_filtered += (((d_input << FILTER_SHIFT) - d_filtered) * self.__d_filter_fixed) >> FILTER_SHIFT
+        self.__d_filtered_fixed = d_filtered
+        d_value = d_filtered >> FILTER_SHIFT
+        limit = self.__d_state_limit
+        if d_value > limit:
+            d_value = limit
+        elif d_value < -limit:
+            d_value = -limit
+
+        limit = self.__p_error_limit
+        p_error = error
+        if p_error > limit:
+            p_error = limit
+        elif p_error < -limit:
+            p_error = -limit
+
+        limit = self.__i_error_limit
+        i_error = error
+        if i_error > limit:
+            i_error = limit
+        elif i_error < -limit:
+            i_error = -limit
+        integral = self.__integral_fixed + i_error * self.__Ki_fixed
+        limit = self.__i_limit_fixed
+        if integral > limit:
+            integral = limit
+        elif integral < -limit:
+            integral = -limit
+
+        control_value = (((p_error * self.__Kp_fixed) >> FIXED_SHIFT)
+                         + (integral >> FIXED_SHIFT)
+                         + ((d_value * self.__Kd_fixed) >> FIXED_SHIFT)
+                         + self.__ff_int + self.__feedforward)
+
+        if control_value > self.__out_max_int:
+            control_value = self.__out_max_int
+            if error < 0:
+                self.__integral_fixed = integral
+        elif control_value < self.__out_min_int:
+            control_value = self.__out_min_int
+            if error > 0:
+                self.__integral_fixed = integral
+        else:
+            self.__integral_fixed = integral
 
-        ki_component = self.__accumulated_err * self.__Ki
-        
-        
-        control_value = kp_component + ki_component
-        
         return control_value
-    
 
-    def run_task(self, shares):
+
+    def run_task(self, state):
 
         """
-            Function to run an iteration of the controller
+            Function to run an iteration of the controller on the position
 
-            @param current_value Current value of the system being controlled.
-                Should be the same units as the target value.
+            @param state AxisState whose STATE field enables the task. The
+                controller runs on the mean of the positions sampled since its
+                last run, see axis_state.take_mean_position, and puts its output
+                in CONTROL, its setpoint in SETPOINT, and the sample time of the
+                latest position in CONTROL_US.
         """
 
-        current_value_share, control_value_share, task_state_share = shares
+        ints = state.ints
+        floats = state.floats
 
         while True:
 
-            state = task_state_share.get()
-
-            if state == 0:
+            if ints[STATE] == 0:
                 pass
 
             else:
-                current_value = current_value_share.get()
+                if self.__profile is not None:
+                    self.__profile.apply(self)
+
+                control_value = self.run(take_mean_position(ints))
 
-                error = self.__target_value - current_value
+                floats[CONTROL] = control_value
+                ints[SETPOINT] = self.__target_int
+                ints[CONTROL_US] = ints[POSITION_US]
 
-                #self.__accumulated_err += error
-                
+                if self.__probe is not None:
+                    self.__probe.computed()
 
-                #proportional control
-                kp_component = error  * self.__Kp
+                if self.__capture is not None:
+                    if self.__capture_positions:
+                        self.__capture.record_position(ints[POSITION])
+                    self.__capture.record_control(control_value)
 
-                #ki_component = self.__accumulated_err * self.__Ki
-                
-                
-                control_value = kp_component #+ ki_component
-                
-                control_value_share.put(control_value)
-        
-            yield 0 
\ No newline at end of file
+            yield 0
@@ -0,0 +1,376 @@
+"""! @file axis.py
+
+Builds a complete motor axis (motor driver, encoder, PID controller, state
+block, control loop and cotask tasks) from one entry of a declarative axis table, so
+main.py can run any number of axes without repeating setup code. Each task of
+an axis is instrumented with timing_stats.TaskStats, so the CPU budget used by
+every axis can be reported. The tasks of an axis share its values through one
+axis_state.AxisState block, whose STATE field enable(), start_run() and stop()
+set.
+
+An axis table entry is a dictionary with these keys:
+- "name": prefix for task names, such as "motor1"
+- "motor": dictionary of "en_pin", "in1_pin", "in1_timer", "in1_channel",
+  "in2_pin", "in2_timer", "in2_channel" and "pwm_freq" for MotorDriver
+- "encoder": dictionary of "pin_a", "pin_b", "timer" and "af" for Encoder, and
+  optionally "velocity_tau_us" and "low_speed" for its velocity estimate
+- "controller": keyword arguments for PIDController, including "Kp"
+- "target": initial setpoint in encoder ticks
+- "loop_mode": "split", "fused", "timer" or "cascade", see control_loop.py
+- "tasks": dictionary mapping "motor", "encoder", "controller", "loop", and for
+  "cascade" mode "inner" and "outer", to (priority, period in ms) tuples; with
+  rate-monotonic scheduling the priority only orders tasks of equal period.
+  In "split" mode the "encoder" period is the sample period and the
+  "controller" period the control period. An optional "sampler" entry gives
+  "fused" and "cascade" modes a task sampling the encoder at its own period.
+- "sample_filter": how the controller turns the samples taken since its last
+  run into one position, "mean" (the default) or "last"; see axis_state.py
+- "cascade": for "cascade" mode, a dictionary of "position" and "velocity"
+  keyword arguments for the outer position and inner velocity PIDControllers,
+  used in place of "controller". The position controller output is a velocity
+  in ticks per second, so its output limits set the largest speed.
+- "profile": optional dictionary describing how runs move to "target", with
+  "type" of "step", "trapezoid" or "s_curve", "max_velocity" in ticks per
+  second, "max_acceleration" in ticks per second squared, "max_jerk" in ticks
+  per second cubed for "s_curve", "velocity_ff", the duty cycle per tick per
+  second of planned velocity fed forward, and "acceleration_ff", the duty
+  cycle per tick per second squared of planned acceleration fed forward. In
+  "cascade" mode the planned velocity alone is fed forward to the velocity loop.
+- "loop_timer" and "loop_freq": timer number and rate in Hz for "timer" mode
+- "record": True to record this axis into a capture buffer
+"""
+
+import platform
+import cotask
+import PID_controller
+import encoder_reader
+import control_loop
+import capture
+import motion_profile
+from axis_state import AxisState, STATE, POSITION, POSITION_SUM, SAMPLE_COUNT
+from motor_driver import MotorDriver
+from timing_stats import TaskStats, timed
+
+if "MicroPython" not in platform.platform():
+    from me405_support import cotask, cqueue, task_share
+
+
+class Axis:
+    """!
+    One motor, its encoder and its controller, with the tasks that run them
+    """
+
+    def __init__(self, config, duration_ms):
+        """!
+            Creates the drivers, state block and tasks of an axis and puts the motor in a safe state
+            @param config Axis table entry
+            @param duration_ms Length of a recorded run in ms, used to size the capture buffer
+        """
+        ## Axis table entry this axis was built from
+        self.config = config
+        ## Name prefix of the axis tasks
+        self.name = config["name"]
+        ## Control mode of the axis
+        self.loop_mode = config.get("loop_mode", "split")
+        ## Position, velocity, setpoint, output and run state shared by the axis tasks
+        self.state = AxisState(self.name)
+
+        motor = config["motor"]
+        ## Motor driver of the axis
+        self.motor = MotorDriver(motor["en_pin"],
+                                 motor["in1_pin"], motor["in1_timer"], motor["in1_channel"],
+                                 motor["in2_pin"], motor["in2_timer"], motor["in2_channel"],
+                                 motor["pwm_freq"])
+        self.motor.set_enable(1)
+        self.motor.set_duty_cycle(0)
+
+        encoder = config["encoder"]
+        ## Encoder measuring the motor position
+        self.encoder = encoder_reader.Encoder(encoder["pin_a"], encoder["pin_b"],
+                                              encoder["timer"], encoder["af"],
+                                              encoder.get("velocity_tau_us", 5000),
+                                              encoder.get("low_speed", True))
+        sample_filter = config.get("sample_filter", "mean")
+        if sample_filter not in ("mean", "last"):
+            raise ValueError("Unknown sample filter {}".format(sample_filter))
+        self.encoder.set_averaging(sample_filter == "mean")
+
+        ## Velocity PID controller of the inner loop in "cascade" mode, otherwise None
+        self.velocity_controller = None
+        if self.loop_mode == "cascade":
+            gains = dict(config["cascade"]["velocity"])
+            self.velocity_controller = PID_controller.PIDController(gains.pop("Kp"), 0, **gains)
+            gains = dict(config["cascade"]["position"])
+        else:
+            gains = dict(config["controller"])
+        ## PID controller of the axis, acting on position
+        self.controller = PID_controller.PIDController(gains.pop("Kp"), config["target"], **gains)
+
+        ## Fused read, control and actuate pipeline
+        if self.velocity_controller is None:
+            self.loop = control_loop.ControlLoop(self.encoder, self.controller, self.motor)
+        else:
+            self.loop = control_loop.ControlLoop(self.encoder, self.velocity_controller, self.motor,
+                                                 self.controller)
+        ## Sensor-to-actuator latency measurement
+        self.probe = control_loop.LatencyProbe()
+
+        # Task keys of the control updates and of the position controller
+        # updates; timer mode control updates are not a task
+        if self.loop_mode == "timer":
+            self.__control_key = None
+        elif self.loop_mode == "fused":
+            self.__control_key = "loop"
+        elif self.loop_mode == "cascade":
+            self.__control_key = "inner"
+        else:
+            self.__control_key = "controller"
+        self.__setpoint_key = "outer" if self.loop_mode == "cascade" else self.__control_key
+
+        ## Period of the control updates in ms
+        if self.__control_key is None:
+            self.control_period_ms = max(1, 1000 // config["loop_freq"])
+        else:
+            self.control_period_ms = config["tasks"][self.__control_key][1]
+
+        ## Period in ms of the encoder samples
+        if self.loop_mode == "split":
+            self.sample_period_ms = config["tasks"]["encoder"][1]
+        elif self.loop_mode != "timer" and "sampler" in config["tasks"]:
+            self.sample_period_ms = config["tasks"]["sampler"][1]
+        else:
+            self.sample_period_ms = self.control_period_ms
+
+        ## Period in ms of the updates of the position controller
+        if self.__setpoint_key is None:
+            self.setpoint_period_ms = self.control_period_ms
+        else:
+            self.setpoint_period_ms = config["tasks"][self.__setpoint_key][1]
+
+        ## Motion profile the position controller follows during a run, or
+        ## None to step straight to the target
+        self.profile = None
+        if config.get("profile", {}).get("type", "step") != "step":
+            self.profile = motion_profile.MotionProfile(duration_ms // self.setpoint_period_ms + 2)
+            if self.loop_mode == "split":
+                self.controller.set_profile(self.profile)
+            else:
+                self.loop.set_profile(self.profile)
+
+        ## Buffer recording the position and output during a run
+        self.capture = capture.CaptureBuffer(duration_ms, self.control_period_ms)
+        record = config.get("record", False)
+
+        ## Instrumentation of each task of the axis
+        self.task_stats = []
+        ## cotask tasks of the axis, to be added to the task list
+        self.tasks = []
+        # Task, statistics and shortest allowed period of each task, by task key
+        self.__task_keys = {}
+
+        if self.loop_mode in ("fused", "timer", "cascade"):
+            self.loop.set_probe(self.probe)
+            if record:
+                self.loop.set_capture(self.capture)
+            if self.loop_mode == "fused":
+                self.__add_task("loop", self.loop.run_task)
+            elif self.loop_mode == "cascade":
+                self.__add_task("inner", self.loop.run_task)
+                self.__add_task("outer", self.loop.outer_task)
+            if self.loop_mode != "timer" and "sampler" in config["tasks"]:
+                self.loop.set_sampler(self.state)
+                self.encoder.set_probe(self.probe)
+                self.__add_task("sampler", self.encoder.read_task)
+
+        else:
+            self.encoder.set_probe(self.probe)
+            self.controller.set_probe(self.probe)
+            self.motor.set_probe(self.probe)
+            if record and self.sample_period_ms < self.control_period_ms:
+                # More samples than the capture buffer holds, so record the
+                # latest one each time the controller runs
+                self.controller.set_capture(self.capture, positions=True)
+            elif record:
+                self.encoder.set_capture(self.capture)
+                self.controller.set_capture(self.capture)
+            # cotask releases a task one period after it is created, so tasks
+            # created in this order are also released encoder first each tick
+            self.__add_task("position", self.encoder.read_task, "encoder")
+            self.__add_task("controller", self.controller.run_task)
+            self.__add_task("speed", self.motor.set_duty_cycle_task, "motor")
+
+
+    def __add_task(self, suffix, task_function, key=None):
+        priority, period = self.config["tasks"][key or suffix]
+        name = "{}_{}_task".format(self.name, suffix)
+        stats = TaskStats(name, period)
+        self.task_stats.append(stats)
+        task = cotask.Task(timed(task_function, stats), name=name,
+                           priority=priority, period=period,
+                           profile=True, trace=False, shares=self.state)
+        self.tasks.append(task)
+        self.__task_keys[key or suffix] = (task, stats, period)
+
+
+    def set_period(self, key, period_ms):
+        """!
+            Changes the period of one task of the axis from its next release.
+            The capture buffer and motion profile are sized for the periods in
+            the axis table, so a task cannot be made faster than that.
+            @param key Task key of the axis table, such as "controller"
+            @param period_ms New period in ms
+        """
+        if key not in self.__task_keys:
+            raise KeyError("{} has no {} task".format(self.name, key))
+        task, stats, table_period_ms = self.__task_keys[key]
+        if period_ms < table_period_ms:
+            raise ValueError("{} {} period must be at least {} ms".format(
+                self.name, key, table_period_ms))
+
+        task.set_period(period_ms)
+        stats.period_us = period_ms * 1000
+        stats.reset()
+        if key == self.__control_key:
+            self.control_period_ms = period_ms
+        if key in ("encoder", "sampler"):
+            self.sample_period_ms = period_ms
+        if key == self.__setpoint_key:
+            self.setpoint_period_ms = period_ms
+
+
+    def begin(self):
+        """!
+            Starts timer driven updates in "timer" mode; call once before scheduling
+        """
+        if self.loop_mode == "timer":
+            self.loop.start_timer(self.config["loop_timer"], self.config["loop_freq"], self.state)
+
+
+    def start_run(self):
+        """!
+            Prepares a new run with prepare_run() and enables the axis tasks
+        """
+        self.prepare_run()
+        self.enable()
+
+
+    def prepare_run(self):
+        """!
+            Plans the move for a new run, then zeros the encoder and clears
+            the controller and capture history, leaving the axis tasks as they
+            are. Raises ValueError if the move cannot be planned, before
+            anything else is changed.
+        """
+        if self.profile is not None:
+            profile = self.config["profile"]
+            self.profile.plan(0, self.config["target"], self.setpoint_period_ms,
+                              profile["max_velocity"], profile["max_acceleration"],
+                              profile["type"], profile.get("max_jerk"),
+                              *((1, 0) if self.loop_mode == "cascade" else
+                                (profile.get("velocity_ff", 0), profile.get("acceleration_ff", 0))))
+        self.encoder.zero()
+        self.controller.reset()
+        if self.profile is None:
+            self.controller.set_setpoint(self.config["target"])
+        if self.velocity_controller is not None:
+            self.velocity_controller.reset()
+            self.velocity_controller.set_setpoint(0)
+        self.capture.start()
+        ints = self.state.ints
+        ints[POSITION] = 0
+        ints[POSITION_SUM] = 0
+        ints[SAMPLE_COUNT] = 0
+
+
+    def enable(self):
+        """!
+            Enables the axis tasks, running the move planned by prepare_run()
+        """
+        self.state.ints[STATE] = 1
+
+
+    def stop(self):
+        """!
+            Disables the axis tasks and stops the motor
+        """
+        self.state.ints[STATE] = 0
+        self.motor.set_duty_cycle(0)
+
+
+    def shutdown(self):
+        """!
+            Stops timer driven updates and the motor
+        """
+        self.loop.stop_timer()
+        self.motor.set_duty_cycle(0)
+
+
+    def interrupts(self):
+        """!
+            @return List of (name, period in us) of the interrupts the axis
+                runs outside of cotask, for schedule.check()
+        """
+        if self.loop_mode == "timer":
+            return [(self.name + "_loop_isr", 1000000 // self.config["loop_freq"])]
+        return []
+
+
+    def interrupt_run_times(self):
+        """!
+            @return Dictionary of the worst measured run time in us of each
+                interrupt in interrupts() that has run
+        """
+        if self.loop_mode == "timer" and self.loop.isr_time.count:
+            return {self.name + "_loop_isr": self.loop.isr_time.maximum}
+        return {}
+
+
+    def cpu_utilization(self):
+        """!
+            @return Tuple of the mean and worst case fraction of CPU time used
+                by the axis, from measured task run times
+        """
+        mean = 0
+        worst = 0
+        for stats in self.task_stats:
+            mean += stats.run_time.mean() / stats.period_us
+            worst += stats.run_time.maximum / stats.period_us
+
+        if self.loop_mode == "timer":
+            period_us = 1000000 / self.config["loop_freq"]
+            mean += self.loop.isr_time.mean() / period_us
+            worst += self.loop.isr_time.maximum / period_us
+
+        return mean, worst
+
+
+def build_axes(table, duration_ms):
+    """!
+        Builds every axis in an axis table
+        @param table List of axis table entries; entries with "enabled" set to False are skipped
+        @param duration_ms Length of a recorded run in ms
+        @return List of Axis objects
+    """
+    return [Axis(config, duration_ms)
+            for config in table if config.get("enabled", True)]
+
+
+def budget_report(axes):
+    """!
+        Summarizes the CPU time used by each axis and how many such axes would fit
+        @param axes List of Axis objects that have been running
+        @return Report as a string
+    """
+    lines = []
+    total_mean = 0
+    total_worst = 0
+    for each in axes:
+        mean, worst = each.cpu_utilization()
+        total_mean += mean
+        total_worst += worst
+        lines.append("{:<10s} {:<6s} {:>3d} ms  mean {:5.1f} %  worst {:5.1f} %  fits {} axes".format(
+            each.name, each.loop_mode, each.control_period_ms, mean * 100, worst * 100,
+            int(1 / worst) if worst > 0 else "-"))
+    lines.append("{:<10s} {:<6s} {:>6s}  mean {:5.1f} %  worst {:5.1f} %".format(
+        "total", "", "", total_mean * 100, total_worst * 100))
+    return "\n".join(lines)
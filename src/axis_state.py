@@ -0,0 +1,102 @@
+"""! @file axis_state.py
+
+Control state of one motor axis, held in a single preallocated block in place
+of a task_share.Share for each value. The block is two arrays, one of signed
+32 bit integers and one of floats. Tasks and the timer interrupt read and
+write the fields by the fixed indices below, for example
+state.ints[POSITION] = position. An access is a single array index, with no
+method call, type check or interrupt locking, and storing an integer or a
+float into a field never allocates.
+
+Every field is one 32 bit word, which the Cortex-M4 reads and writes with a
+single instruction. A reader can therefore never see a field half written by
+an interrupt, and the block is safe to hand to an interrupt handler. Each
+field is atomic on its own, though, not a group of fields. A task that needs
+a position and its timestamp from the same update must read them with
+interrupts disabled.
+
+POSITION_SUM and SAMPLE_COUNT let the encoder be sampled faster than the
+controller runs. The sampling task adds each position to the sum, and the
+controller takes the mean of the window with take_mean_position(), which
+starts the next one. The controller then acts on one decimated estimate made
+from every sample since its last run, at whatever rate it is set to.
+"""
+
+from array import array
+
+
+## Index in AxisState.ints of the run state; the axis tasks only run while it is nonzero
+STATE = 0
+## Index in AxisState.ints of the position in encoder ticks
+POSITION = 1
+## Index in AxisState.ints of the velocity in encoder ticks per second
+VELOCITY = 2
+## Index in AxisState.ints of the position setpoint in encoder ticks
+SETPOINT = 3
+## Index in AxisState.ints of the utime.ticks_us() time at which POSITION was sampled
+POSITION_US = 4
+## Index in AxisState.ints of the sample time of the position CONTROL was computed from
+CONTROL_US = 5
+## Index in AxisState.ints of the sum of the positions sampled since the last take_mean_position()
+POSITION_SUM = 6
+## Index in AxisState.ints of the number of positions in POSITION_SUM
+SAMPLE_COUNT = 7
+## Number of integer fields
+INT_COUNT = 8
+
+## Smallest and largest values an integer field holds, those of a signed 32
+## bit array element
+INT_MIN = -(1 << 31)
+INT_MAX = (1 << 31) - 1
+
+## Most samples summed into one window; a sampler that is not being consumed
+## starts a new window instead, so POSITION_SUM stays within 32 bits for
+## positions up to 2**25 ticks
+MAX_SAMPLES = 64
+
+## Index in AxisState.floats of the controller output, the motor duty cycle in percent
+CONTROL = 0
+## Number of float fields
+FLOAT_COUNT = 1
+
+
+class AxisState:
+    """!
+    Preallocated block of the control state of one axis
+    """
+
+    def __init__(self, name):
+        """!
+            Creates a block with every field zero
+            @param name Name of the axis, used when printing
+        """
+        self.name = name
+        ## Integer fields, indexed by STATE, POSITION, VELOCITY, SETPOINT,
+        ## POSITION_US, CONTROL_US, POSITION_SUM and SAMPLE_COUNT
+        self.ints = array('l', (0 for _ in range(INT_COUNT)))
+        ## Float fields, indexed by CONTROL
+        self.floats = array('f', (0 for _ in range(FLOAT_COUNT)))
+
+
+    def __repr__(self):
+        ints = self.ints
+        return "{}: state {} position {} velocity {} setpoint {} control {}".format(
+            self.name, ints[STATE], ints[POSITION], ints[VELOCITY], ints[SETPOINT],
+            self.floats[CONTROL])
+
+
+def take_mean_position(ints):
+    """!
+        Decimates the positions sampled since the last call into their mean
+        and starts a new window
+        @param ints Integer fields of an AxisState
+        @return Mean position in encoder ticks, or the POSITION field if no
+            positions were summed since the last call
+    """
+    count = ints[SAMPLE_COUNT]
+    if count == 0:
+        return ints[POSITION]
+    mean = ints[POSITION_SUM] / count
+    ints[POSITION_SUM] = 0
+    ints[SAMPLE_COUNT] = 0
+    return mean
@@ -0,0 +1,324 @@
+"""! @file bench_host.py
+
+Drives a bench of several boards from one process on a PC. Every board stays
+connected for the whole session, and an asyncio task per board reads all it
+sends as it arrives, so commands and step response tests go to every board at
+once with no reconnect before each test. Serial reads block, so each board is
+read in a worker thread of its own. Boards can also be simulated, with sim/ on
+the path, see sim/sim_board.py.
+
+The runs of all boards are merged into one table of samples, each with its
+board, its board time and a host time. The host time is the time.monotonic()
+time the run command was sent, counted from the start of the session, plus
+the board time since the first sample of the run. It leaves out the delay of
+the serial link and of the board reading the command, so it lines boards up
+to within a few milliseconds.
+
+Usage: python src/bench_host.py --port COM6 --port COM7 [--sim 2]
+                                [--send "period controller 20"]
+                                --run 0.03 [--run 0.03,0.0001,0]
+                                [--stream] [--text] [--target 16384] [--wait 5]
+                                [--out bench.npz] [--archive runs]
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import time
+import numpy
+import serial
+import display
+import gain_sweep
+import run_archive
+
+
+## Most bytes kept from a board while no test is running, so a board printing
+## between tests does not fill memory
+IDLE_BYTES = 65536
+
+## Layout of one merged sample
+SAMPLE_DTYPE = numpy.dtype([("board", "u2"),
+                            ("run", "u4"),
+                            ("host_s", "f8"),
+                            ("time_ms", "f8"),
+                            ("position", "f8"),
+                            ("control", "f8")])
+
+
+class Board:
+    """!
+    @brief Persistent connection to one board, read continuously by an asyncio task.
+    """
+
+    def __init__(self, name, port, clock_start_s):
+        """!
+        @brief Wrap an open port; call start() from the event loop to begin reading.
+        @param name Name of the board used in results
+        @param port Open serial port with a read timeout set, or a stand-in
+            such as sim_board.SimulatedBoard
+        @param clock_start_s time.monotonic() time the session started, which
+            host times are counted from
+        """
+        self.name = name
+        self.__port = port
+        self.__clock_start_s = clock_start_s
+        self.__received = bytearray()
+        self.__arrived = None
+        self.__running = False
+        self.__stopping = False
+        self.__reader = None
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        ## Host time in seconds data last arrived, or None
+        self.last_data_s = None
+
+    def host_time(self):
+        """!
+        @return Seconds since the session started
+        """
+        return time.monotonic() - self.__clock_start_s
+
+    def start(self):
+        """!
+        @brief Start the task reading the board.
+        """
+        self.__arrived = asyncio.Event()
+        self.__reader = asyncio.get_running_loop().create_task(self.__read_loop())
+
+    async def __read_loop(self):
+        loop = asyncio.get_running_loop()
+        port = self.__port
+        while not self.__stopping:
+            try:
+                chunk = await loop.run_in_executor(
+                    self.__executor, lambda: port.read(max(1, port.in_waiting)))
+            except (serial.SerialException, OSError, TypeError) as error:
+                print("{}: {}".format(self.name, error))
+                break
+            if not chunk:
+                continue
+
+            self.last_data_s = self.host_time()
+            self.__received.extend(chunk)
+            if not self.__running and len(self.__received) > IDLE_BYTES:
+                del self.__received[:-IDLE_BYTES]
+            self.__arrived.set()
+
+    async def send(self, text):
+        """!
+        @brief Send a line to the board.
+        @param text Line to send, with or without its newline
+        @return Host time in seconds the line was sent
+        """
+        if not text.endswith("\n"):
+            text += "\n"
+        sent_s = self.host_time()
+        await asyncio.get_running_loop().run_in_executor(None, self.__port.write, text.encode())
+        return sent_s
+
+    async def run_test(self, command, capture=True, binary=True, wait_s=5, idle_s=0.5):
+        """!
+        @brief Start a step response test and wait for its data.
+        @param command Run command, "Kp" or "Kp,Ki,Kd"
+        @param capture True if the board sends the run in one dump when it ends
+        @param binary True if the board streams binary telemetry frames rather than text
+        @param wait_s Longest time to wait for the run, in seconds
+        @param idle_s Time without streamed data after which the run is finished, in seconds
+        @return Dictionary of the "board" name, "command", host time "sent_s"
+            in seconds, and arrays of "times" in ms, "positions" and
+            "controls", which is None for text lines; or None if no data arrived
+        """
+        self.__received.clear()
+        self.__running = True
+        try:
+            sent_s = await self.send(command)
+            deadline_s = sent_s + wait_s
+            run = None
+
+            while True:
+                if capture:
+                    run = gain_sweep.decode_run(self.__received)
+                    if run is not None:
+                        break
+                elif self.last_data_s is not None and self.last_data_s > sent_s \
+                        and self.host_time() - self.last_data_s > idle_s:
+                    break
+
+                remaining_s = deadline_s - self.host_time()
+                if remaining_s <= 0:
+                    break
+                self.__arrived.clear()
+                try:
+                    await asyncio.wait_for(self.__arrived.wait(), min(remaining_s, idle_s))
+                except asyncio.TimeoutError:
+                    pass
+
+            if not capture:
+                run = gain_sweep.decode_run(self.__received, False, binary)
+        finally:
+            self.__running = False
+
+        if run is None:
+            return None
+        return dict(board=self.name, command=command.strip(), sent_s=sent_s,
+                    times=run[0], positions=run[1], controls=run[2])
+
+    async def close(self):
+        """!
+        @brief Stop reading and close the port.
+        """
+        self.__stopping = True
+        if self.__reader is not None:
+            await self.__reader
+        self.__executor.shutdown()
+        self.__port.close()
+
+
+async def send_all(boards, text):
+    """!
+    @brief Send the same line to every board at once.
+    @param boards List of Board
+    @param text Line to send
+    @return List of the host time each board was sent the line
+    """
+    return await asyncio.gather(*(board.send(text) for board in boards))
+
+
+async def run_all(boards, command, **test_options):
+    """!
+    @brief Run the same test on every board at once.
+    @param boards List of Board
+    @param command Run command, "Kp" or "Kp,Ki,Kd"
+    @param test_options Keyword arguments passed on to Board.run_test
+    @return List of the run of each board, None where no data arrived
+    """
+    return await asyncio.gather(*(board.run_test(command, **test_options) for board in boards))
+
+
+def merge_runs(runs, names):
+    """!
+    @brief Merge the samples of many runs into one table in host time order.
+    @param runs List of run dictionaries from Board.run_test; None entries are skipped
+    @param names List of board names, whose positions are stored in place of names
+    @return Structured array of SAMPLE_DTYPE, where "run" is the position of
+        the run in runs
+    """
+    tables = []
+    for index, run in enumerate(runs):
+        if run is None:
+            continue
+        times = numpy.asarray(run["times"], dtype=float)
+        table = numpy.zeros(len(times), dtype=SAMPLE_DTYPE)
+        table["board"] = names.index(run["board"])
+        table["run"] = index
+        table["time_ms"] = times
+        table["host_s"] = run["sent_s"] + (times - times[0]) / 1000
+        table["position"] = run["positions"]
+        table["control"] = numpy.nan if run["controls"] is None else run["controls"]
+        tables.append(table)
+
+    if not tables:
+        return numpy.zeros(0, dtype=SAMPLE_DTYPE)
+    merged = numpy.concatenate(tables)
+    return merged[numpy.argsort(merged["host_s"], kind="stable")]
+
+
+def print_runs(runs, target):
+    """!
+    @brief Print the step response figures of a set of runs, one row per run.
+    @param runs List of run dictionaries from Board.run_test, or None for failed runs
+    @param target Step size in encoder ticks
+    """
+    _, _, metrics = gain_sweep.score_runs(
+        [None if run is None else (run["times"], run["positions"], run["controls"]) for run in runs],
+        target)
+    print("{:<12s} {:<20s} {:>9s} {:>9s} {:>10s} {:>11s} {:>9s} {:>8s}".format(
+        "board", "command", "sent s", "rise ms", "overshoot", "settle ms", "ss error", "IAE"))
+    for index, run in enumerate(runs):
+        if run is None:
+            continue
+        print("{:<12s} {:<20s} {:>9.3f} {:>9.1f} {:>9.1f}% {:>11.1f} {:>9.1f} {:>8.4f}".format(
+            run["board"], run["command"], run["sent_s"], metrics["rise_ms"][index],
+            metrics["overshoot_pct"][index], metrics["settling_ms"][index],
+            metrics["steady_state_error"][index], metrics["iae"][index]))
+
+
+async def run_bench(ports, sends, commands, target, archive=None, **test_options):
+    """!
+    @brief Connect every board, send settings, run every test on all boards and merge the results.
+    @param ports List of (name, open port) pairs
+    @param sends Setting lines sent to every board before the first test
+    @param commands Run commands, each run on every board at once
+    @param target Step size in encoder ticks
+    @param archive RunArchive every successful run is saved to, or None
+    @param test_options Keyword arguments passed on to Board.run_test
+    @return Tuple of the list of every run and the merged sample table
+    """
+    clock_start_s = time.monotonic()
+    boards = [Board(name, port, clock_start_s) for name, port in ports]
+    names = [board.name for board in boards]
+    for board in boards:
+        board.start()
+
+    runs = []
+    try:
+        for text in sends:
+            await send_all(boards, text)
+
+        for command in commands:
+            batch = await run_all(boards, command, **test_options)
+            for board, run in zip(boards, batch):
+                if run is None:
+                    print("{} {}: no data".format(board.name, command))
+                elif archive is not None:
+                    archive.add(run["times"], run["positions"], run["controls"],
+                                display.parse_gains(command), target,
+                                label="{} {}".format(board.name, command))
+            print_runs(batch, target)
+            runs.extend(batch)
+    finally:
+        await asyncio.gather(*(board.close() for board in boards))
+
+    return runs, merge_runs(runs, names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--port", action="append", default=[],
+                        help="Serial device of a board; give once per board")
+    parser.add_argument("--sim", type=int, default=0,
+                        help="Number of simulated boards to add, with sim/ on the path")
+    parser.add_argument("--send", action="append", default=[],
+                        help="Setting line sent to every board before the tests")
+    parser.add_argument("--run", action="append", required=True,
+                        help="Run command, Kp or Kp,Ki,Kd, run on every board at once")
+    parser.add_argument("--target", type=float, default=16384, help="Step size in encoder ticks")
+    parser.add_argument("--stream", action="store_true",
+                        help="Boards stream data instead of sending a capture dump")
+    parser.add_argument("--text", action="store_true",
+                        help="Boards stream text lines instead of binary telemetry")
+    parser.add_argument("--wait", type=float, default=5,
+                        help="Longest time to wait for each run, in seconds")
+    parser.add_argument("--out", default="bench.npz", help="File the merged samples are saved to")
+    parser.add_argument("--archive", help="Run archive directory each run is also saved to")
+    args = parser.parse_args()
+
+    ports = [(name, serial.Serial(name, 115200, timeout=0.1)) for name in args.port]
+    if args.sim:
+        import sim_board
+        ports += [("sim{}".format(number + 1), sim_board.SimulatedBoard("sim{}".format(number + 1)))
+                  for number in range(args.sim)]
+    if not ports:
+        parser.error("give at least one --port or --sim")
+
+    runs, samples = asyncio.run(run_bench(
+        ports, args.send, args.run, args.target,
+        run_archive.RunArchive(args.archive) if args.archive else None,
+        capture=not args.stream, binary=not args.text, wait_s=args.wait))
+
+    numpy.savez(args.out, samples=samples, boards=[name for name, _ in ports])
+    print("Saved {} samples of {} runs to {}".format(
+        len(samples), sum(run is not None for run in runs), args.out))
+
+
+if __name__ == "__main__":
+    main()
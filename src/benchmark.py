@@ -0,0 +1,308 @@
+"""! @file benchmark.py
+
+Measures how long hot paths take per call. On the board times are taken with
+utime.ticks_us; on a PC, where utime may be the simulator's virtual clock, the
+wall clock is used instead. The cost of an empty loop is subtracted.
+
+bench_all() times the driver and controller methods called on every control
+tick, and the cost of one resume of each task generator, on drivers built from
+the first entries of the axis and servo tables in main.py. Each figure is the
+best of several repeats. Results can be saved as JSON and compared with a
+saved baseline, flagging every figure that got slower by more than a threshold.
+A fixed reference workload is timed alongside, and comparisons are scaled by
+how its time changed, so a busier or slower machine is not reported as a
+regression of every path.
+
+Run on the board with "import benchmark; benchmark.run()", or on a PC with
+"python src/benchmark.py" and sim/ on the path, which supplies stand-ins for
+pyb. On the board the motor is disabled while it is benchmarked, but the
+servo moves.
+
+Usage: python src/benchmark.py [--save bench.json] [--baseline bench.json]
+                               [--threshold 0.2] [--iterations 1000]
+"""
+
+import json
+import platform
+
+if "MicroPython" in platform.platform():
+    import utime
+
+    def _now_us():
+        return utime.ticks_us()
+
+    def _elapsed_us(start):
+        return utime.ticks_diff(utime.ticks_us(), start)
+
+else:
+    import time
+
+    def _now_us():
+        return time.perf_counter_ns() // 1000
+
+    def _elapsed_us(start):
+        return time.perf_counter_ns() // 1000 - start
+
+
+def _empty(argument):
+    return argument
+
+
+def time_call(function, argument, iterations=1000):
+    """!
+        Times repeated calls of a function taking one argument
+        @param function Function to time
+        @param argument Argument passed on every call
+        @param iterations Number of calls to time
+        @return Mean time per call in microseconds, less the loop overhead
+    """
+    start = _now_us()
+    for _ in range(iterations):
+        _empty(argument)
+    overhead = _elapsed_us(start)
+
+    start = _now_us()
+    for _ in range(iterations):
+        function(argument)
+    elapsed = _elapsed_us(start)
+
+    return max(elapsed - overhead, 0) / iterations
+
+
+def time_sequence(function, arguments, iterations=1000):
+    """!
+        Times repeated calls of a function taking one argument, cycling through
+        a list of arguments so every call sees a new value
+        @param function Function to time
+        @param arguments List of arguments passed in turn
+        @param iterations Number of calls to time
+        @return Mean time per call in microseconds, less the loop overhead
+    """
+    count = len(arguments)
+
+    start = _now_us()
+    for index in range(iterations):
+        _empty(arguments[index % count])
+    overhead = _elapsed_us(start)
+
+    start = _now_us()
+    for index in range(iterations):
+        function(arguments[index % count])
+    elapsed = _elapsed_us(start)
+
+    return max(elapsed - overhead, 0) / iterations
+
+
+## Name of the reference workload in benchmark results
+REFERENCE = "reference"
+
+
+def _reference(count):
+    # Fixed mix of integer, float and attribute work, standing in for the machine speed
+    total = 0
+    scale = 0.5
+    for index in range(count):
+        total += (index * 3) >> 1
+        scale = scale * 0.999 + 0.001
+    return total + int(scale)
+
+
+def _best(timer, function, argument, iterations, repeats):
+    # Least time of several repeats, the one least disturbed by other activity
+    return min(timer(function, argument, iterations) for _ in range(repeats))
+
+
+def bench_all(iterations=1000, repeats=5):
+    """!
+        Times every hot path and task resume, printing each as it is measured
+        @param iterations Number of calls timed in each repeat
+        @param repeats Number of repeats, of which the fastest is kept
+        @return Dictionary of microseconds per call for each path
+    """
+    import main
+    import axis
+    import axis_state
+    import task_share
+    from servo_driver import ServoDriver
+    from timing_stats import TaskStats, timed
+
+    if "MicroPython" not in platform.platform():
+        from me405_support import task_share
+
+    task_state = task_share.Share('l', thread_protect=False, name="Bench State")
+    task_state.put(1)
+    config = dict(main.AXES[0], loop_mode="split", record=False)
+    bench_axis = axis.Axis(config, main.TIMEOUT_MS)
+    bench_axis.motor.set_enable(0)
+    encoder = bench_axis.encoder
+    controller = bench_axis.controller
+    motor = bench_axis.motor
+    loop = bench_axis.loop
+
+    servo_config = main.SERVOS[0]
+    servo = ServoDriver(servo_config["pin"], servo_config["timer"], servo_config["channel"],
+                        servo_config["min_pulse"], servo_config["max_pulse"],
+                        servo_config["angle_range"], servo_config["arr"], servo_config["ps"])
+    servo.test_sweep_reset()
+
+    state = bench_axis.state
+    ints = state.ints
+    bench_axis.start_run()
+
+    results = {}
+
+    def measure(name, timer, function, argument):
+        results[name] = _best(timer, function, argument, iterations, repeats)
+        print("{}: {:.2f} us".format(name, results[name]))
+
+    measure(REFERENCE, time_call, _reference, 10)
+    measure("Encoder.read", time_call, lambda _: encoder.read(), None)
+    measure("PIDController.run", time_call, controller.run, 1000)
+    measure("PIDController.run_fixed", time_call, controller.run_fixed, 1000)
+    measure("MotorDriver.set_duty_cycle", time_sequence, motor.set_duty_cycle,
+            [-75.5, -20, 0, 33.3, 100])
+    measure("MotorDriver.set_duty_cycle unchanged", time_call, motor.set_duty_cycle, 33.3)
+    measure("ServoDriver.set_angle", time_sequence, servo.set_angle, [0, 45, 90, 135, 180])
+    if bench_axis.profile is not None:
+        measure("MotionProfile.apply", time_call, bench_axis.profile.apply, controller)
+    measure("ControlLoop.update", time_call, lambda _: loop.update(), None)
+    measure("ControlLoop.update_fixed", time_call, lambda _: loop.update_fixed(), None)
+    # Reading a state field, next to a plain attribute read for comparison
+    measure("AxisState field read", time_call, lambda _: ints[axis_state.POSITION], None)
+    measure("Share.get", time_call, lambda _: task_state.get(), None)
+    measure("Attribute read", time_call, lambda _: state.name, None)
+
+    # One resume of each task generator with the task state set, as cotask runs them
+    measure("Encoder.read_task resume", time_call, next, encoder.read_task(state))
+    measure("PIDController.run_task resume", time_call, next, controller.run_task(state))
+    measure("MotorDriver.set_duty_cycle_task resume", time_call, next,
+            motor.set_duty_cycle_task(state))
+    measure("ControlLoop.run_task resume", time_call, next, loop.run_task(state))
+    measure("ServoDriver.motion_task resume", time_call, next, servo.motion_task(task_state))
+    measure("timed(Encoder.read_task) resume", time_call, next,
+            timed(encoder.read_task, TaskStats("bench", 10))(state))
+
+    task_state.put(0)
+    bench_axis.stop()
+    bench_axis.shutdown()
+    servo.reset_pulse_width()
+    return results
+
+
+def save_results(results, path):
+    """!
+        Writes benchmark results to a JSON file
+        @param results Dictionary of microseconds per call, such as from bench_all
+        @param path File to write
+    """
+    with open(path, "w") as file:
+        json.dump(results, file)
+
+
+def load_results(path):
+    """!
+        Reads benchmark results written by save_results
+        @param path File to read
+        @return Dictionary of microseconds per call
+    """
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare_results(results, baseline, threshold=0.2, floor_us=0.1):
+    """!
+        Prints every path measured in both results next to its baseline. When
+        both hold the reference workload, baseline times are first scaled by
+        how much its time changed.
+        @param results Dictionary of microseconds per call
+        @param baseline Dictionary of microseconds per call to compare with
+        @param threshold Fraction slower than the baseline that counts as a regression
+        @param floor_us Smallest slowdown in microseconds that counts, so
+            timer resolution on very fast paths is not flagged
+        @return List of the names of paths that regressed
+    """
+    speed = 1
+    if baseline.get(REFERENCE) and results.get(REFERENCE):
+        speed = results[REFERENCE] / baseline[REFERENCE]
+        print("Reference workload takes {:.2f} times as long as in the baseline".format(speed))
+
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline or name == REFERENCE:
+            continue
+        old = baseline[name] * speed
+        new = results[name]
+        slower = new > old * (1 + threshold) and new - old > floor_us
+        if slower:
+            regressions.append(name)
+        print("{}: {:.2f} us, expected {:.2f} us ({:+.0f} %){}".format(
+            name, new, old, 100 * (new - old) / old if old else 0,
+            " REGRESSION" if slower else ""))
+    return regressions
+
+
+def run(iterations=1000, repeats=5, save_path=None, baseline_path=None, threshold=0.2):
+    """!
+        Runs every benchmark, optionally saving the results and comparing them with a baseline
+        @param iterations Number of calls timed in each repeat
+        @param repeats Number of repeats, of which the fastest is kept
+        @param save_path File the results are saved to, or None
+        @param baseline_path File of earlier results to compare with, or None
+        @param threshold Fraction slower than the baseline that counts as a regression
+        @return List of the names of paths that regressed
+    """
+    results = bench_all(iterations, repeats)
+    regressions = []
+    if baseline_path is not None:
+        print("")
+        regressions = compare_results(results, load_results(baseline_path), threshold)
+        print("{} regressions above {:.0f} %".format(len(regressions), 100 * threshold))
+    if save_path is not None:
+        save_results(results, save_path)
+    return regressions
+
+
+def bench_pid(iterations=1000, budget_us=1000):
+    """!
+        Prints the cost of one PIDController iteration with every term active,
+        and how many controllers would fit in a time budget
+        @param iterations Number of iterations to time for each path
+        @param budget_us Time budget in microseconds, such as one 1 kHz tick
+        @return Dictionary of microseconds per iteration for each path
+    """
+    import PID_controller
+
+    controller = PID_controller.PIDController(0.03, 16384, Ki=0.0001, Kd=0.5, Kf=0.001,
+                                              out_min=-100, out_max=100, i_limit=20,
+                                              d_filter=0.25)
+    results = {
+        "PIDController.run": time_call(controller.run, 1000, iterations),
+    }
+    controller.reset()
+    results["PIDController.run_fixed"] = time_call(controller.run_fixed, 1000, iterations)
+
+    for name, cost in results.items():
+        print("{}: {:.2f} us/iteration, {} per {} us".format(
+            name, cost, int(budget_us // cost) if cost else "unlimited", budget_us))
+
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    from run_sim import install_support_modules
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[2])
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--save", help="File the results are saved to")
+    parser.add_argument("--baseline", help="File of earlier results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Fraction slower than the baseline that counts as a regression")
+    args = parser.parse_args()
+
+    install_support_modules()
+    bench_pid(args.iterations)
+    print("")
+    sys.exit(1 if run(args.iterations, args.repeats, args.save, args.baseline, args.threshold) else 0)
@@ -0,0 +1,102 @@
+"""! @file capture.py
+
+Records a step response run into preallocated arrays on the board so that no
+serial I/O happens while the controller is running. The encoder and controller
+tasks write samples in place, and the whole run is sent in one bulk write once
+it has ended.
+
+Dump layout, little endian: sync 0xA5, marker 0xC3, sample count (uint16),
+item size of the integer arrays in bytes (uint8), then the time stamps [us],
+positions and control values, each as one contiguous array.
+"""
+
+import struct
+import utime
+from array import array
+
+
+## First byte of a capture dump, shared with the telemetry frames
+CAPTURE_SYNC = 0xA5
+## Second byte of a capture dump, distinguishing it from a telemetry frame
+CAPTURE_MARKER = 0xC3
+## Layout of the header preceding the sample arrays
+HEADER_FORMAT = "<BBHB"
+
+
+class CaptureBuffer:
+    """!
+    Fixed-size sample store for a single run. Samples past the end of the
+    buffer are dropped rather than reallocating.
+    """
+
+    def __init__(self, duration_ms, period_ms):
+        """!
+            Allocates room for every sample of a run
+            @param duration_ms Length of the run in ms, such as TIMEOUT_MS
+            @param period_ms Period of the tasks writing samples in ms
+        """
+        ## Number of samples the buffer can hold
+        self.size = duration_ms // period_ms + 2
+
+        ## Sample times in microseconds since start()
+        self.times = array('l', (0 for _ in range(self.size)))
+        ## Sampled positions
+        self.positions = array('l', (0 for _ in range(self.size)))
+        ## Controller output for each sample
+        self.controls = array('f', (0 for _ in range(self.size)))
+
+        self.__header = bytearray(struct.calcsize(HEADER_FORMAT))
+        self.__count = 0
+        self.__start = utime.ticks_us()
+
+
+    def start(self):
+        """!
+            Empties the buffer and restarts the time base
+        """
+        self.__count = 0
+        self.__start = utime.ticks_us()
+
+
+    def count(self):
+        """!
+            @return Number of samples recorded since start()
+        """
+        return self.__count
+
+
+    def record_position(self, position):
+        """!
+            Records a new sample time and position
+            @param position Position in encoder ticks
+        """
+        index = self.__count
+        if index < self.size:
+            self.times[index] = utime.ticks_diff(utime.ticks_us(), self.__start)
+            self.positions[index] = position
+            # The output stays as it was until the controller next runs
+            self.controls[index] = self.controls[index - 1] if index else 0
+            self.__count = index + 1
+
+
+    def record_control(self, control):
+        """!
+            Records the controller output computed from the latest position
+            @param control Controller output
+        """
+        if self.__count:
+            self.controls[self.__count - 1] = control
+
+
+    def dump(self, stream):
+        """!
+            Writes the header and every recorded sample
+            @param stream Object with a write() method accepting a buffer
+        """
+        count = self.__count
+        struct.pack_into(HEADER_FORMAT, self.__header, 0,
+                         CAPTURE_SYNC, CAPTURE_MARKER, count, self.times.itemsize)
+        stream.write(self.__header)
+        stream.write(memoryview(self.times)[:count])
+        stream.write(memoryview(self.positions)[:count])
+        stream.write(memoryview(self.controls)[:count])
@@ -0,0 +1,166 @@
+"""! @file commands.py
+
+Reads text commands from the PC one line at a time and dispatches them to
+handler functions. LineReader collects bytes into a preallocated buffer,
+reading only what is already waiting, so polling it from the scheduler loop
+never blocks and does not allocate until a whole line has arrived. Partial
+lines are kept until the rest arrives, and a burst of commands is handed out
+one line per poll so the scheduler runs between them. Lines too long for the
+buffer are dropped whole.
+
+CommandDispatcher splits a line into words, separated by spaces or commas,
+and calls the handler registered for the first word with the rest. A handler
+signals bad arguments by raising ValueError, IndexError or KeyError, which is
+reported back over the serial port instead of stopping the program, as are
+arithmetic errors such as OverflowError from converting an infinite value.
+"""
+
+## Longest command line accepted, in bytes
+LINE_SIZE = 64
+
+_NEWLINE = 10
+
+
+class LineReader:
+    """!
+    Non-blocking, line buffered reader of a serial stream
+    """
+
+    def __init__(self, stream, size=LINE_SIZE):
+        """!
+            Allocates the line buffer
+            @param stream Object with any() and readinto() methods, such as pyb.USB_VCP()
+            @param size Longest line accepted in bytes, including the newline
+        """
+        self.__stream = stream
+        self.__buffer = bytearray(size)
+        self.__view = memoryview(self.__buffer)
+        self.__length = 0
+        self.__scanned = 0
+        self.__discarding = False
+        ## Number of lines dropped for being longer than the buffer
+        self.overflows = 0
+
+
+    def poll(self):
+        """!
+            Reads whatever has arrived, without waiting for more
+            @return The next complete line, without its line ending, or None
+                if no complete line has arrived
+        """
+        end = self.__find_newline()
+
+        if end < 0:
+            if self.__length == len(self.__buffer):
+                # Too long to be a command, so drop it up to its newline
+                if not self.__discarding:
+                    self.overflows += 1
+                self.__discarding = True
+                self.__length = 0
+                self.__scanned = 0
+
+            if not self.__stream.any():
+                return None
+            count = self.__stream.readinto(self.__view[self.__length:])
+            if not count:
+                return None
+            self.__length += count
+
+            end = self.__find_newline()
+            if end < 0:
+                return None
+
+        line = None
+        if self.__discarding:
+            self.__discarding = False
+        else:
+            try:
+                line = bytes(self.__view[:end]).decode().strip()
+            except ValueError:
+                pass
+
+        self.__consume(end + 1)
+        return line
+
+
+    def __find_newline(self):
+        buffer = self.__buffer
+        for index in range(self.__scanned, self.__length):
+            if buffer[index] == _NEWLINE:
+                return index
+        self.__scanned = self.__length
+        return -1
+
+
+    def __consume(self, count):
+        # Moves the bytes after the first count to the start of the buffer
+        buffer = self.__buffer
+        remaining = self.__length - count
+        for index in range(remaining):
+            buffer[index] = buffer[count + index]
+        self.__length = remaining
+        self.__scanned = 0
+
+
+class CommandDispatcher:
+    """!
+    Table of named commands and the functions that carry them out
+    """
+
+    def __init__(self, default=None, default_usage=""):
+        """!
+            Creates an empty command table
+            @param default Function called with every word of a line whose
+                first word is not a command, or None to report such lines as errors
+            @param default_usage Description of the lines passed to default,
+                printed first by usage()
+        """
+        self.__handlers = {}
+        self.__default = default
+        self.__default_usage = default_usage
+
+
+    def add(self, name, handler, usage=""):
+        """!
+            Adds a command
+            @param name First word of the command, in lower case
+            @param handler Function called with a list of the remaining words
+            @param usage Description of the arguments, printed by usage()
+        """
+        self.__handlers[name] = (handler, usage)
+
+
+    def usage(self):
+        """!
+            @return String listing every command and its arguments
+        """
+        lines = ["{} {}".format(name, self.__handlers[name][1]).rstrip()
+                 for name in sorted(self.__handlers)]
+        if self.__default_usage:
+            lines.insert(0, self.__default_usage)
+        return "\n".join(lines)
+
+
+    def dispatch(self, line):
+        """!
+            Carries out one command line, printing an error if it is not valid
+            @param line Command text without its line ending
+            @return True if the command was carried out
+        """
+        words = line.replace(",", " ").split()
+        if not words:
+            return False
+
+        entry = self.__handlers.get(words[0].lower())
+        try:
+            if entry is not None:
+                entry[0](words[1:])
+            elif self.__default is not None:
+                self.__default(words)
+            else:
+                raise KeyError(words[0])
+        except (ValueError, IndexError, KeyError, ArithmeticError) as error:
+            print("error: {}: {!r}".format(line, error))
+            return False
+
+        return True
@@ -0,0 +1,320 @@
+"""! @file control_loop.py
+
+Runs a complete motor control update, reading the encoder, running the PID
+controller and setting the motor duty cycle back to back in one task. This
+applies each output in the same tick as the position it was computed from
+without relying on three separate tasks being released and run in that order,
+and without the other tasks that can run between them.
+Also contains a probe measuring that sensor-to-actuator latency in either mode.
+
+Given a second, position controller, the loop becomes the inner velocity loop
+of a cascade: the position controller runs at its own, slower rate and sets the
+velocity the inner loop holds with the motor.
+
+A separate sampling task can read the encoder faster than the loop runs. The
+loop then acts on the mean of the positions sampled since its last update,
+taken from the axis state block, instead of reading the encoder itself.
+
+The loop can also be run from a hardware timer interrupt at a fixed rate,
+independent of the cotask scheduler and whatever else it is running. That path
+uses only integer arithmetic on preallocated objects, so it does not allocate
+and is safe to run as a hard interrupt.
+"""
+
+import pyb
+import utime
+from axis_state import STATE, SETPOINT, POSITION_US, CONTROL_US, CONTROL, take_mean_position
+from timing_stats import TimingStats
+
+
+class LatencyProbe:
+    """!
+    Measures the time from sampling the encoder to applying a motor output
+    computed from that sample. The encoder, controller and motor each mark
+    their step, so the probe works whether they run as one task or three.
+    """
+
+    def __init__(self, bin_width_us=1000, bin_count=25):
+        """!
+            Creates a probe with empty statistics
+            @param bin_width_us Width of each latency histogram bin in microseconds
+            @param bin_count Number of latency histogram bins
+        """
+        ## Sensor-to-actuator latency statistics
+        self.stats = TimingStats(bin_width_us, bin_count)
+        self.__sensed_us = 0
+        self.__computed_from_us = 0
+        self.__computed = False
+
+
+    def sensed(self):
+        """!
+            Marks the time a new position was sampled
+        """
+        self.__sensed_us = utime.ticks_us()
+
+
+    def computed(self):
+        """!
+            Marks that a new output was computed from the latest sample
+        """
+        self.__computed_from_us = self.__sensed_us
+        self.__computed = True
+
+
+    def actuated(self):
+        """!
+            Marks that the latest output was applied to the motor and records
+            how old the sample it came from is
+        """
+        if self.__computed:
+            self.stats.add(utime.ticks_diff(utime.ticks_us(), self.__computed_from_us))
+
+
+class ControlLoop:
+    """!
+    Single-task motor control pipeline of sense, compute and actuate, optionally
+    with an outer position loop
+    """
+
+    def __init__(self, encoder, controller, motor, position_controller=None):
+        """!
+            Creates a control loop from existing drivers
+            @param encoder Encoder measuring the motor position
+            @param controller PIDController computing the duty cycle
+            @param motor MotorDriver applying the duty cycle
+            @param position_controller PIDController computing a velocity setpoint
+                from the position, or None. When given, controller acts on the
+                encoder velocity in counts per second instead of the position.
+        """
+        self.__encoder = encoder
+        self.__controller = controller
+        self.__motor = motor
+        self.__position_controller = position_controller
+        # Controller whose setpoint is the position setpoint
+        self.__setpoint_controller = position_controller or controller
+        self.__capture = None
+        self.__probe = None
+        self.__profile = None
+        self.__samples = None
+        self.__timer = None
+
+        ## Absolute deviation of each timer tick from the nominal period
+        self.jitter = TimingStats(bin_width_us=5, bin_count=20)
+        ## Time spent in each timer driven update
+        self.isr_time = TimingStats(bin_width_us=10, bin_count=20)
+
+
+    def set_capture(self, capture):
+        """!
+            Records every position and output of run_task into a capture buffer
+            @param capture CaptureBuffer to record into, or None to stop recording
+        """
+        self.__capture = capture
+
+
+    def set_probe(self, probe):
+        """!
+            Measures sensor-to-actuator latency of every update
+            @param probe LatencyProbe to mark, or None to stop measuring
+        """
+        self.__probe = probe
+
+
+    def set_profile(self, profile):
+        """!
+            Takes the position setpoint of every update from a motion profile.
+            In a cascade the profile feeds the outer position loop.
+            @param profile MotionProfile to play back, or None to hold the setpoint
+        """
+        self.__profile = profile
+
+
+    def set_sampler(self, state):
+        """!
+            Takes positions from a separate task sampling the encoder, such as
+            Encoder.read_task, rather than reading it in every update. Not
+            used by update_fixed.
+            @param state AxisState the sampling task writes into, or None to
+                read the encoder in every update
+        """
+        self.__samples = state
+
+
+    def update(self):
+        """!
+            Runs one sense, compute and actuate cycle
+            @return Controller output applied to the motor
+        """
+        probe = self.__probe
+        samples = self.__samples
+
+        if samples is None:
+            position = self.__encoder.read()
+            if probe is not None:
+                probe.sensed()
+
+        if self.__position_controller is None:
+            if self.__profile is not None:
+                self.__profile.apply(self.__controller)
+            if samples is not None:
+                position = take_mean_position(samples.ints)
+            control_value = self.__controller.run(position)
+        else:
+            control_value = self.__controller.run(self.__encoder.get_velocity())
+        if probe is not None:
+            probe.computed()
+
+        self.__motor.set_duty_cycle(control_value)
+        if probe is not None:
+            probe.actuated()
+
+        if self.__capture is not None:
+            self.__capture.record_position(self.__encoder.get_position())
+            self.__capture.record_control(control_value)
+
+        return control_value
+
+
+    def update_fixed(self):
+        """!
+            Runs one sense, compute and actuate cycle without allocating,
+            using the controller's integer control law
+            @return Integer controller output applied to the motor
+        """
+        probe = self.__probe
+
+        position = self.__encoder.read()
+        if probe is not None:
+            probe.sensed()
+
+        if self.__position_controller is None:
+            if self.__profile is not None:
+                self.__profile.apply(self.__controller)
+            control_value = self.__controller.run_fixed(position)
+        else:
+            control_value = self.__controller.run_fixed(self.__encoder.get_velocity())
+        if probe is not None:
+            probe.computed()
+
+        self.__motor.set_duty_cycle(control_value)
+        if probe is not None:
+            probe.actuated()
+
+        if self.__capture is not None:
+            self.__capture.record_position(position)
+            self.__capture.record_control(control_value)
+
+        return control_value
+
+
+    def outer_update(self):
+        """!
+            Runs the position controller on the latest position, or the mean
+            of those sampled since its last run, and passes its output to the
+            inner loop as the velocity setpoint
+            @return Velocity setpoint in counts per second
+        """
+        if self.__profile is not None:
+            self.__profile.apply(self.__position_controller)
+
+        if self.__samples is None:
+            position = self.__encoder.get_position()
+        else:
+            position = take_mean_position(self.__samples.ints)
+        velocity_target = self.__position_controller.run(position)
+        self.__controller.set_setpoint(velocity_target)
+        return velocity_target
+
+
+    def outer_task(self, state):
+        """!
+            Runs one outer position loop update per resume while the task state is nonzero
+            @param state AxisState whose STATE field enables the task
+        """
+        ints = state.ints
+
+        while True:
+
+            if ints[STATE] == 0:
+                pass
+
+            else:
+                self.outer_update()
+
+            yield 0
+
+
+    def start_timer(self, timer_num, frequency, state):
+        """!
+            Runs update_fixed from a hardware timer interrupt at a fixed rate,
+            publishing the position and output for other tasks
+            @param timer_num Number of a timer not used for anything else,
+                such as one of the basic timers 6 or 7
+            @param frequency Update rate in Hz
+            @param state AxisState whose STATE field enables the updates and
+                which receives the results of each update
+        """
+        self.__state = state
+        self.__period_us = 1000000 // frequency
+        self.__last_tick_us = 0
+        self.__ticked = False
+        self.jitter.reset()
+        self.isr_time.reset()
+
+        self.__timer = pyb.Timer(timer_num, freq=frequency)
+        self.__timer.callback(self.__timer_callback)
+
+
+    def stop_timer(self):
+        """!
+            Stops timer driven updates
+        """
+        if self.__timer is not None:
+            self.__timer.callback(None)
+            self.__timer.deinit()
+            self.__timer = None
+
+
+    def __timer_callback(self, timer):
+        start = utime.ticks_us()
+
+        if self.__ticked:
+            deviation = utime.ticks_diff(start, self.__last_tick_us) - self.__period_us
+            self.jitter.add(deviation if deviation >= 0 else -deviation)
+        self.__last_tick_us = start
+        self.__ticked = True
+
+        state = self.__state
+        if state.ints[STATE] != 0:
+            self.__publish(state, self.update_fixed())
+            self.isr_time.add(utime.ticks_diff(utime.ticks_us(), start))
+
+
+    def __publish(self, state, control_value):
+        # Writes the results of an update into an AxisState, without allocating
+        ints = state.ints
+        self.__encoder.publish(ints)
+        state.floats[CONTROL] = control_value
+        ints[CONTROL_US] = ints[POSITION_US]
+        ints[SETPOINT] = self.__setpoint_controller.get_setpoint()
+
+
+    def run_task(self, state):
+        """!
+            Runs one control update per resume while the task state is nonzero,
+            publishing the position and output for other tasks
+            @param state AxisState whose STATE field enables the task and
+                which receives the results of each update
+        """
+        ints = state.ints
+
+        while True:
+
+            if ints[STATE] == 0:
+                pass
+
+            else:
+                self.__publish(state, self.update())
+
+            yield 0
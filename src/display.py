@@ -6,6 +6,13 @@ This file is based loosely on an example found at
 https://matplotlib.org/stable/gallery/user_interfaces/embedding_in_tk_sgskip.html
 Original program, based on example from above listed source and from reference code
 distributed as part of the ME405 curriculum "lab0example.py". 
+
+Every run is saved to a run archive, see run_archive.py, and the History
+button overlays the most recent runs saved there.
+
+The serial port is opened for the first test and stays open until the window
+closes, so a test does not wait for the port to reopen. To drive several
+boards at once, see bench_host.py.
 """
 
 # Imports
@@ -13,7 +20,9 @@ import threading
 import time
 import tkinter
 from random import random
+import numpy
 import serial
+import run_archive
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg)
 from matplotlib.backends._backend_tk import (NavigationToolbar2Tk)
@@ -24,13 +33,439 @@ from matplotlib.backends._backend_tk import (NavigationToolbar2Tk)
 #__DEV_NAME = "COM6"
 __DEV_NAME = "/dev/cu.usbmodem2052339C57522"
 
+## Set to match TELEMETRY_BINARY in main.py on the board
+__TELEMETRY_BINARY = True
+
+## Set to match CAPTURE_STEP_RESPONSE in main.py on the board
+__CAPTURE_MODE = True
+
+## Longest time to wait for a captured run to be sent, in seconds
+__CAPTURE_WAIT_S = 5
+
+## Draw streamed data while it arrives instead of after the run ends. Only
+## used when __CAPTURE_MODE is False, since a captured run arrives all at once.
+__LIVE_MODE = True
+
+## Redraw rate of the live plot in frames per second
+__LIVE_FPS = 30
+
+## Number of most recent samples kept and drawn by the live plot
+__LIVE_SAMPLES = 20000
+
+## Time without new data after which a live run is treated as finished, in seconds
+__LIVE_IDLE_S = 0.5
+
+## Directory every run is saved to, see run_archive.py, or None to not save runs
+__ARCHIVE_DIR = "runs"
+
+## Set to match the target in main.py, used to score saved runs
+__TARGET = 16384
+
+## Number of the most recent saved runs drawn by the History button
+__HISTORY_RUNS = 10
+
+## Serial port kept open between tests, see open_port()
+__port = None
+
+## First sync byte of a telemetry frame, see telemetry.py
+TELEMETRY_SYNC_1 = 0xA5
+## Second sync byte of a telemetry frame
+TELEMETRY_SYNC_2 = 0x5A
+## Layout of one telemetry frame
+TELEMETRY_DTYPE = numpy.dtype([("sync", "u1", 2),
+                               ("time_us", "<u4"),
+                               ("position", "<i4"),
+                               ("control", "<f4"),
+                               ("state", "u1"),
+                               ("checksum", "u1")])
+
+
+def decode_telemetry(data):
+    """!
+    @brief Decode every complete telemetry frame in a buffer at once.
+    Candidate frames are located by their sync bytes and kept only when the
+    checksum matches, so text printed by other tasks between frames is skipped.
+    @param data Bytes received from the board
+    @return Tuple of a structured array of frames using TELEMETRY_DTYPE and the
+        number of bytes consumed. Bytes past the consumed count may hold the
+        start of a frame that has not been fully received yet.
+    """
+    raw = numpy.frombuffer(data, dtype=numpy.uint8)
+    frame_size = TELEMETRY_DTYPE.itemsize
+
+    if len(raw) < frame_size:
+        return numpy.zeros(0, dtype=TELEMETRY_DTYPE), 0
+
+    starts = numpy.flatnonzero((raw[:-1] == TELEMETRY_SYNC_1) & (raw[1:] == TELEMETRY_SYNC_2))
+    complete = starts[starts + frame_size <= len(raw)]
+
+    frames = raw[complete[:, None] + numpy.arange(frame_size)]
+    sums = frames[:, 2:frame_size - 1].sum(axis=1, dtype=numpy.uint32) & 0xFF
+    matches = sums == frames[:, frame_size - 1]
+    valid = complete[matches]
+    frames = frames[matches]
+
+    # A sync pattern inside a payload could pass the checksum by chance; drop
+    # any frame that starts inside the one before it
+    keep = numpy.ones(len(valid), dtype=bool)
+    keep[1:] = numpy.diff(valid) >= frame_size
+    valid = valid[keep]
+    frames = numpy.ascontiguousarray(frames[keep])
+
+    # Leave unconsumed any trailing bytes that may begin a frame still in flight
+    end = int(valid[-1]) + frame_size if len(valid) else 0
+    incomplete = starts[(starts >= end) & (starts + frame_size > len(raw))]
+    if len(incomplete):
+        consumed = int(incomplete[0])
+    elif raw[-1] == TELEMETRY_SYNC_1:
+        consumed = len(raw) - 1
+    else:
+        consumed = len(raw)
+
+    return frames.view(TELEMETRY_DTYPE).reshape(-1), consumed
+
+
+## Second byte of a capture dump, see capture.py
+CAPTURE_MARKER = 0xC3
+
+
+def decode_capture(data):
+    """!
+    @brief Decode a bulk capture dump sent by the board after a run.
+    @param data Bytes received from the board
+    @return Tuple of arrays (times in us, positions, control values), or None
+        if no complete dump is present
+    """
+    header = bytes((TELEMETRY_SYNC_1, CAPTURE_MARKER))
+    index = data.find(header)
+
+    while index >= 0 and index + 5 <= len(data):
+        count = data[index + 2] | (data[index + 3] << 8)
+        item_size = data[index + 4]
+        start = index + 5
+        end = start + count * (2 * item_size + 4)
+
+        if item_size in (4, 8) and end <= len(data):
+            int_type = numpy.dtype("<i{}".format(item_size))
+            times = numpy.frombuffer(data, int_type, count, start)
+            positions = numpy.frombuffer(data, int_type, count, start + count * item_size)
+            controls = numpy.frombuffer(data, "<f4", count, start + 2 * count * item_size)
+            return times, positions, controls
+
+        index = data.find(header, index + 1)
+
+    return None
+
+
+def decode_lines(data):
+    """!
+    @brief Decode every complete "time,position" text line in a buffer.
+    Lines that do not hold two numbers, such as other printed messages, are skipped.
+    @param data Bytes received from the board
+    @return Tuple of an array of (time in ms, position) rows and the number of
+        bytes consumed. Bytes past the consumed count are an unfinished line.
+    """
+    end = data.rfind(b"\n") + 1
+    rows = []
+    for line in data[:end].decode(errors="replace").splitlines():
+        split_line = line.strip().split(",")
+        if len(split_line) > 1:
+            try:
+                rows.append((float(split_line[0]), float(split_line[1])))
+            except ValueError:
+                pass
+    return numpy.array(rows, dtype=float).reshape(-1, 2), end
+
+
+def parse_gains(command):
+    """!
+    @brief Read the gains out of a run command.
+    @param command Text sent to the board, "Kp" or "Kp,Ki,Kd"
+    @return Tuple of (Kp, Ki, Kd), with NaN for any gain not given
+    """
+    gains = [numpy.nan] * 3
+    try:
+        values = [float(value) for value in command.split(",")]
+    except ValueError:
+        return tuple(gains)
+    gains[:len(values[:3])] = values[:3]
+    return tuple(gains)
+
+
+def command_bytes(command):
+    """!
+    @brief Encode a command typed in the text box as one line for the board.
+    The board only acts on complete lines, see commands.LineReader, so a
+    newline is added if the command does not end in one.
+    @param command Text typed in the text box
+    @return Bytes to write to the serial port
+    """
+    if not command.endswith("\n"):
+        command += "\n"
+    return command.encode()
+
+
+def archive_run(times, positions, controls, command):
+    """!
+    @brief Save a run to the archive in __ARCHIVE_DIR, if there is one.
+    @param times Sample times in ms
+    @param positions Sample positions in encoder ticks
+    @param controls Controller output of each sample, or None if not known
+    @param command Text sent to the board to start the run
+    """
+    if __ARCHIVE_DIR is None or len(times) == 0:
+        return
+    archive = run_archive.RunArchive(__ARCHIVE_DIR)
+    entry = archive.add(times, positions, controls, parse_gains(command.strip()), __TARGET,
+                        label=command.strip())
+    print("Saved run {} to {}".format(entry["run_id"], __ARCHIVE_DIR))
+
+
+def open_port():
+    """!
+    @brief Open the board's serial port on first use and keep it open between tests.
+    @return Open serial port, with anything already received discarded
+    """
+    global __port
+    if __port is None or not __port.is_open:
+        __port = serial.Serial(__DEV_NAME, 115200, timeout=0.1)
+    __port.reset_input_buffer()
+    return __port
+
+
+def close_port():
+    """!
+    @brief Close the serial port if it is open; the next test opens it again.
+    """
+    global __port
+    if __port is not None:
+        print("Closing serial port")
+        __port.close()
+        __port = None
+
+
+class RingBuffer:
+    """!
+    @brief Fixed-size store of the most recent rows of samples.
+    Rows are written in bulk by one thread and read by another; once the buffer
+    is full the oldest rows are overwritten, so memory use stays constant no
+    matter how long a run streams.
+    """
+
+    def __init__(self, capacity, columns=2):
+        """!
+        @brief Create an empty ring buffer.
+        @param capacity Number of rows kept
+        @param columns Number of values in each row
+        """
+        self.__data = numpy.zeros((capacity, columns))
+        self.__capacity = capacity
+        self.__columns = columns
+        self.__written = 0
+        self.__lock = threading.Lock()
+
+    def clear(self):
+        """!
+        @brief Forget every stored row.
+        """
+        with self.__lock:
+            self.__written = 0
+
+    def extend(self, rows):
+        """!
+        @brief Append rows, overwriting the oldest rows once full.
+        @param rows Array of shape (n, columns)
+        """
+        rows = numpy.asarray(rows, dtype=float).reshape(-1, self.__columns)
+        count = len(rows)
+        if count == 0:
+            return
+        kept = rows[-self.__capacity:]
+
+        with self.__lock:
+            start = (self.__written + count - len(kept)) % self.__capacity
+            first = min(len(kept), self.__capacity - start)
+            self.__data[start:start + first] = kept[:first]
+            self.__data[:len(kept) - first] = kept[first:]
+            self.__written += count
+
+    def total(self):
+        """!
+        @return Number of rows appended since the buffer was created or cleared
+        """
+        return self.__written
+
+    def latest(self):
+        """!
+        @return Copy of the stored rows, oldest first
+        """
+        with self.__lock:
+            if self.__written <= self.__capacity:
+                return self.__data[:self.__written].copy()
+            split = self.__written % self.__capacity
+            return numpy.concatenate((self.__data[split:], self.__data[:split]))
+
+
+class SerialReader(threading.Thread):
+    """!
+    @brief Background thread reading step response data from a serial port.
+    Everything waiting on the port is read in one call and decoded in bulk,
+    either as binary telemetry frames or as "time,position" text lines, and
+    appended to a ring buffer as rows of time in ms and position.
+    """
+
+    def __init__(self, port, buffer, binary):
+        """!
+        @brief Create a reader; call start() to begin reading.
+        @param port Open serial port, with a read timeout set
+        @param buffer RingBuffer receiving rows of (time in ms, position)
+        @param binary True to decode binary telemetry frames, False for text lines
+        """
+        super().__init__(daemon=True)
+        self.__port = port
+        self.__buffer = buffer
+        self.__binary = binary
+        self.__pending = bytearray()
+        self.__stop_event = threading.Event()
+        ## Value of time.monotonic() when data was last received
+        self.last_data_s = time.monotonic()
+
+    def run(self):
+        while not self.__stop_event.is_set():
+            try:
+                chunk = self.__port.read(max(1, self.__port.in_waiting))
+            except (serial.SerialException, OSError, TypeError):
+                break
+            if not chunk:
+                continue
+
+            self.last_data_s = time.monotonic()
+            self.__pending.extend(chunk)
+
+            if self.__binary:
+                frames, consumed = decode_telemetry(bytes(self.__pending))
+                del self.__pending[:consumed]
+                self.__buffer.extend(numpy.column_stack((frames["time_us"] / 1000,
+                                                         frames["position"])))
+            else:
+                rows, consumed = decode_lines(bytes(self.__pending))
+                del self.__pending[:consumed]
+                self.__buffer.extend(rows)
+
+    def stop(self):
+        """!
+        @brief Stop reading and wait for the thread to finish.
+        """
+        self.__stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+class LivePlot:
+    """!
+    @brief Redraws streamed data at a fixed frame rate from the Tk event loop.
+    Only the data line is redrawn each frame, blitted over a saved copy of the
+    axes background; the whole figure is redrawn only when the axis limits have
+    to grow. Nothing here waits on the serial port, so the window stays
+    responsive for the whole run.
+    """
+
+    def __init__(self, plot_axes, plot_canvas, buffer, reader, fps, idle_s, wait_s, on_done=None):
+        """!
+        @brief Start drawing; frames are scheduled with the Tk after() call.
+        @param plot_axes The set of axes to plot data onto, from Matplotlib
+        @param plot_canvas The canvas to plot data onto, from Matplotlib
+        @param buffer RingBuffer of (time in ms, position) rows to draw
+        @param reader SerialReader filling the buffer
+        @param fps Redraw rate in frames per second
+        @param idle_s Time without new data after which the run is finished, in seconds
+        @param wait_s Longest time to wait for the first data, in seconds
+        @param on_done Function called once the run is finished
+        """
+        self.__axes = plot_axes
+        self.__canvas = plot_canvas
+        self.__buffer = buffer
+        self.__reader = reader
+        self.__period_ms = max(1, int(1000 / fps))
+        self.__idle_s = idle_s
+        self.__wait_s = wait_s
+        self.__on_done = on_done
+        self.__background = None
+
+        self.__line, = plot_axes.plot([], [], animated=True)
+        self.__draw_id = plot_canvas.mpl_connect("draw_event", self.__on_draw)
+        plot_canvas.draw()
+
+        plot_canvas.get_tk_widget().after(self.__period_ms, self.__frame)
+
+    def __on_draw(self, event):
+        # The figure was redrawn, for example after a resize or a limit change,
+        # so the saved background is stale
+        self.__background = self.__canvas.copy_from_bbox(self.__axes.bbox)
+        self.__axes.draw_artist(self.__line)
+
+    def __frame(self):
+        data = self.__buffer.latest()
+
+        if len(data):
+            # Drawing more points than the axes have pixels only costs time
+            step = max(1, len(data) // 4000)
+            self.__line.set_data(data[::step, 0], data[::step, 1])
+
+            if self.__grow_limits(data):
+                self.__canvas.draw()
+            elif self.__background is not None:
+                self.__canvas.restore_region(self.__background)
+                self.__axes.draw_artist(self.__line)
+                self.__canvas.blit(self.__axes.bbox)
+
+        quiet_s = time.monotonic() - self.__reader.last_data_s
+        if not self.__reader.is_alive() or quiet_s > (self.__idle_s if len(data) else self.__wait_s):
+            self.__finish(len(data))
+        else:
+            self.__canvas.get_tk_widget().after(self.__period_ms, self.__frame)
+
+    def __grow_limits(self, data):
+        x_low, x_high = self.__axes.get_xlim()
+        y_low, y_high = self.__axes.get_ylim()
+        x_min, y_min = data.min(axis=0)
+        x_max, y_max = data.max(axis=0)
+
+        if x_min >= x_low and x_max <= x_high and y_min >= y_low and y_max <= y_high:
+            return False
+
+        # Grow past the data so limits change rarely during a run
+        x_span = max(x_max - x_min, 1)
+        y_span = max(y_max - y_min, 1)
+        self.__axes.set_xlim(min(x_low, x_min), max(x_high, x_max + x_span))
+        self.__axes.set_ylim(min(y_low, y_min - 0.1 * y_span), max(y_high, y_max + 0.1 * y_span))
+        return True
+
+    def __finish(self, count):
+        self.__reader.stop()
+        self.__canvas.mpl_disconnect(self.__draw_id)
+
+        if count == 0:
+            print("Failed to get data")
+
+        # Leave a normal artist behind so later redraws and Clear behave as usual
+        self.__line.set_animated(False)
+        self.__axes.relim()
+        self.__axes.autoscale_view()
+        self.__canvas.draw()
+
+        if self.__on_done is not None:
+            self.__on_done()
+
 
 def plot_step_data(plot_axes, plot_canvas, xlabel, ylabel, textbox: tkinter.Text):
     """!
     @brief Plot data from a real-world step response test.
-    This function reads data from a serial port, then strips lines of strings,
-    converting them to floating point numbers. Successfully gathered data is appended
-    to arrays of time and encoder count.
+    This function reads data from a serial port, either decoding binary telemetry
+    frames or stripping lines of strings and converting them to floating point
+    numbers. Successfully gathered data is appended to arrays of time and encoder count.
+    In live mode the data is read by a background thread and drawn as it
+    arrives, and this function returns as soon as the test has been started.
     @param plot_axes The set of axes to plot data onto, from Matplotlib
     @param plot_canvas The canvas to plot data onto, from Matplotlib
     @param xlabel The label for the horizontal axis
@@ -40,34 +475,93 @@ def plot_step_data(plot_axes, plot_canvas, xlabel, ylabel, textbox: tkinter.Text
 
     times = []
     voltages = []   
+    controls = None
 
-    ser = serial.Serial(__DEV_NAME, 115200, timeout=0.1) 
+    ser = open_port()
 
     serial_data = textbox.get(1.0, "end-1c")
 
     print(serial_data)
 
-    try:
-        ser.write((serial_data).encode())
-        while True:
-            line = ser.readline().decode()
-            
-            line = line.strip('\r\n')
+    if __LIVE_MODE and not __CAPTURE_MODE:
+        plot_axes.set_xlabel(xlabel)
+        plot_axes.set_ylabel(ylabel)
+        plot_axes.grid(True)
 
-            split_line = line.split(",")
+        buffer = RingBuffer(__LIVE_SAMPLES)
+        reader = SerialReader(ser, buffer, __TELEMETRY_BINARY)
 
-            if len(split_line) > 1:
+        def save_run():
+            data = buffer.latest()
+            archive_run(data[:, 0], data[:, 1], None, serial_data)
 
-                times.append(float(split_line[0]))
-                voltages.append(float(split_line[1]))
+        try:
+            ser.write(command_bytes(serial_data))
+            reader.start()
+        except Exception:
+            close_port()
+            raise
 
+        LivePlot(plot_axes, plot_canvas, buffer, reader,
+                 __LIVE_FPS, __LIVE_IDLE_S, __CAPTURE_WAIT_S, save_run)
+        return
 
-            if not line:
+    try:
+        ser.write(command_bytes(serial_data))
+
+        if __CAPTURE_MODE:
+            received = bytearray()
+            deadline = time.time() + __CAPTURE_WAIT_S
+            run = None
+            while run is None and time.time() < deadline:
+                received.extend(ser.read(4096))
+                run = decode_capture(bytes(received))
+
+            if run is None:
                 print("Failed to get data")
-                break
-    finally:
-        print("Closing serial port")
-        ser.close()
+            else:
+                times = run[0] / 1000
+                voltages = run[1]
+                controls = run[2]
+
+        elif __TELEMETRY_BINARY:
+            received = bytearray()
+            while True:
+                chunk = ser.read(4096)
+                if not chunk:
+                    break
+                received.extend(chunk)
+
+            frames, _ = decode_telemetry(bytes(received))
+            if len(frames) == 0:
+                print("Failed to get data")
+            times = frames["time_us"] / 1000
+            voltages = frames["position"]
+            controls = frames["control"]
+
+        else:
+            while True:
+                line = ser.readline().decode()
+                
+                line = line.strip('\r\n')
+
+                split_line = line.split(",")
+
+                if len(split_line) > 1:
+
+                    times.append(float(split_line[0]))
+                    voltages.append(float(split_line[1]))
+
+
+                if not line:
+                    print("Failed to get data")
+                    break
+    except Exception:
+        # The port may be in a bad state, so the next test opens it afresh
+        close_port()
+        raise
+
+    archive_run(times, voltages, controls, serial_data)
 
     # Draw the plot
     plot_axes.plot(times, voltages,marker=".")
@@ -77,6 +571,30 @@ def plot_step_data(plot_axes, plot_canvas, xlabel, ylabel, textbox: tkinter.Text
     plot_canvas.draw()
 
 
+def plot_history(plot_axes, plot_canvas, xlabel, ylabel):
+    """!
+    @brief Overlay the most recent runs saved in the run archive.
+    @param plot_axes The set of axes to plot data onto, from Matplotlib
+    @param plot_canvas The canvas to plot data onto, from Matplotlib
+    @param xlabel The label for the horizontal axis
+    @param ylabel The label for the vertical axis
+    """
+    if __ARCHIVE_DIR is None:
+        return
+    archive = run_archive.RunArchive(__ARCHIVE_DIR)
+    rows = archive.find(last=__HISTORY_RUNS)
+    run_archive.print_index(rows)
+    if len(rows) == 0:
+        print("No saved runs")
+        return
+
+    archive.overlay(plot_axes, rows["run_id"])
+    plot_axes.set_xlabel(xlabel)
+    plot_axes.set_ylabel(ylabel)
+    plot_axes.legend()
+    plot_axes.grid(True)
+    plot_canvas.draw()
+
 
 def tk_matplot(plot_function, xlabel, ylabel, title):
     """!
@@ -118,19 +636,24 @@ def tk_matplot(plot_function, xlabel, ylabel, title):
                                 text="Run Test",
                                 command=lambda: plot_function(axes, canvas, xlabel, ylabel, text_box)
                                 )
+    button_history = tkinter.Button(master=tk_root,
+                                    text="History",
+                                    command=lambda: plot_history(axes, canvas, xlabel, ylabel))
     
     
     # arrange things in a grid because "pack" is weird
-    canvas.get_tk_widget().grid(row=0, column=0, columnspan=4)
-    toolbar.grid(row=1, column=0, columnspan=4)
+    canvas.get_tk_widget().grid(row=0, column=0, columnspan=5)
+    toolbar.grid(row=1, column=0, columnspan=5)
     button_run.grid(row=2, column=0)
     text_box.grid(row=2, column=1)
-    button_clear.grid(row=2, column=2)
-    button_quit.grid(row=2, column=3)
+    button_history.grid(row=2, column=2)
+    button_clear.grid(row=2, column=3)
+    button_quit.grid(row=2, column=4)
 
 
     # this function runs until the user quits
     tkinter.mainloop()
+    close_port()
     
 
 
@@ -1,16 +1,63 @@
 """! @file encoder_reader.py
 
-
+Reads quadrature encoders with a hardware timer and estimates their velocity.
+Velocity is found by dividing the change in position by the measured time
+since the last read, then low pass filtered with a time constant, so it stays
+correct when reads are late or irregular. At low speeds, where only a few
+counts change between reads, the change can instead be measured over the time
+between count changes. Both use only integer arithmetic on small integers, so
+reading an encoder does not allocate and is safe from an interrupt.
+
+By default the timer counts through its full 16 bit range, and the change in
+count between reads is found with modular arithmetic, so position is exact as
+long as the shaft turns less than half the counter range between reads; see
+max_safe_speed(). A read that comes close to that limit sets a sticky flag.
+
+read_task can sample the encoder faster than the controller runs. With
+averaging on, each sample is also added to the window of the axis state
+block, which the controller decimates into a mean, see axis_state.py.
 """
 
 import platform
 import pyb
+import utime
+from axis_state import STATE, POSITION, VELOCITY, POSITION_US, POSITION_SUM, SAMPLE_COUNT, MAX_SAMPLES
 
 if "MicroPython" not in platform.platform():
     from me405_support import cotask, cqueue, task_share
 
   
-__AUTO_RELOAD_VALUE = 10000
+_AUTO_RELOAD_VALUE = 10000
+
+## Number of counts of a 16 bit timer counter
+FULL_RANGE_MODULUS = 1 << 16
+
+## Number of fractional bits in the velocity filter coefficient
+VELOCITY_FILTER_SHIFT = 8
+## Largest velocity magnitude in counts per second, keeping the filter
+## arithmetic within MicroPython's small integers
+VELOCITY_LIMIT = ((1 << 30) - 1) >> (VELOCITY_FILTER_SHIFT + 1)
+## Longest time in microseconds a velocity is measured over. Reads further apart
+## than this restart the estimate, and with low speed estimation a motor that
+## has not moved for this long is reported as stopped.
+VELOCITY_MAX_WINDOW_US = 100000
+
+
+def _rate(counts, time_us):
+    # counts * 1000000 // time_us without forming a product too large for a small integer
+    sign = 1
+    if counts < 0:
+        counts = -counts
+        sign = -1
+    # Whole multiples of the time give whole millions of counts per second; the
+    # remainder is scaled up a thousand at a time so no product exceeds 1000 * time_us
+    whole = counts // time_us
+    if whole > VELOCITY_LIMIT // 1000000:
+        return sign * VELOCITY_LIMIT
+    thousands = (counts % time_us) * 1000
+    units = (thousands % time_us) * 1000
+    return sign * (whole * 1000000 + (thousands // time_us) * 1000 + units // time_us)
+
 
 class Encoder:
 
@@ -24,7 +71,10 @@ class Encoder:
                   inApin: pyb.Pin.board,
                   inBpin: pyb.Pin.board,
                   timer_num: int,
-                  af_mode: int
+                  af_mode: int,
+                  velocity_tau_us: int = 5000,
+                  low_speed: bool = True,
+                  full_range: bool = True
                   ):
         """! 
             Creates an encoder timer that counts
@@ -32,14 +82,28 @@ class Encoder:
             @param inBpin Pyboard pin used to read encoder channel B
             @param timer_num Timer number associated with pin alternate functions
             @param af_mode Alternate function timer to use
+            @param velocity_tau_us Time constant of the velocity low pass filter
+                in microseconds, or 0 for no filtering
+            @param low_speed True to measure velocity over the time between
+                count changes, rather than between reads, when the motor is slow
+            @param full_range True to count through the full 16 bit timer range,
+                False to wrap every _AUTO_RELOAD_VALUE counts
         """
 
         self.__encA_pin = pyb.Pin(inApin, mode=pyb.Pin.AF_PP, af=af_mode)
         self.__encB_pin = pyb.Pin(inBpin, mode=pyb.Pin.AF_PP, af=af_mode)
-        self.__enc_timer = pyb.Timer(timer_num, prescaler=0, period=__AUTO_RELOAD_VALUE-1)
+        self.__modulus = FULL_RANGE_MODULUS if full_range else _AUTO_RELOAD_VALUE
+        self.__enc_timer = pyb.Timer(timer_num, prescaler=0, period=self.__modulus-1)
         
         self.__timer_channel = self.__enc_timer.channel(1,pyb.Timer.ENC_AB)
 
+        self.__capture = None
+        self.__probe = None
+        self.__velocity_tau_us = velocity_tau_us
+        self.__low_speed = low_speed
+        self.__averaging = False
+        self.__wrap_warning = (self.__modulus * 3) >> 3
+
         self.zero()
     
 
@@ -50,62 +114,219 @@ class Encoder:
             @return Position since last zero
         """        
 
+        now = utime.ticks_us()
         current_count = self.__enc_timer.counter()
 
-        count_delta = self.__last_count - current_count
-
-        if(abs(count_delta) > __AUTO_RELOAD_VALUE/2):
-
-            if(count_delta < 0):
-                count_delta += __AUTO_RELOAD_VALUE-1
-
-            else:
-                count_delta -= __AUTO_RELOAD_VALUE-1
+        # Change in count taken modulo the counter range, as the signed value
+        # closest to zero, which is correct across a wrap as long as the true
+        # change is less than half the range
+        modulus = self.__modulus
+        count_delta = (self.__last_count - current_count) % modulus
+        if count_delta >= modulus >> 1:
+            count_delta -= modulus
+
+        # A change close to half the range, or a speed that predicts one, means
+        # a wrap may have been missed
+        if count_delta > self.__wrap_warning or count_delta < -self.__wrap_warning:
+            self.wrap_suspect = True
+        else:
+            elapsed = utime.ticks_diff(now, self.__last_read_us)
+            speed = self.__velocity if self.__velocity >= 0 else -self.__velocity
+            # speed * elapsed / 1000000, approximated with shifts to stay a small integer
+            if elapsed <= VELOCITY_MAX_WINDOW_US and (speed * (elapsed >> 10)) >> 10 >= modulus >> 1:
+                self.wrap_suspect = True
 
         self.__last_count = current_count
 
         self.__position += count_delta
 
+        self.__update_velocity(count_delta, now)
+
         return self.__position
+
+
+    def __update_velocity(self, count_delta, now):
+
+        elapsed = utime.ticks_diff(now, self.__last_read_us)
+        self.__last_read_us = now
+
+        if elapsed <= 0:
+            return
+
+        if elapsed > VELOCITY_MAX_WINDOW_US:
+            # Too long since the last read for a meaningful difference, such as
+            # when the read task was idle between runs
+            self.__restart_velocity(now)
+            return
+
+        if self.__low_speed:
+            window = utime.ticks_diff(now, self.__change_us)
+
+            if count_delta != 0:
+                # Difference over the time since the count last changed, which
+                # is the time since the last read whenever the motor is fast
+                raw = _rate(self.__position - self.__change_position, window)
+                self.__change_us = now
+                self.__change_position = self.__position
+
+            elif window >= VELOCITY_MAX_WINDOW_US:
+                raw = 0
+                self.__change_us = now
+
+            else:
+                # No new count yet, so the motor is moving at most one count per window
+                bound = _rate(1, window)
+                raw = self.__raw_velocity
+                if raw > bound:
+                    raw = bound
+                elif raw < -bound:
+                    raw = -bound
+
+        else:
+            raw = _rate(count_delta, elapsed)
+
+        if raw > VELOCITY_LIMIT:
+            raw = VELOCITY_LIMIT
+        elif raw < -VELOCITY_LIMIT:
+            raw = -VELOCITY_LIMIT
+        self.__raw_velocity = raw
+
+        # First order low pass filter with a coefficient set by the elapsed time
+        tau = self.__velocity_tau_us
+        if tau > 0:
+            alpha = (elapsed << VELOCITY_FILTER_SHIFT) // (tau + elapsed)
+            self.__velocity += ((raw - self.__velocity) * alpha) >> VELOCITY_FILTER_SHIFT
+        else:
+            self.__velocity = raw
+
+
+    def __restart_velocity(self, now):
+
+        self.__last_read_us = now
+        self.__change_us = now
+        self.__change_position = self.__position
+        self.__raw_velocity = 0
+        self.__velocity = 0
     
 
-    def read_task(self, shares):
+    def read_task(self, state):
 
         """! 
-            Read the current position
-            @return Position since last zero
+            Read the current position and velocity
+            @param state AxisState whose STATE field enables the task; the
+                position, velocity and time of each read go in its POSITION,
+                VELOCITY and POSITION_US fields, and with averaging on the
+                position is also added to POSITION_SUM
         """        
 
-        position_share, task_state_share = shares
+        ints = state.ints
 
         while True:
 
-            state = task_state_share.get()
-
-            if state == 0:
+            if ints[STATE] == 0:
                 pass
 
             else:
-                current_count = self.__enc_timer.counter()
+                self.read()
+            
+                ints[POSITION] = self.__position
+                ints[VELOCITY] = self.__velocity
+                ints[POSITION_US] = self.__last_read_us
+
+                if self.__averaging:
+                    count = ints[SAMPLE_COUNT]
+                    if count < MAX_SAMPLES:
+                        ints[POSITION_SUM] += self.__position
+                        ints[SAMPLE_COUNT] = count + 1
+                    else:
+                        ints[POSITION_SUM] = self.__position
+                        ints[SAMPLE_COUNT] = 1
 
-                count_delta = self.__last_count - current_count
+                if self.__probe is not None:
+                    self.__probe.sensed()
 
-                if(abs(count_delta) > __AUTO_RELOAD_VALUE/2):
+                if self.__capture is not None:
+                    self.__capture.record_position(self.__position)
 
-                    if(count_delta < 0):
-                        count_delta += __AUTO_RELOAD_VALUE-1
+            yield 0
+    
 
-                    else:
-                        count_delta -= __AUTO_RELOAD_VALUE-1
+    def set_capture(self, capture):
 
-                self.__last_count = current_count
+        """! 
+            Records every position read by read_task into a capture buffer
+            @param capture CaptureBuffer to record into, or None to stop recording
+        """
 
-                self.__position += count_delta
-            
-                position_share.put(self.__position)
+        self.__capture = capture
+
+
+    def set_averaging(self, averaging):
+
+        """! 
+            Chooses whether read_task sums its positions for the controller
+            to average, or leaves it only the latest position
+            @param averaging True to sum every position read by read_task
+        """
+
+        self.__averaging = averaging
+
+
+    def set_probe(self, probe):
+
+        """! 
+            Marks every position read by read_task on a latency probe
+            @param probe LatencyProbe to mark, or None to stop measuring
+        """
+
+        self.__probe = probe
+
+
+    def get_position(self):
+
+        """! 
+            Returns the position found by the most recent read without reading the timer
+            @return Position since last zero
+        """
+
+        return self.__position
+
+
+    def publish(self, ints):
+
+        """! 
+            Copies the results of the most recent read into an axis state
+            block without reading the timer; does not allocate
+            @param ints Integer fields of an AxisState, which receive the
+                position, velocity and time of the read
+        """
+
+        ints[POSITION] = self.__position
+        ints[VELOCITY] = self.__velocity
+        ints[POSITION_US] = self.__last_read_us
+
+
+    def max_safe_speed(self, read_period_us: int):
+
+        """! 
+            Returns the fastest speed that is tracked without error when the
+            encoder is read at a given period
+            @param read_period_us Longest time between reads in microseconds
+            @return Speed in counts per second
+        """
+
+        return ((self.__modulus >> 1) - 1) * 1000000 // read_period_us
+
+
+    def get_velocity(self):
+
+        """! 
+            Returns the filtered velocity found by the most recent read
+            @return Velocity in counts per second
+        """
+
+        return self.__velocity
 
-            yield 0
-    
 
     def zero(self):
 
@@ -116,5 +337,10 @@ class Encoder:
         self.__last_count = 0
         self.__position = 0
         self.__enc_timer.counter(0)
+        ## True once a read has changed by nearly half the counter range, or
+        ## the speed predicted such a change, so a wrap may have been missed.
+        ## Stays set until the next zero.
+        self.wrap_suspect = False
+        self.__restart_velocity(utime.ticks_us())
         
 
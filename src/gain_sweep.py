@@ -0,0 +1,285 @@
+"""! @file gain_sweep.py
+
+Runs step response tests for a list or grid of PID gains back to back and
+scores them all at once. Runs on a PC connected to the board, like display.py.
+Each run sends "Kp,Ki,Kd" to the board, waits for the response using the same
+serial modes as display.py, and resamples it onto a time grid shared by every
+run. The runs are stored as one NumPy array, scored with step_metrics.py, and
+printed from best to worst integral of absolute error. Each run can also be
+saved to a run archive, see run_archive.py, to compare with later sweeps.
+
+Given a list of periods, the sweep is repeated at each control period, set
+with the board's "period" command, and the longest period at which some gains
+still meet the overshoot and settling time limits is reported. The encoder
+keeps its own sample period, so slower control does not coarsen the data.
+
+Usage: python src/gain_sweep.py --port COM6 --kp 0.01 0.02 0.03 --ki 0 0.0001
+                                [--kd 0] [--target 16384] [--out sweep.npz]
+                                [--archive runs] [--plot]
+                                [--periods 10 20 40 [--period-task controller]
+                                 [--max-overshoot 5] [--max-settling 800]]
+"""
+
+import argparse
+import itertools
+import time
+import numpy
+import serial
+import display
+import run_archive
+import step_metrics
+
+
+## Pause between the end of one run and the start of the next, in seconds
+SETTLE_S = 0.5
+
+## Spacing of the time grid shared by every run, in ms
+GRID_MS = 1
+
+
+def gain_grid(kp, ki=(0,), kd=(0,)):
+    """!
+    @brief Make every combination of the given gains.
+    @param kp Proportional gains to try
+    @param ki Integral gains to try
+    @param kd Derivative gains to try
+    @return Array of shape (runs, 3) of (Kp, Ki, Kd) rows
+    """
+    return numpy.array(list(itertools.product(kp, ki, kd)), dtype=float).reshape(-1, 3)
+
+
+def decode_run(received, capture=True, binary=True):
+    """!
+    @brief Decode one step response from the bytes a board sent.
+    @param received Bytes received since the run command was sent
+    @param capture True if the board sends the run in one dump when it ends
+    @param binary True if the board streams binary telemetry frames rather than text
+    @return Tuple of arrays of times in ms, positions and controller outputs,
+        which are None for text lines, or None if no complete run is present
+    """
+    if capture:
+        run = display.decode_capture(bytes(received))
+        return None if run is None else (run[0] / 1000, run[1], run[2])
+
+    if binary:
+        frames, _ = display.decode_telemetry(bytes(received))
+        times, positions, controls = frames["time_us"] / 1000, frames["position"], frames["control"]
+    else:
+        rows, _ = display.decode_lines(bytes(received))
+        times, positions, controls = rows[:, 0], rows[:, 1], None
+
+    return (times, positions, controls) if len(times) else None
+
+
+def run_step_test(port, gains, capture=True, binary=True, wait_s=5, idle_s=0.5):
+    """!
+    @brief Run one step response test on the board.
+    @param port Open serial port, with a read timeout set
+    @param gains Sequence of (Kp, Ki, Kd)
+    @param capture True if the board sends the run in one dump when it ends
+    @param binary True if the board streams binary telemetry frames rather than text
+    @param wait_s Longest time to wait for the run, in seconds
+    @param idle_s Time without streamed data after which the run is finished, in seconds
+    @return Tuple of arrays of times in ms, positions and controller outputs,
+        which are None for text lines, or None if no data arrived
+    """
+    port.reset_input_buffer()
+    port.write("{},{},{}\n".format(*gains).encode())
+
+    received = bytearray()
+    deadline = time.monotonic() + wait_s
+    last_data_s = None
+
+    while time.monotonic() < deadline:
+        chunk = port.read(max(1, port.in_waiting))
+        if chunk:
+            received.extend(chunk)
+            last_data_s = time.monotonic()
+
+        if capture:
+            run = decode_run(received)
+            if run is not None:
+                return run
+        elif last_data_s is not None and time.monotonic() - last_data_s > idle_s:
+            break
+
+    return None if capture else decode_run(received, False, binary)
+
+
+def score_runs(runs, target):
+    """!
+    @brief Resample runs onto a shared time grid and score them all at once.
+    @param runs List of (times in ms, positions, controller outputs) tuples,
+        or None for failed runs
+    @param target Step size in encoder ticks
+    @return Tuple of the time grid in ms, an array of shape (runs, samples) of
+        positions and the dictionary of step_metrics.step_metrics. Failed runs
+        are rows of NaN with NaN figures.
+    """
+    ends = [run[0][-1] for run in runs if run is not None]
+    grid = numpy.arange(0, (max(ends) if ends else 0) + GRID_MS, GRID_MS)
+
+    positions = numpy.full((len(runs), len(grid)), numpy.nan)
+    for index, run in enumerate(runs):
+        if run is not None:
+            positions[index] = step_metrics.resample(run[0], run[1], grid)
+
+    failed = numpy.isnan(positions).any(axis=1)
+    metrics = step_metrics.step_metrics(grid, numpy.where(failed[:, None], 0, positions), target)
+    for values in metrics.values():
+        values[failed] = numpy.nan
+
+    return grid, positions, metrics
+
+
+def set_period(port, task, period_ms):
+    """!
+    @brief Change the period of one task of the selected axes on the board.
+    @param port Open serial port
+    @param task Task key of the axis table, such as "controller"
+    @param period_ms New period in ms
+    """
+    port.write("period {} {}\n".format(task, period_ms).encode())
+    time.sleep(SETTLE_S)
+    port.reset_input_buffer()
+
+
+def run_sweep(port, gains, target, archive=None, periods=None, period_task="controller",
+              **test_options):
+    """!
+    @brief Run a step response test for every row of gains and score them.
+    @param port Open serial port, with a read timeout set
+    @param gains Array of (Kp, Ki, Kd) rows, such as from gain_grid
+    @param target Step size in encoder ticks
+    @param archive RunArchive every successful run is saved to, or None
+    @param periods Control periods in ms to run every row of gains at, or
+        None to leave the board's period as it is
+    @param period_task Task key whose period is set, such as "controller",
+        "loop" or "inner" depending on the loop mode
+    @param test_options Keyword arguments passed on to run_step_test
+    @return Dictionary of "gains", "times", "positions" and every step figure,
+        and with periods, "period_ms" of each run
+    """
+    runs = []
+    rows = []
+    run_periods = []
+    for period_ms in (periods if periods is not None else [None]):
+        if period_ms is not None:
+            set_period(port, period_task, period_ms)
+        for row in gains:
+            runs.append(run_step_test(port, row, **test_options))
+            rows.append(row)
+            run_periods.append(numpy.nan if period_ms is None else period_ms)
+            label = "sweep" if period_ms is None else "sweep {} ms".format(period_ms)
+            if archive is not None and runs[-1] is not None:
+                archive.add(*runs[-1], gains=row, target=target, label=label)
+            print("{}Kp={:g} Ki={:g} Kd={:g}: {}".format(
+                "" if period_ms is None else "{} ms ".format(period_ms),
+                *row, "ok" if runs[-1] is not None else "no data"))
+            time.sleep(SETTLE_S)
+
+    times, positions, metrics = score_runs(runs, target)
+    result = dict(gains=numpy.asarray(rows, dtype=float).reshape(-1, 3),
+                  times=times, positions=positions, **metrics)
+    if periods is not None:
+        result["period_ms"] = numpy.asarray(run_periods, dtype=float)
+    return result
+
+
+def cheapest_period(result, max_overshoot_pct, max_settling_ms):
+    """!
+    @brief Find the slowest control rate at which some gains meet the response limits.
+    @param result Dictionary returned by run_sweep with periods
+    @param max_overshoot_pct Largest allowed overshoot in percent
+    @param max_settling_ms Longest allowed settling time in ms
+    @return Index of the run with the longest period meeting both limits,
+        the lowest integral of absolute error breaking ties, or None
+    """
+    with numpy.errstate(invalid="ignore"):
+        passing = ((result["overshoot_pct"] <= max_overshoot_pct)
+                   & (result["settling_ms"] <= max_settling_ms))
+    if not passing.any():
+        return None
+    candidates = numpy.flatnonzero(passing)
+    # Longest period first, then lowest error
+    order = numpy.lexsort((result["iae"][candidates], -result["period_ms"][candidates]))
+    return int(candidates[order[0]])
+
+
+def print_ranking(result):
+    """!
+    @brief Print every run of a sweep from lowest to highest integral of absolute error.
+    @param result Dictionary returned by run_sweep
+    """
+    periods = result.get("period_ms")
+    print("{}{:>10s} {:>10s} {:>10s} {:>9s} {:>10s} {:>11s} {:>9s} {:>8s}".format(
+        "" if periods is None else "{:>9s} ".format("period ms"),
+        "Kp", "Ki", "Kd", "rise ms", "overshoot", "settle ms", "ss error", "IAE"))
+    for index in numpy.argsort(result["iae"]):
+        print("{}{:>10g} {:>10g} {:>10g} {:>9.1f} {:>9.1f}% {:>11.1f} {:>9.1f} {:>8.4f}".format(
+            "" if periods is None else "{:>9g} ".format(periods[index]),
+            *result["gains"][index], result["rise_ms"][index], result["overshoot_pct"][index],
+            result["settling_ms"][index], result["steady_state_error"][index],
+            result["iae"][index]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--port", required=True, help="Serial device of the board")
+    parser.add_argument("--kp", type=float, nargs="+", required=True)
+    parser.add_argument("--ki", type=float, nargs="+", default=[0])
+    parser.add_argument("--kd", type=float, nargs="+", default=[0])
+    parser.add_argument("--target", type=float, default=16384, help="Step size in encoder ticks")
+    parser.add_argument("--stream", action="store_true",
+                        help="Board streams data instead of sending a capture dump")
+    parser.add_argument("--text", action="store_true",
+                        help="Board streams text lines instead of binary telemetry")
+    parser.add_argument("--out", default="sweep.npz", help="File the runs are saved to")
+    parser.add_argument("--archive", help="Run archive directory each run is also saved to")
+    parser.add_argument("--plot", action="store_true", help="Plot every run when done")
+    parser.add_argument("--periods", type=int, nargs="+",
+                        help="Control periods in ms to repeat the sweep at")
+    parser.add_argument("--period-task", default="controller",
+                        help="Axis task whose period is set: controller, loop or inner")
+    parser.add_argument("--max-overshoot", type=float, default=5,
+                        help="Largest overshoot in percent meeting the spec")
+    parser.add_argument("--max-settling", type=float, default=800,
+                        help="Longest settling time in ms meeting the spec")
+    args = parser.parse_args()
+
+    gains = gain_grid(args.kp, args.ki, args.kd)
+    with serial.Serial(args.port, 115200, timeout=0.1) as port:
+        result = run_sweep(port, gains, args.target,
+                           run_archive.RunArchive(args.archive) if args.archive else None,
+                           args.periods, args.period_task,
+                           capture=not args.stream, binary=not args.text)
+
+    numpy.savez(args.out, **result)
+    print_ranking(result)
+    print("Saved {} runs to {}".format(len(result["gains"]), args.out))
+
+    if args.periods:
+        best = cheapest_period(result, args.max_overshoot, args.max_settling)
+        if best is None:
+            print("No period meets {:g}% overshoot and {:g} ms settling".format(
+                args.max_overshoot, args.max_settling))
+        else:
+            print("Longest control period meeting the spec: {:g} ms with Kp={:g} Ki={:g} Kd={:g}".format(
+                result["period_ms"][best], *result["gains"][best]))
+
+    if args.plot:
+        from matplotlib import pyplot
+        for index, (row, positions) in enumerate(zip(result["gains"], result["positions"])):
+            label = "Kp={:g} Ki={:g} Kd={:g}".format(*row)
+            if "period_ms" in result:
+                label = "{:g} ms ".format(result["period_ms"][index]) + label
+            pyplot.plot(result["times"], positions, label=label)
+        pyplot.xlabel("Time [ms]")
+        pyplot.ylabel("Encoder Ticks [#]")
+        pyplot.legend()
+        pyplot.grid(True)
+        pyplot.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""! @file idle_gc.py
+
+Runs garbage collection only in the idle time between task runs, so a
+collection pause never delays a control tick. MicroPython collects
+automatically when an allocation finds no free block. That can happen in the
+middle of any task, and the pause holds the scheduler for as long as the
+collection takes. IdleCollector keeps at least a reserve of heap free, so the
+automatic collection has no reason to run, by collecting ahead of time. It
+only collects when memory is running low and the next release of every
+periodic task is further away than the longest pause measured so far.
+
+MicroPython's collector is not incremental, so each pause covers the whole
+heap. A task set with no gap between releases as long as one pause, such as a
+2 ms cascade inner loop, never leaves room. Those deferrals are counted, the
+automatic collection remains as the last resort, and warning() says so.
+
+A guard time is kept free after each collection, a fraction of the longest
+pause measured, or of the shortest task period before any is measured, so it
+scales with the task set rather than ruling out short periods.
+"""
+
+import gc
+import utime
+from timing_stats import TimingStats
+
+
+## Free heap in bytes below which a collection is due
+RESERVE_BYTES = 16384
+
+## The guard time kept between the end of a collection and the next task
+## release is the longest pause measured, or before the first collection the
+## shortest task period, divided by this
+GUARD_DIVISOR = 4
+
+## Guard time in microseconds when no task period is known
+DEFAULT_GUARD_US = 1000
+
+
+class IdleCollector:
+    """!
+    Collects garbage in the gaps between task releases
+    """
+
+    def __init__(self, stats_list, reserve_bytes=RESERVE_BYTES, guard_us=None):
+        """!
+            Creates a collector
+            @param stats_list List of TaskStats of every task, whose recorded
+                releases give the time until the next task is due
+            @param reserve_bytes Free heap in bytes below which a collection is due
+            @param guard_us Time in microseconds to leave free after a
+                collection, or None to derive it, see guard()
+        """
+        self.__stats_list = stats_list
+        self.reserve_bytes = reserve_bytes
+        self.__guard_us = guard_us
+        ## Duration of each collection
+        self.pause = TimingStats(500, 20)
+        ## Number of due collections that had to wait for a long enough gap
+        self.deferrals = 0
+        self.__waiting = False
+
+
+    def shortest_period_us(self):
+        """!
+            @return Shortest period of the periodic tasks in microseconds, or
+                None if there are none
+        """
+        shortest = None
+        for stats in self.__stats_list:
+            if stats.period_us is not None and (shortest is None or stats.period_us < shortest):
+                shortest = stats.period_us
+        return shortest
+
+
+    def guard(self):
+        """!
+            Finds the time to leave free after a collection
+            @return The guard time given when created, or else the longest
+                pause measured divided by GUARD_DIVISOR, or before any pause is
+                measured the shortest task period divided by GUARD_DIVISOR
+        """
+        if self.__guard_us is not None:
+            return self.__guard_us
+        if self.pause.count:
+            return self.pause.maximum // GUARD_DIVISOR
+        shortest = self.shortest_period_us()
+        if shortest is None:
+            return DEFAULT_GUARD_US
+        return shortest // GUARD_DIVISOR
+
+
+    def warning(self):
+        """!
+            Explains why due collections are not running in idle time
+            @return Warning as a string, or None when collections have run in
+                idle time and the task set still leaves room for them
+        """
+        if not self.deferrals:
+            return None
+        needed = self.pause.maximum + self.guard()
+        shortest = self.shortest_period_us()
+        if self.pause.count and (shortest is None or shortest > needed):
+            return None
+        return ("warning: {} idle garbage collections so far, {} deferred; a gap of {} us "
+                "is needed and the shortest task period is {} us, so collection falls back "
+                "to automatic pauses inside tasks").format(
+                    self.pause.count, self.deferrals, needed, shortest)
+
+
+    def slack_us(self):
+        """!
+            Finds the time until the next periodic task release. Tasks that
+            have not run since they started or changed period are left out,
+            as their releases are not known yet.
+            @return Time in microseconds until the next release, or None if a
+                task is already due or no releases are known
+        """
+        now = utime.ticks_us()
+        slack = None
+        for stats in self.__stats_list:
+            release = stats.next_release()
+            if release is None:
+                continue
+            remaining = utime.ticks_diff(release, now)
+            if remaining <= 0:
+                return None
+            if slack is None or remaining < slack:
+                slack = remaining
+        return slack
+
+
+    def poll(self):
+        """!
+            Collects garbage if memory is low and there is time before the
+            next task release; call on every pass of the scheduler loop
+            @return True if a collection ran
+        """
+        if gc.mem_free() >= self.reserve_bytes:
+            return False
+
+        slack = self.slack_us()
+        if slack is None or slack < self.pause.maximum + self.guard():
+            if not self.__waiting:
+                self.deferrals += 1
+                self.__waiting = True
+            return False
+
+        start = utime.ticks_us()
+        gc.collect()
+        self.pause.add(utime.ticks_diff(utime.ticks_us(), start))
+        self.__waiting = False
+        return True
+
+
+    def __repr__(self):
+        text = "idle collections: {} deferrals, free {} bytes, pause {}".format(
+            self.deferrals, gc.mem_free(), self.pause)
+        warning = self.warning()
+        if warning is not None:
+            text += "\n" + warning
+        return text
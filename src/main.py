@@ -2,13 +2,19 @@
 
 """
 
+import math
 import pyb
 import utime
 import micropython
-import PID_controller
-from motor_driver import MotorDriver as Motor
 from servo_driver import ServoDriver as Servo
-import encoder_reader
+import axis
+import axis_state
+import commands
+import idle_gc
+import schedule
+import telemetry
+import timing_stats
+from timing_stats import TaskStats, timed
 import platform
 import cotask
 import task_share
@@ -21,55 +27,142 @@ if "MicroPython" not in platform.platform():
 micropython.alloc_emergency_exception_buf(100)
 
 
-## Constant defining the pin to be used for channel A of the encoder
-ENCODER1_PIN_A = pyb.Pin.board.PB6
-## Constant defining the pin to be used for channel B of the encoder
-ENCODER1_PIN_B = pyb.Pin.board.PB7
-## Enable pin for the motor driver
-MOTOR1_EN_PIN = pyb.Pin.board.PC1
-## Motor 1 channel B control pin
-MOTOR1_INB_PIN = pyb.Pin.board.PA1
-## Motor 1 channel A control pin
-MOTOR1_INA_PIN = pyb.Pin.board.PA0
-
-MOTOR1_SPEED_TASK_PRIORITY = 3
-MOTOR1_SPEED_TASK_PERIOD = 10
-
-MOTOR1_POSITION_TASK_PRIORITY = 2
-MOTOR1_POSITION_TASK_PERIOD = 10
-
-MOTOR1_CONTROLLER_TASK_PRIORITY = 1
-MOTOR1_CONTROLLER_TASK_PERIOD = 10
+## Control mode used by every axis unless its table entry says otherwise.
+## "split" runs the encoder, controller and motor as three tasks; "fused"
+## reads, computes and actuates in a single task; "timer" runs the fused
+## update from a hardware timer interrupt outside of cotask; "cascade" runs a
+## slower position loop setting the velocity held by a fast velocity loop task
+LOOP_MODE = "split"
+
+## Motion profile of every run: "step" jumps straight to the target, while
+## "trapezoid" and "s_curve" follow a planned move, see motion_profile.py
+PROFILE = "trapezoid"
+
+## Table of motor axes, see axis.py. Each IHM04A1 channel drives one motor;
+## encoders use the 16 bit timers TIM4 and TIM8, PWM uses TIM2 and TIM3, and
+## the basic timers TIM6 and TIM7 are free for "timer" mode control loops.
+## The "split" tasks share a period, so their priorities order each tick as
+## encoder, then controller, then motor: every output is applied in the tick
+## its position was read.
+AXES = [
+    {
+        "name": "motor1",
+        "motor": {"en_pin": pyb.Pin.board.PC1,
+                  "in1_pin": pyb.Pin.board.PA0, "in1_timer": 2, "in1_channel": 1,
+                  "in2_pin": pyb.Pin.board.PA1, "in2_timer": 2, "in2_channel": 2,
+                  "pwm_freq": 30000},
+        "encoder": {"pin_a": pyb.Pin.board.PB6, "pin_b": pyb.Pin.board.PB7,
+                    "timer": 4, "af": pyb.Pin.AF2_TIM4},
+        "controller": {"Kp": 0.03, "Ki": 0.0001, "out_min": -100, "out_max": 100, "i_limit": 20},
+        "target": 16384,
+        "loop_mode": LOOP_MODE,
+        "cascade": {"position": {"Kp": 10, "out_min": -30000, "out_max": 30000},
+                    "velocity": {"Kp": 0.004, "Ki": 0.0004, "Kf": 0.003,
+                                 "out_min": -100, "out_max": 100, "i_limit": 20}},
+        "profile": {"type": PROFILE, "max_velocity": 30000, "max_acceleration": 400000,
+                    "max_jerk": 8000000, "velocity_ff": 0.00315, "acceleration_ff": 0.00015},
+        "tasks": {"motor": (1, 10), "encoder": (3, 10), "controller": (2, 10), "loop": (3, 10),
+                  "inner": (3, 2), "outer": (2, 10)},
+        "loop_timer": 6,
+        "loop_freq": 1000,
+        "record": True,
+    },
+    {
+        "name": "motor2",
+        "enabled": False,
+        "motor": {"en_pin": pyb.Pin.board.PA10,
+                  "in1_pin": pyb.Pin.board.PB4, "in1_timer": 3, "in1_channel": 1,
+                  "in2_pin": pyb.Pin.board.PB5, "in2_timer": 3, "in2_channel": 2,
+                  "pwm_freq": 30000},
+        "encoder": {"pin_a": pyb.Pin.board.PC6, "pin_b": pyb.Pin.board.PC7,
+                    "timer": 8, "af": pyb.Pin.AF3_TIM8},
+        "controller": {"Kp": 0.03, "Ki": 0.0001, "out_min": -100, "out_max": 100, "i_limit": 20},
+        "target": 16384,
+        "loop_mode": LOOP_MODE,
+        "cascade": {"position": {"Kp": 10, "out_min": -30000, "out_max": 30000},
+                    "velocity": {"Kp": 0.004, "Ki": 0.0004, "Kf": 0.003,
+                                 "out_min": -100, "out_max": 100, "i_limit": 20}},
+        "profile": {"type": PROFILE, "max_velocity": 30000, "max_acceleration": 400000,
+                    "max_jerk": 8000000, "velocity_ff": 0.00315, "acceleration_ff": 0.00015},
+        "tasks": {"motor": (1, 10), "encoder": (3, 10), "controller": (2, 10), "loop": (3, 10),
+                  "inner": (3, 2), "outer": (2, 10)},
+        "loop_timer": 7,
+        "loop_freq": 1000,
+    },
+]
+
+## Table of servos, with arguments for ServoDriver. A prescaler of 79 and
+## auto reload of 19999 give a 50 Hz period with 1 us ticks. A servo with
+## "waypoints", a list of (time in ms, angle) pairs, repeats that motion;
+## otherwise it sweeps its full range one degree per task run.
+SERVOS = [
+    {
+        "name": "servo1",
+        "pin": pyb.Pin.board.PA8, "timer": 1, "channel": 1,
+        "min_pulse": 600, "max_pulse": 2600,    # uSec
+        "angle_range": 180,                     # deg
+        "arr": 19999, "ps": 79,
+        "task": (0, 10),
+    },
+]
+
+MOTOR_PRINTING_TASK_PRIORITY = 0
+## Period of the motor data stream in ms. Each run sends every sample the
+## recorded axis captured since the last one, so a 1 kHz axis is logged at
+## 1 kHz, ten frames per run, without a task fast enough to outrank control
+MOTOR_PRINTING_TASK_PERIOD = 10
+
+## Stream motor data as binary telemetry frames rather than text lines
+TELEMETRY_BINARY = True
+## Number of telemetry frames sent in each USB write
+TELEMETRY_FRAMES_PER_WRITE = 10
+
+## Record step responses on the board and send them after the run, instead of
+## streaming data while the controller is running
+CAPTURE_STEP_RESPONSE = True
+
+## Ways the recorded axis can send its data to the PC, chosen with the
+## "telemetry" command: "capture" sends the whole run after it ends, "binary"
+## and "text" stream it while it runs, and "off" sends nothing
+TELEMETRY_MODES = ("capture", "binary", "text", "off")
+## Telemetry modes whose data is binary, which any text on the link would
+## break up, so the heartbeat stays quiet in them
+BINARY_TELEMETRY_MODES = ("capture", "binary")
+
+HB_TASK_PRIORITY = 0
+HB_TASK_PERIOD = 1000
 
-MOTOR1_PRINTING_TASK_PRIORITY = 4
-MOTOR1_PRINTING_TASK_PERIOD = 10
+## How task priorities are chosen, see schedule.py: "rate_monotonic" ranks
+## tasks by period, "deadline_monotonic" by TASK_DEADLINES_MS, and "table" uses
+## the priorities in the tables above as they are. Under the first two, table
+## priorities only order tasks of equal period, so there the control tasks
+## come before the servo and printing tasks.
+SCHEDULING = "rate_monotonic"
 
-HB_TASK_PRIORITY = 999
-HB_TASK_PERIOD = 1000
+## Deadlines in ms, by task name, of tasks that must finish sooner than their
+## period for "deadline_monotonic" scheduling
+TASK_DEADLINES_MS = {}
 
-# servo task setup
-SERVO1_POS_UPDATE_PRIO = 10
-SERVO1_POS_UPDATE_PERIOD = 10   # arbitrary, unsure of correct value
+## Refuse to start when the run times measured in the last session show that
+## a task can miss its deadline, rather than only printing a warning. Off by
+## default, since a single slow run saved to RUN_TIMES_FILE would otherwise
+## keep the board from starting until the file is deleted.
+SCHEDULE_STRICT = False
 
-# constants to set servo freq to 50hz w/ tick int of 1us
-SERVO_ARR = 19999
-SERVO_PS = 79
+## File keeping the worst measured run times between sessions
+RUN_TIMES_FILE = "run_times.json"
 
-# servo angle specific constants
-## In mircoseconds
-SERVO1_MIN_PULSE = 600      # uSec
-## In mircoseconds
-SERVO1_MAX_PULSE = 2600     # uSec
-## In mircoseconds
-SERVO1_ANGLE_RANGE = 180    # deg
+## Fraction by which a measured run time must differ from the saved one before
+## RUN_TIMES_FILE is written again, so flash is not rewritten after every test
+RUN_TIMES_TOLERANCE = 0.2
 
-# servo pin and timer declarations
-SERVO1_PIN = pyb.Pin.board.PA8
-SERVO1_TIMER_NUM = 1
-SERVO1_TIMER_CHAN = 1
+## Record the heap allocated by every task run from startup; the "alloc"
+## command also turns this on and off and reports the worst offenders
+TRACK_ALLOCATIONS = False
 
-## Constant defining the timer number of the pins used for encoder 1
-ENCODER1_TIMER_NUMBER = 4 
+## Free heap in bytes below which a garbage collection is run in the idle time
+## between task releases, see idle_gc.py
+GC_RESERVE_BYTES = 16384
 
 ## Maximum time to wait before ending the step response test in ms
 TIMEOUT_MS = 2000
@@ -77,7 +170,8 @@ TIMEOUT_MS = 2000
 
 def heartbeat(shares):
     """!
-    Optional heartbeat task to verify tasks are working
+    Optional heartbeat task to verify tasks are working. Prints only in the
+    text telemetry modes, so it never lands among binary frames or a capture dump.
     """
 
     task_state_share = shares
@@ -86,7 +180,7 @@ def heartbeat(shares):
 
         state = task_state_share.get()
 
-        if state == 0:
+        if state == 0 or telemetry_mode in BINARY_TELEMETRY_MODES:
             pass
 
         else:
@@ -95,200 +189,478 @@ def heartbeat(shares):
         yield 0
 
 
-def motor_printing(shares):
+def motor_printing(state):
     """!
     Function to enable printing of motor data to the serial bus
+    @param state AxisState of the axis to print
     """
 
-    position_share, controller_value_share, task_state_share = shares
+    ints = state.ints
 
-    while True:
+    start_time = utime.ticks_ms()
 
-        state = task_state_share.get()
+    while True:
 
-        if state == 0:
+        if ints[axis_state.STATE] == 0:
             start_time = utime.ticks_ms()
             pass
 
         else:
-            print(str(utime.ticks_ms()-start_time) + "," + str(position_share.get()))
+            print(str(utime.ticks_ms()-start_time) + "," + str(ints[axis_state.POSITION]))
 
         yield 0
 
 
+def motor_telemetry(state, recorded):
+    """!
+    Function to stream motor data to the serial bus as binary telemetry frames.
+    Every run sends the samples captured since the previous run, so the data
+    rate follows the rate the axis records at, not the period of this task.
+    Frames are packed into a preallocated buffer, see telemetry.py.
+    @param state AxisState of the axis to stream
+    @param recorded CaptureBuffer the axis records its samples into
+    """
 
-if __name__ == "__main__":
+    ints = state.ints
 
-    '''SERVO 1 SETUP'''
-    ## Servo 1 Object
-    servo1 = Servo(SERVO1_PIN,
-                   SERVO1_TIMER_NUM,
-                   SERVO1_TIMER_CHAN,
-                   SERVO1_MIN_PULSE,
-                   SERVO1_MAX_PULSE,
-                   SERVO1_ANGLE_RANGE,
-                   SERVO_ARR,
-                   SERVO_PS)
-
-    ## Initialize servo 1 to nominal position (halfway thru range)
-    # servo1.set_angle(SERVO1_ANGLE_RANGE/2)
-    servo1.test_sweep_reset()
-
-
-    '''MOTOR 1 SETUP'''
-    ## Motor 1 Object
-    motor1 = Motor(MOTOR1_EN_PIN, 
-                  MOTOR1_INA_PIN, 2, 1,
-                  MOTOR1_INB_PIN, 2, 2,
-                  30000)
-    
-    #Initialize motor to safe state
-    motor1.set_enable(1)
-    motor1.set_duty_cycle(0)
-
-
-    '''MOTOR 1 ENCODER SETUP'''
-    ## Motor 1 encoder object
-    encoder1 = encoder_reader.Encoder(ENCODER1_PIN_A, ENCODER1_PIN_B, ENCODER1_TIMER_NUMBER, pyb.Pin.AF2_TIM4)
-
-
-    '''MOTOR 1 PID CONTROL SETUP'''
-    ## Current position of motor 1 in encoder ticks
-    position1 = 0
-
-    ## Target motor position in encoder ticks
-    step_target = 16384
-
-    ## PID controller object for motor 1
-    controller1 = PID_controller.PIDController(Kp=0.03, init_target=step_target, Ki = 0.0001)
-
-
-
-    ## Flag defining the end of the step response routine
-    done = False
-
-
-
-    '''MOTOR 1 TASKS SETUP'''
-    # Create a share and a queue to test function and diagnostic printouts
-
-    ## Motor 1 position share
-    motor1_position = task_share.Share('l', thread_protect=False, name="Motor 1 Share") #initialized with signed long
-    ## Motor 1 controller share
-    motor1_controller_value = task_share.Share('f', thread_protect=False, name="Motor 1 Control Val") #initialized with float
-    ## Motor 1 task state share
-    motor1_task_state = task_share.Share('l', thread_protect=False, name="Motor 1 Task State") #initialized with signed long
-
-    ## Motor 1 speed task
-    motor1_speed_task = cotask.Task(motor1.set_duty_cycle_task, name="motor1_speed_task", priority=MOTOR1_SPEED_TASK_PRIORITY, 
-                            period=MOTOR1_SPEED_TASK_PERIOD,
-                            profile=True, trace=True, shares=(motor1_controller_value, motor1_task_state))
-    
-    ## Motor 1 position task
-    motor1_position_task = cotask.Task(encoder1.read_task, name="motor1_position_task", priority=MOTOR1_POSITION_TASK_PRIORITY, 
-                            period=MOTOR1_POSITION_TASK_PERIOD,
-                            profile=True, trace=True, shares=(motor1_position, motor1_task_state))
-    
-    ## Motor 1 PID controller update task
-    motor1_controller_task = cotask.Task(controller1.run_task, name="motor1_controller_task", priority=MOTOR1_CONTROLLER_TASK_PRIORITY, 
-                            period=MOTOR1_CONTROLLER_TASK_PERIOD,
-                            profile=True, trace=True, shares=(motor1_position, motor1_controller_value, motor1_task_state))
-    
-    ## Motor 1 print update task
-    motor1_print_task = cotask.Task(motor_printing, name="motor1_print_task", priority=MOTOR1_PRINTING_TASK_PRIORITY, 
-                            period=MOTOR1_PRINTING_TASK_PERIOD,
-                            profile=True, trace=True, shares=(motor1_position, motor1_controller_value, motor1_task_state))
-
-
-    '''SERVO 1 TASKS SETUP'''
-    ## Servo 1 test sweep task
-    servo1_sweep_task = cotask.Task(servo1.test_sweep_run, name="servo1_position_task", priority=SERVO1_POS_UPDATE_PRIO, 
-                            period=SERVO1_POS_UPDATE_PERIOD,
-                            profile=True, trace=True, shares=(motor1_task_state))
+    writer = telemetry.TelemetryWriter(pyb.USB_VCP(), TELEMETRY_FRAMES_PER_WRITE)
+    sent = 0
+    frame_state = 1
 
-    '''OTHER TASKS'''
-    ## Controller heartbeat task
-    heartbeat_task = cotask.Task(heartbeat, name="heartbeat_task", priority=HB_TASK_PRIORITY, 
-                            period=HB_TASK_PERIOD,
-                            profile=True, trace=True, shares=(motor1_task_state))
-    
+    while True:
 
-    motor1_task_state.put(0)
-    
-    cotask.task_list.append(motor1_speed_task)
-    cotask.task_list.append(motor1_position_task)
-    cotask.task_list.append(motor1_controller_task)
-    cotask.task_list.append(heartbeat_task)
-    cotask.task_list.append(motor1_print_task)
-    cotask.task_list.append(servo1_sweep_task)
+        run_state = ints[axis_state.STATE]
+        count = recorded.count()
 
+        if count < sent:
+            # A new run has restarted the capture
+            sent = 0
 
-    # Run the memory garbage collector to ensure memory is as defragmented as
-    # possible before the real-time scheduler is started
-    gc.collect()
+        if run_state != 0:
+            frame_state = run_state
+            # The newest sample may not have its controller output yet
+            count -= 1
 
+        while sent < count:
+            writer.write(recorded.times[sent], recorded.positions[sent],
+                         recorded.controls[sent], frame_state)
+            sent += 1
 
+        if run_state == 0:
+            writer.flush()
 
-    start_time = 0
-    
+        yield 0
 
-    '''MAIN LOOP'''
-    try:
 
-        while 1:
+def motor_output(shares):
+    """!
+    Function to stream motor data in the telemetry mode currently selected
+    @param shares Tuple of the AxisState and CaptureBuffer of the axis to stream
+    """
 
-            cotask.task_list.pri_sched()
+    state, recorded = shares
+    streams = {"binary": motor_telemetry(state, recorded), "text": motor_printing(state)}
 
-            # for idx,value in enumerate(time_values):
-            #     print(str(value) + "," + str(position_values[idx]))
-            
-            if (utime.ticks_ms()-start_time) > TIMEOUT_MS:
-                motor1_task_state.put(0)
-                motor1.set_duty_cycle(0)
-                #print("Done")
+    while True:
 
-                
-            if pyb.USB_VCP().any():
+        stream = streams.get(telemetry_mode)
 
-                ## Raw value read by the serial bus
-                serial_value = pyb.USB_VCP().read()
+        if stream is not None:
+            next(stream)
 
-                ## Requested Kp value, converted from serial data
-                received_Kp = float(serial_value.decode().strip('\n'))
+        yield 0
 
-                controller1.set_Kp(received_Kp)
 
-                ## Time at which the step response test was started in ms
-                start_time = utime.ticks_ms()
 
-                done = False
+if __name__ == "__main__":
 
-                encoder1.zero()
+    '''TASK STATE SETUP'''
+    ## Task state share enabling the servo and heartbeat tasks when nonzero;
+    ## each axis has its own run state in its AxisState
+    task_state = task_share.Share('l', thread_protect=False, name="Task State") #initialized with signed long
+
+
+    '''SERVO SETUP'''
+    ## Servo objects, in the order of the servo table
+    servos = []
+
+    for servo_config in SERVOS:
+        servo = Servo(servo_config["pin"],
+                      servo_config["timer"],
+                      servo_config["channel"],
+                      servo_config["min_pulse"],
+                      servo_config["max_pulse"],
+                      servo_config["angle_range"],
+                      servo_config["arr"],
+                      servo_config["ps"])
+
+        ## Initialize servo to nominal position (halfway thru range)
+        # servo.set_angle(servo_config["angle_range"]/2)
+        if "waypoints" in servo_config:
+            servo.plan_waypoints(servo_config["waypoints"], servo_config["task"][1], repeat=True)
+        else:
+            servo.test_sweep_reset()
+        servos.append(servo)
+
+
+    '''AXIS SETUP'''
+    ## Motor axes built from the axis table, each with its drivers, state block and tasks
+    axes = axis.build_axes(AXES, TIMEOUT_MS)
+
+    ## Axis whose data is recorded or streamed to the PC
+    recorded_axis = None
+    for each in axes:
+        if each.config.get("record", False):
+            recorded_axis = each
+
+    ## How the recorded axis sends its data, one of TELEMETRY_MODES
+    if CAPTURE_STEP_RESPONSE:
+        telemetry_mode = "capture"
+    else:
+        telemetry_mode = "binary" if TELEMETRY_BINARY else "text"
+
+    ## Axes that gain and setpoint commands apply to
+    selected_axes = axes
+
+    ## Flag set while a step response test is running
+    running = False
+
+    ## Time at which the step response test was started in ms
+    start_time = 0
+
+
+    '''TASKS SETUP'''
+    task_state.put(0)
+
+    ## Every cotask task, gathered so priorities can be assigned before the
+    ## task list, which sorts tasks as they are added, sees them
+    tasks = []
+    for each in axes:
+        tasks.extend(each.tasks)
+
+    if recorded_axis is not None:
+        ## Recorded axis print update task
+        print_task_name = recorded_axis.name + "_print_task"
+        print_task = cotask.Task(timed(motor_output,
+                                       TaskStats(print_task_name, MOTOR_PRINTING_TASK_PERIOD)),
+                                 name=print_task_name,
+                                 priority=MOTOR_PRINTING_TASK_PRIORITY,
+                                 period=MOTOR_PRINTING_TASK_PERIOD,
+                                 profile=True, trace=False,
+                                 shares=(recorded_axis.state, recorded_axis.capture))
+        tasks.append(print_task)
+
+    for servo, servo_config in zip(servos, SERVOS):
+        ## Servo motion task
+        sweep_task_name = servo_config["name"] + "_position_task"
+        sweep_task = cotask.Task(timed(servo.motion_task, TaskStats(sweep_task_name, servo_config["task"][1])),
+                                 name=sweep_task_name,
+                                 priority=servo_config["task"][0],
+                                 period=servo_config["task"][1],
+                                 profile=True, trace=False, shares=(task_state))
+        tasks.append(sweep_task)
+
+    '''OTHER TASKS'''
+    ## Controller heartbeat task
+    heartbeat_task = cotask.Task(timed(heartbeat, TaskStats("heartbeat_task", HB_TASK_PERIOD)),
+                            name="heartbeat_task", priority=HB_TASK_PRIORITY, 
+                            period=HB_TASK_PERIOD,
+                            profile=True, trace=False, shares=(task_state))
+    tasks.append(heartbeat_task)
+
+
+    '''SCHEDULE CHECK'''
+    ## Deadlines of TASK_DEADLINES_MS in us
+    task_deadlines = {name: int(ms * 1000) for name, ms in TASK_DEADLINES_MS.items()}
+    ## Interrupts the axes run outside of cotask, which delay every task
+    interrupts = [entry for each in axes for entry in each.interrupts()]
+
+    ## Worst run times in us measured in this and earlier sessions, by name
+    saved_run_times = schedule.load_run_times(RUN_TIMES_FILE)
+
+    schedule.assign_priorities(tasks, SCHEDULING, task_deadlines)
+    schedulable, report = schedule.check(tasks, saved_run_times, task_deadlines, interrupts)
+    print(report)
+    if not schedulable:
+        if SCHEDULE_STRICT:
+            raise RuntimeError("Task set can miss its deadlines; see the table above, or delete "
+                               + RUN_TIMES_FILE + " to measure again")
+        print("warning: task set can miss its deadlines with the run times in " + RUN_TIMES_FILE)
+
+    for task in tasks:
+        cotask.task_list.append(task)
+    for each in axes:
+        each.begin()
+
+
+    '''COMMAND SETUP'''
+    ## Serial port the PC sends commands over
+    usb = pyb.USB_VCP()
+    ## Line buffered reader of the commands
+    command_reader = commands.LineReader(usb)
+
+
+    def start_run():
+        """!
+        Starts a step response test on every axis. Every axis is prepared
+        before any is enabled, so a move that cannot be planned starts none
+        of them; any run in progress is stopped as well.
+        """
+        global running, start_time
+        try:
+            for each in axes:
+                each.prepare_run()
+        except ValueError:
+            for each in axes:
+                each.stop()
+            task_state.put(0)
+            running = False
+            raise
+        for each in axes:
+            each.enable()
+        start_time = utime.ticks_ms()
+        running = True
+        task_state.put(1)
+
+
+    def stop_run():
+        """!
+        Ends the step response test, sending the recorded run in capture mode
+        """
+        global running
+        task_state.put(0)
+        for each in axes:
+            each.stop()
+        if running and telemetry_mode == "capture" and recorded_axis is not None:
+            recorded_axis.capture.dump(usb)
+        if running:
+            # Keep the run times for the schedule check of the next session,
+            # writing flash only when they have changed noticeably
+            measured = check_schedule()
+            if schedule.run_times_changed(saved_run_times, measured, RUN_TIMES_TOLERANCE):
+                saved_run_times.update(measured)
+                try:
+                    schedule.save_run_times(saved_run_times, RUN_TIMES_FILE)
+                except OSError:
+                    pass
+        running = False
+
+
+    def check_schedule(words=None):
+        """!
+        Checks the schedule with the run times measured so far, printing the
+        table when a task can miss its deadline or when asked by command
+        @return Dictionary of the worst run time in us of every task and interrupt
+        """
+        run_times = schedule.measured_run_times()
+        for each in axes:
+            run_times.update(each.interrupt_run_times())
+        schedulable, report = schedule.check(tasks, run_times, task_deadlines, interrupts)
+        if not schedulable:
+            print("warning: task set can miss its deadlines\n" + report)
+        elif words is not None:
+            print(report)
+        return run_times
+
+
+    def finite_float(word):
+        """!
+        Reads a command argument as a number, rejecting inf and nan, which no
+        gain or setpoint can hold
+        """
+        value = float(word)
+        if not math.isfinite(value):
+            raise ValueError("{} is not a finite number".format(word))
+        return value
+
+
+    def run_gains(words):
+        """!
+        Sets the gains of the selected axes from "Kp", "Kp,Ki" or "Kp,Ki,Kd"
+        and starts a test, as sent by display.py and gain_sweep.py. The gains
+        go to the loop that drives the motor, so they are always in duty
+        cycle percent: per tick of position error, or in "cascade" mode per
+        tick per second of velocity error, the same loop as vkp.
+        """
+        received_gains = [finite_float(word) for word in words]
+        if len(received_gains) > 3:
+            raise ValueError("expected Kp,Ki,Kd")
+        for each in selected_axes:
+            controller = each.velocity_controller or each.controller
+            for setter, gain in zip((controller.set_Kp, controller.set_Ki,
+                                     controller.set_Kd), received_gains):
+                setter(gain)
+        start_run()
+
+
+    def gain_command(setter_name, velocity_loop=False):
+        """!
+        Makes a command setting one gain of every selected axis
+        @param setter_name Name of the PIDController method setting the gain
+        @param velocity_loop True to set the gain of the cascade velocity loop
+        """
+        def set_gain(words):
+            gain = finite_float(words[0])
+            controllers = [each.velocity_controller if velocity_loop else each.controller
+                           for each in selected_axes]
+            if None in controllers:
+                raise ValueError("no velocity loop outside of cascade mode")
+            for controller in controllers:
+                getattr(controller, setter_name)(gain)
+        return set_gain
+
+
+    def select_axis(words):
+        """!
+        Chooses the axes that gain and setpoint commands apply to
+        """
+        global selected_axes
+        if words[0] == "all":
+            selected_axes = axes
+        else:
+            selected_axes = [each for each in axes if each.name == words[0]]
+            if not selected_axes:
+                selected_axes = axes
+                raise KeyError(words[0])
+
+
+    def set_setpoint(words):
+        """!
+        Sets the target of the selected axes, used from the next test
+        """
+        target = int(finite_float(words[0]))
+        if target < axis_state.INT_MIN or target > axis_state.INT_MAX:
+            raise ValueError("setpoint {} is outside {} to {}".format(
+                target, axis_state.INT_MIN, axis_state.INT_MAX))
+        for each in selected_axes:
+            each.config["target"] = target
+
+
+    def set_task_period(words):
+        """!
+        Sets the period in ms of one task of every selected axis, by task key
+        """
+        period_ms = int(words[1])
+        for each in selected_axes:
+            each.set_period(words[0], period_ms)
+
+
+    def set_telemetry(words):
+        """!
+        Chooses how the recorded axis sends its data
+        """
+        global telemetry_mode
+        if words[0] not in TELEMETRY_MODES:
+            raise ValueError("expected one of " + ", ".join(TELEMETRY_MODES))
+        telemetry_mode = words[0]
+
+
+    def allocation_command(words):
+        """!
+        Turns allocation tracking on or off, or reports the tasks that
+        allocate the most and the idle collections
+        """
+        if words:
+            if words[0] not in ("on", "off"):
+                raise ValueError("expected on or off")
+            timing_stats.track_allocations = words[0] == "on"
+        else:
+            print(timing_stats.allocation_report())
+            print(collector)
+
+
+    def show_status(words):
+        """!
+        Prints the state, target and gains of every axis, and a warning when
+        garbage collection cannot run in idle time
+        """
+        print("running" if running else "stopped", "telemetry", telemetry_mode)
+        for each in axes:
+            print(each.name, "target", each.config["target"], "gains", each.controller.get_gains(),
+                  "selected" if each in selected_axes else "")
+        warning = collector.warning()
+        if warning is not None:
+            print(warning)
+
+
+    ## Commands accepted over the serial port; a line of numbers sets gains and starts a test
+    dispatcher = commands.CommandDispatcher(
+        run_gains, "Kp[,Ki[,Kd]] - set the gains of the loop driving the motor, in duty % per"
+                   " tick, or per tick/s in cascade mode, and start a test")
+    dispatcher.add("start", lambda words: start_run(), "- start a test")
+    dispatcher.add("stop", lambda words: stop_run(), "- end the test")
+    position_units = "GAIN - position loop, duty % per tick, or tick/s per tick in cascade mode"
+    velocity_units = "GAIN - cascade velocity loop, duty % per tick/s"
+    dispatcher.add("kp", gain_command("set_Kp"), position_units)
+    dispatcher.add("ki", gain_command("set_Ki"), position_units)
+    dispatcher.add("kd", gain_command("set_Kd"), position_units)
+    dispatcher.add("kf", gain_command("set_Kf"), position_units)
+    dispatcher.add("vkp", gain_command("set_Kp", True), velocity_units)
+    dispatcher.add("vki", gain_command("set_Ki", True), velocity_units)
+    dispatcher.add("vkd", gain_command("set_Kd", True), velocity_units)
+    dispatcher.add("vkf", gain_command("set_Kf", True), velocity_units)
+    dispatcher.add("axis", select_axis, "NAME|all")
+    dispatcher.add("setpoint", set_setpoint, "TICKS")
+    dispatcher.add("period", set_task_period, "TASK MS")
+    dispatcher.add("telemetry", set_telemetry, "|".join(TELEMETRY_MODES))
+    dispatcher.add("status", show_status)
+    # Report task timing without disturbing a run in progress
+    dispatcher.add("stats", lambda words: print(timing_stats.show_all()))
+    dispatcher.add("schedule", check_schedule)
+    dispatcher.add("alloc", allocation_command, "[on|off]")
+    dispatcher.add("help", lambda words: print(dispatcher.usage()))
+
+
+    timing_stats.track_allocations = TRACK_ALLOCATIONS
+
+    ## Garbage collector run only between task releases, so collection pauses
+    ## do not land in the middle of control ticks
+    collector = idle_gc.IdleCollector(timing_stats.task_stats_list, GC_RESERVE_BYTES)
+
+    # Run the memory garbage collector to ensure memory is as defragmented as
+    # possible before the real-time scheduler is started
+    gc.collect()
 
-                ## Time since the start of the step response routine in ms
-                current_time_ms_appx = 0
 
-                ## List containing recorded position values 
-                position_values = []
-                ## List containing recorded time values 
-                time_values = []
+    '''MAIN LOOP'''
+    try:
+
+        while 1:
+
+            cotask.task_list.pri_sched()
+
+            if running and utime.ticks_diff(utime.ticks_ms(), start_time) > TIMEOUT_MS:
+                stop_run()
 
-                ## Time of previous iteration and used to execute the PID at a known period
-                last_time = start_time
+            # At most one command per pass, so a burst of commands cannot
+            # hold off the scheduler
+            line = command_reader.poll()
+            if line:
+                dispatcher.dispatch(line)
 
-                motor1_task_state.put(1)
+            collector.poll()
 
         
     except KeyboardInterrupt:
         pass
 
-    motor1.set_duty_cycle(0)
-    servo1.reset_pulse_width()
+    for each in axes:
+        each.shutdown()
+    for servo in servos:
+        servo.reset_pulse_width()
 
     # Print a table of task data and a table of shared information data
     print('\n' + str (cotask.task_list))
     print(task_share.show_all())
-    print(motor1_speed_task.get_trace())
-    print(motor1_position_task.get_trace())
-    print(motor1_controller_task.get_trace())
-    print('')
\ No newline at end of file
+    for each in axes:
+        print(each.state)
+    print(timing_stats.show_all())
+    for each in axes:
+        print(each.name + " sensor to actuator latency: " + str(each.probe.stats))
+        if each.loop_mode == "timer":
+            print(each.name + " timer jitter: " + str(each.loop.jitter))
+            print(each.name + " timer update time: " + str(each.loop.isr_time))
+    print(axis.budget_report(axes))
+    print(timing_stats.allocation_report())
+    print(collector)
+    print('')
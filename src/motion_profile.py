@@ -0,0 +1,151 @@
+"""! @file motion_profile.py
+
+Plans point-to-point moves as trapezoidal or jerk-limited (S-curve) position
+profiles. A whole move is computed when it is commanded, into preallocated
+arrays holding one position setpoint and one feed-forward value per controller
+tick, made from the planned velocity and acceleration. While the move runs,
+apply() only copies the next pair into the controller, so a tick does no
+profile math and does not allocate.
+
+An S-curve is made by averaging the trapezoidal profile over the jerk time,
+which limits the jerk to the acceleration divided by that time and makes the
+move one jerk time longer.
+"""
+
+import math
+from array import array
+
+
+## Profile types accepted by MotionProfile.plan
+PROFILE_TYPES = ("trapezoid", "s_curve")
+
+
+class MotionProfile:
+    """!
+    Lookup table of setpoints for one move, played back one sample per tick
+    """
+
+    def __init__(self, capacity):
+        """!
+            Allocates room for a move
+            @param capacity Largest number of ticks a move may take
+        """
+        ## Number of samples the profile can hold
+        self.capacity = capacity
+        ## Position setpoint of each tick
+        self.positions = array('l', (0 for _ in range(capacity)))
+        ## Feed-forward of each tick, already scaled to controller output units
+        self.feedforwards = array('l', (0 for _ in range(capacity)))
+        self.__count = 0
+        self.__index = 0
+
+
+    def plan(self, start, end, period_ms, max_velocity, max_acceleration,
+             profile_type="trapezoid", max_jerk=None, velocity_gain=0, acceleration_gain=0):
+        """!
+            Computes a move and rewinds playback to its first sample
+            @param start Starting position in encoder ticks
+            @param end Final position in encoder ticks
+            @param period_ms Time between ticks of the controller the profile feeds
+            @param max_velocity Largest speed in ticks per second
+            @param max_acceleration Largest acceleration in ticks per second squared
+            @param profile_type "trapezoid" or "s_curve"
+            @param max_jerk Largest jerk in ticks per second cubed, for "s_curve"
+            @param velocity_gain Controller output per tick per second of
+                planned velocity, added to the feed-forward of each tick
+            @param acceleration_gain Controller output per tick per second
+                squared of planned acceleration, added to the feed-forward of each tick
+            @return Number of ticks the move takes
+        """
+        if profile_type not in PROFILE_TYPES:
+            raise ValueError("Unknown profile type {}".format(profile_type))
+
+        period_s = period_ms / 1000
+        distance = abs(end - start)
+        direction = 1 if end >= start else -1
+
+        # Peak speed, lower than max_velocity for moves too short to reach it
+        velocity = min(max_velocity, math.sqrt(distance * max_acceleration))
+        accel_s = velocity / max_acceleration if velocity > 0 else 0
+        accel_distance = 0.5 * max_acceleration * accel_s * accel_s
+        cruise_s = (distance - 2 * accel_distance) / velocity if velocity > 0 else 0
+        total_s = 2 * accel_s + cruise_s
+
+        average_count = 1
+        if profile_type == "s_curve" and max_jerk:
+            average_count = max(1, round(max_acceleration / max_jerk / period_s))
+
+        count = math.ceil(total_s / period_s) + average_count
+        if count > self.capacity:
+            raise ValueError("Move needs {} ticks, more than the {} allocated".format(
+                count, self.capacity))
+
+        position_sum = 0
+        feedforward_sum = 0
+        history = [(0, 0)] * average_count
+
+        for index in range(count):
+            t = index * period_s
+            if t < accel_s:
+                position = 0.5 * max_acceleration * t * t
+                speed = max_acceleration * t
+                acceleration = max_acceleration
+            elif t < accel_s + cruise_s:
+                position = accel_distance + velocity * (t - accel_s)
+                speed = velocity
+                acceleration = 0
+            elif t < total_s:
+                position = distance - 0.5 * max_acceleration * (total_s - t) ** 2
+                speed = max_acceleration * (total_s - t)
+                acceleration = -max_acceleration
+            else:
+                position = distance
+                speed = 0
+                acceleration = 0
+            feedforward = speed * velocity_gain + acceleration * acceleration_gain
+
+            # Running average over the jerk time; a single sample for a trapezoid
+            old_position, old_feedforward = history[index % average_count]
+            history[index % average_count] = (position, feedforward)
+            position_sum += position - old_position
+            feedforward_sum += feedforward - old_feedforward
+
+            self.positions[index] = start + direction * round(position_sum / average_count)
+            self.feedforwards[index] = direction * round(feedforward_sum / average_count)
+
+        self.positions[count - 1] = end
+        self.feedforwards[count - 1] = 0
+        self.__count = count
+        self.__index = 0
+        return count
+
+
+    def hold(self, position):
+        """!
+            Replaces the move with a constant setpoint
+            @param position Position to hold in encoder ticks
+        """
+        self.positions[0] = position
+        self.feedforwards[0] = 0
+        self.__count = 1
+        self.__index = 0
+
+
+    def done(self):
+        """!
+            @return True once the last sample of the move has been applied
+        """
+        return self.__index >= self.__count - 1
+
+
+    def apply(self, controller):
+        """!
+            Sets the controller setpoint and feed-forward to the next sample,
+            holding the last sample once the move is done
+            @param controller PIDController to update
+        """
+        index = self.__index
+        controller.set_setpoint(self.positions[index])
+        controller.set_feedforward(self.feedforwards[index])
+        if index < self.__count - 1:
+            self.__index = index + 1
@@ -3,11 +3,14 @@
 Contains a class to drive brushed DC motors using the IHM04A1 motor driver from ST.
 https://www.st.com/en/ecosystems/x-nucleo-ihm04a1.html
 Supports bi-directional operation and speed control through PWM.
+Duty cycles are converted once to signed integer timer compare values, which
+are only written to the timer when they change.
 """
 
 
 import platform
 import pyb
+from axis_state import STATE, CONTROL
 
 if "MicroPython" not in platform.platform():
     from me405_support import cotask, cqueue, task_share
@@ -43,6 +46,18 @@ class MotorDriver:
         self.__pin1_timer_channel = self.__setupmotor__(in1pin, in1_timer_num, in1_timer_channel_number, pwm_frequency)
         self.__pin2_timer_channel = self.__setupmotor__(in2pin, in2_timer_num, in2_timer_channel_number, pwm_frequency)
 
+        ## Timer compare value giving a 100 % duty cycle
+        self.compare_span = pyb.Timer(in1_timer_num).period() + 1
+
+        self.__min_level = -100
+        self.__max_level = 100
+        self.__probe = None
+
+        # Start with both outputs low so the motor is off
+        self.__compare = 0
+        self.__pin1_timer_channel.compare(0)
+        self.__pin2_timer_channel.compare(0)
+
         
     def __setupmotor__(self, inpin: pyb.Pin.board, in_timer_num: int, in_timer_channel_number: int, pwm_frequency: int):
         """! 
@@ -66,55 +81,112 @@ class MotorDriver:
         self.__en_pin.value(value)
 
 
+    def set_probe(self, probe):
+        """! 
+        Marks every duty cycle applied by set_duty_cycle_task on a latency probe
+        @param probe LatencyProbe to mark, or None to stop measuring
+        """
+        self.__probe = probe
+
+
+    def set_limits(self, min_level, max_level):
+        """! 
+        Sets the range duty cycles are saturated to
+        @param min_level Lowest duty cycle in percent, no lower than -100
+        @param max_level Highest duty cycle in percent, no higher than 100
+        """
+        self.__min_level = max(min_level, -100)
+        self.__max_level = min(max_level, 100)
+
+
     def set_duty_cycle (self, level):
         """!
         This method sets the duty cycle to be sent
         to the motor to the given level. Positive values
         cause torque in one direction, negative values
         in the opposite direction.
-        @param level A signed integer holding the duty
-               cycle of the voltage sent to the motor 
+        @param level A signed number holding the duty
+               cycle of the voltage sent to the motor in percent,
+               saturated to the limits from set_limits
         """
         #print (f"Setting duty cycle to {level}")
 
+        if level > self.__max_level:
+            level = self.__max_level
+        elif level < self.__min_level:
+            level = self.__min_level
+
+        if level < 0:
+            self.set_compare(-(int(-level * self.compare_span) // 100))
+        else:
+            self.set_compare(int(level * self.compare_span) // 100)
+
 
-        if(level < 0):
-            self.__pin1_timer_channel.pulse_width_percent(level * -1)
-            self.__pin2_timer_channel.pulse_width_percent(0)
+    def set_compare(self, compare: int):
+        """!
+        Sets the signed timer compare value driving the motor, writing the
+        timers only when it changes. The idle input is held low, so the
+        motor brakes during the off part of each PWM period.
+        @param compare Compare value from -compare_span to compare_span, where
+               the sign gives the direction
+        """
+        last = self.__compare
+        if compare == last:
+            return
+        self.__compare = compare
+
+        if compare < 0:
+            if last > 0:
+                self.__pin2_timer_channel.compare(0)
+            self.__pin1_timer_channel.compare(-compare)
         else:
-            self.__pin1_timer_channel.pulse_width_percent(0)
-            self.__pin2_timer_channel.pulse_width_percent(level)
+            if last < 0:
+                self.__pin1_timer_channel.compare(0)
+            self.__pin2_timer_channel.compare(compare)
+
+
+    def brake(self):
+        """!
+        Stops driving the motor with both inputs low, shorting the motor
+        through the low side of the H-bridge so it stops quickly
+        """
+        self.set_compare(0)
+        self.set_enable(1)
+
+
+    def coast(self):
+        """!
+        Stops driving the motor with the H-bridge disabled so it spins down
+        freely. Call set_enable(1) to drive it again.
+        """
+        self.set_compare(0)
+        self.set_enable(0)
 
     
-    def set_duty_cycle_task (self, shares):
+    def set_duty_cycle_task (self, state):
         """!
         This method sets the duty cycle to be sent
         to the motor to the given level. Positive values
         cause torque in one direction, negative values
         in the opposite direction.
-        @param level A signed integer holding the duty
-               cycle of the voltage sent to the motor 
+        @param state AxisState whose STATE field enables the task and whose
+               CONTROL field holds the duty cycle of the voltage sent to the motor
         """
         #print (f"Setting duty cycle to {level}")
 
-        level_queue, task_state_share = shares
+        ints = state.ints
+        floats = state.floats
 
         while 1:
 
-            state = task_state_share.get()
-
-            if state == 0:
+            if ints[STATE] == 0:
                 pass
 
             else:
-                level = level_queue.get()
-
-                if(level < 0):
-                    self.__pin1_timer_channel.pulse_width_percent(level * -1)
-                    self.__pin2_timer_channel.pulse_width_percent(0)
-                else:
-                    self.__pin1_timer_channel.pulse_width_percent(0)
-                    self.__pin2_timer_channel.pulse_width_percent(level)
+                self.set_duty_cycle(floats[CONTROL])
+
+                if self.__probe is not None:
+                    self.__probe.actuated()
 
             yield 0
 
@@ -0,0 +1,279 @@
+"""! @file run_archive.py
+
+Keeps every step response run on disk so it can be found and compared later.
+Runs on a PC, not on the board. An archive is a directory holding two files:
+- "samples.dat", the samples of every run one after another as raw rows of
+  SAMPLE_DTYPE. It is only ever appended to, and is read through a NumPy
+  memory map, so opening an archive reads nothing and a run costs only the
+  pages it touches.
+- "index.npy", one row of INDEX_DTYPE per run with where its samples are, the
+  gains, target and sample period it ran with, when it ran, and its
+  step_metrics figures. Queries and rankings only read the index, so they stay
+  instant however many runs the archive holds.
+
+Usage: python src/run_archive.py runs [--kp 0.03] [--ki 0] [--kd 0] [--label text]
+                                      [--sort iae] [--last 10] [--plot]
+"""
+
+import argparse
+import os
+import time
+import numpy
+import step_metrics
+
+
+## Layout of one sample of a run
+SAMPLE_DTYPE = numpy.dtype([("time_ms", "<f8"),
+                            ("position", "<f8"),
+                            ("control", "<f4")])
+
+## Layout of one row of the run index
+INDEX_DTYPE = numpy.dtype([("run_id", "<i8"),
+                           ("timestamp", "<f8"),
+                           ("offset", "<i8"),
+                           ("count", "<i8"),
+                           ("kp", "<f8"),
+                           ("ki", "<f8"),
+                           ("kd", "<f8"),
+                           ("target", "<f8"),
+                           ("period_ms", "<f8"),
+                           ("rise_ms", "<f8"),
+                           ("overshoot_pct", "<f8"),
+                           ("settling_ms", "<f8"),
+                           ("steady_state_error", "<f8"),
+                           ("iae", "<f8"),
+                           ("label", "<U32")])
+
+## Name of the file holding the samples of every run
+SAMPLES_FILE = "samples.dat"
+## Name of the file holding the run index
+INDEX_FILE = "index.npy"
+
+
+class RunArchive:
+    """!
+    @brief Directory of step response runs with an index of how each one went.
+    """
+
+    def __init__(self, path):
+        """!
+        @brief Open an archive, creating an empty one if the directory does not exist.
+        @param path Directory of the archive
+        """
+        ## Directory of the archive
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.__samples_path = os.path.join(path, SAMPLES_FILE)
+        self.__index_path = os.path.join(path, INDEX_FILE)
+        self.__samples = None
+
+        if os.path.exists(self.__index_path):
+            ## Structured array of INDEX_DTYPE with one row per run, oldest first
+            self.index = numpy.load(self.__index_path)
+        else:
+            self.index = numpy.zeros(0, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, times_ms, positions, controls=None, gains=(numpy.nan,) * 3,
+            target=numpy.nan, period_ms=None, label="", timestamp=None):
+        """!
+        @brief Store a run and index it with its step response figures.
+        @param times_ms Sample times in ms
+        @param positions Sample positions in encoder ticks
+        @param controls Controller output of each sample, or None if not known
+        @param gains Sequence of (Kp, Ki, Kd); unknown gains are NaN
+        @param target Step size in encoder ticks, or NaN if not known, in which
+            case no figures are computed
+        @param period_ms Sample period in ms; by default the median spacing of the times
+        @param label Short free text description, cut to 32 characters
+        @param timestamp Time the run was made, as from time.time(); by default now
+        @return Index row of the new run
+        """
+        times_ms = numpy.asarray(times_ms, dtype=float)
+        rows = numpy.zeros(len(times_ms), dtype=SAMPLE_DTYPE)
+        rows["time_ms"] = times_ms
+        rows["position"] = positions
+        rows["control"] = numpy.nan if controls is None else controls
+
+        if period_ms is None:
+            period_ms = numpy.median(numpy.diff(times_ms)) if len(times_ms) > 1 else numpy.nan
+
+        entry = numpy.zeros(1, dtype=INDEX_DTYPE)
+        entry["run_id"] = self.index["run_id"][-1] + 1 if len(self.index) else 0
+        entry["timestamp"] = time.time() if timestamp is None else timestamp
+        entry["offset"] = self.__sample_count()
+        entry["count"] = len(rows)
+        entry["kp"], entry["ki"], entry["kd"] = gains
+        entry["target"] = target
+        entry["period_ms"] = period_ms
+        entry["label"] = label[:32]
+
+        figures = ("rise_ms", "overshoot_pct", "settling_ms", "steady_state_error", "iae")
+        if len(rows) > 1 and numpy.isfinite(target) and target != 0:
+            metrics = step_metrics.step_metrics(rows["time_ms"], rows["position"], target)
+            for name in figures:
+                entry[name] = metrics[name]
+        else:
+            for name in figures:
+                entry[name] = numpy.nan
+
+        # Samples go first, so an interrupted save leaves unused samples
+        # rather than an index row pointing past the end of the file
+        with open(self.__samples_path, "ab") as samples_file:
+            samples_file.write(rows.tobytes())
+        self.__samples = None
+
+        self.index = numpy.concatenate((self.index, entry))
+        temporary_path = self.__index_path + ".tmp"
+        with open(temporary_path, "wb") as index_file:
+            numpy.save(index_file, self.index)
+        os.replace(temporary_path, self.__index_path)
+
+        return entry[0]
+
+    def __sample_count(self):
+        if not os.path.exists(self.__samples_path):
+            return 0
+        return os.path.getsize(self.__samples_path) // SAMPLE_DTYPE.itemsize
+
+    def __sample_map(self):
+        if self.__samples is None:
+            count = self.__sample_count()
+            if count == 0:
+                return numpy.zeros(0, dtype=SAMPLE_DTYPE)
+            self.__samples = numpy.memmap(self.__samples_path, dtype=SAMPLE_DTYPE,
+                                          mode="r", shape=(count,))
+        return self.__samples
+
+    def entry(self, run_id):
+        """!
+        @brief Look up the index row of a run.
+        @param run_id Identifier of the run
+        @return Index row of the run
+        """
+        rows = numpy.flatnonzero(self.index["run_id"] == run_id)
+        if len(rows) == 0:
+            raise KeyError("No run {} in {}".format(run_id, self.path))
+        return self.index[rows[0]]
+
+    def samples(self, run_id):
+        """!
+        @brief Get the samples of a run without copying them.
+        @param run_id Identifier of the run
+        @return Read-only structured array of SAMPLE_DTYPE, backed by the samples file
+        """
+        entry = self.entry(run_id)
+        return self.__sample_map()[entry["offset"]:entry["offset"] + entry["count"]]
+
+    def find(self, sort=None, last=None, **criteria):
+        """!
+        @brief Find runs by the values in their index rows.
+        @param sort Index field to order the runs by, lowest first, or None
+            for the order they were made in
+        @param last Keep only this many of the most recently made runs, before sorting
+        @param criteria Index fields and the values they must have. A pair
+            (low, high) matches the range between them, with None for no
+            bound; any other value must match exactly, or to within rounding
+            for gains and other numbers.
+        @return Array of the index rows found
+        """
+        rows = self.index
+        if last is not None:
+            rows = rows[-last:] if last > 0 else rows[:0]
+
+        keep = numpy.ones(len(rows), dtype=bool)
+        for name, value in criteria.items():
+            column = rows[name]
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    keep &= column >= low
+                if high is not None:
+                    keep &= column <= high
+            elif column.dtype.kind == "f":
+                keep &= numpy.isclose(column, value, rtol=1e-9, atol=0)
+            else:
+                keep &= column == value
+        rows = rows[keep]
+
+        if sort is not None:
+            rows = rows[numpy.argsort(rows[sort], kind="stable")]
+        return rows
+
+    def resampled(self, run_ids, grid_ms=1):
+        """!
+        @brief Put runs on one shared time grid so they can be compared sample by sample.
+        @param run_ids Identifiers of the runs
+        @param grid_ms Spacing of the time grid in ms
+        @return Tuple of the time grid in ms and an array of shape (runs, samples) of positions
+        """
+        runs = [self.samples(run_id) for run_id in run_ids]
+        ends = [run["time_ms"][-1] for run in runs if len(run)]
+        grid = numpy.arange(0, (max(ends) if ends else 0) + grid_ms, grid_ms)
+
+        positions = numpy.empty((len(runs), len(grid)))
+        for row, run in enumerate(runs):
+            positions[row] = step_metrics.resample(run["time_ms"], run["position"], grid)
+        return grid, positions
+
+    def overlay(self, plot_axes, run_ids):
+        """!
+        @brief Draw runs on one set of axes, labelled by their gains.
+        @param plot_axes The set of axes to plot data onto, from Matplotlib
+        @param run_ids Identifiers of the runs
+        """
+        for run_id in run_ids:
+            entry = self.entry(run_id)
+            run = self.samples(run_id)
+            plot_axes.plot(run["time_ms"], run["position"],
+                           label="#{} Kp={:g} Ki={:g} Kd={:g}".format(
+                               run_id, entry["kp"], entry["ki"], entry["kd"]))
+
+
+def print_index(rows):
+    """!
+    @brief Print index rows as a table.
+    @param rows Index rows, such as from RunArchive.find()
+    """
+    print("{:>5s} {:>19s} {:>10s} {:>10s} {:>10s} {:>9s} {:>10s} {:>11s} {:>8s}  {}".format(
+        "run", "time", "Kp", "Ki", "Kd", "rise ms", "overshoot", "settle ms", "IAE", "label"))
+    for row in rows:
+        print("{:>5d} {:>19s} {:>10g} {:>10g} {:>10g} {:>9.1f} {:>9.1f}% {:>11.1f} {:>8.4f}  {}".format(
+            row["run_id"], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["timestamp"])),
+            row["kp"], row["ki"], row["kd"], row["rise_ms"], row["overshoot_pct"],
+            row["settling_ms"], row["iae"], row["label"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("path", help="Directory of the archive")
+    parser.add_argument("--kp", type=float, help="Only runs with this Kp")
+    parser.add_argument("--ki", type=float, help="Only runs with this Ki")
+    parser.add_argument("--kd", type=float, help="Only runs with this Kd")
+    parser.add_argument("--label", help="Only runs with this label")
+    parser.add_argument("--sort", choices=INDEX_DTYPE.names, help="Index field to order runs by")
+    parser.add_argument("--last", type=int, help="Only the most recent runs")
+    parser.add_argument("--plot", action="store_true", help="Overlay the runs found")
+    args = parser.parse_args()
+
+    archive = RunArchive(args.path)
+    criteria = {name: getattr(args, name) for name in ("kp", "ki", "kd", "label")
+                if getattr(args, name) is not None}
+    rows = archive.find(sort=args.sort, last=args.last, **criteria)
+    print_index(rows)
+
+    if args.plot and len(rows):
+        from matplotlib import pyplot
+        plot_axes = pyplot.gca()
+        archive.overlay(plot_axes, rows["run_id"])
+        plot_axes.set_xlabel("Time [ms]")
+        plot_axes.set_ylabel("Encoder Ticks [#]")
+        plot_axes.legend()
+        plot_axes.grid(True)
+        pyplot.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""! @file schedule.py
+
+Assigns cotask priorities from task periods and checks that a task set can
+meet its deadlines. With rate-monotonic priorities the task with the shortest
+period gets the highest priority, so the fast control tasks always win over
+slower tasks such as printing and the heartbeat, whatever order the tasks are
+created in. Deadline-monotonic priorities rank tasks by a deadline that may be
+shorter than the period instead.
+
+The check uses the worst run time measured for each task, by the TaskStats
+wrapping it or in an earlier session. cotask never interrupts a running task,
+so a task can be blocked by one run of any lower priority task as well as
+delayed by every higher priority task. The worst case response time R of each
+task, with run time C, is found by the usual non-preemptive analysis
+
+    w = B + sum over higher priority tasks j of (w // T_j + 1) * C_j
+          + sum over interrupts k of ceil((w + C) / T_k) * C_k
+    R = w + C
+
+where B is the longest run of a lower priority task, iterated until w stops
+changing. A task misses its deadline when R is longer than the deadline.
+"""
+
+import json
+import timing_stats
+
+
+## Priority policies accepted by assign_priorities
+POLICIES = ("rate_monotonic", "deadline_monotonic", "table")
+
+# Sort key of tasks without a period, after every periodic task
+_NO_DEADLINE = 1 << 30
+
+
+def _deadline(task, deadlines_us):
+    if task.period is None:
+        return _NO_DEADLINE
+    if deadlines_us is not None and task.name in deadlines_us:
+        return deadlines_us[task.name]
+    return task.period
+
+
+def assign_priorities(tasks, policy="rate_monotonic", deadlines_us=None):
+    """!
+        Sets the priority of every task from its deadline, the shortest
+        deadline getting the highest priority. Tasks with the same deadline
+        keep the order of the priorities they were created with. Call this
+        before appending the tasks to cotask.task_list, which files tasks by
+        their priority as they are added.
+        @param tasks List of cotask.Task
+        @param policy "rate_monotonic" ranks tasks by period,
+            "deadline_monotonic" by their deadline in deadlines_us or else
+            their period, and "table" leaves the priorities as they are
+        @param deadlines_us Dictionary of deadlines in microseconds by task name
+    """
+    if policy not in POLICIES:
+        raise ValueError("Unknown scheduling policy {}".format(policy))
+    if policy == "table":
+        return
+    if policy == "rate_monotonic":
+        deadlines_us = None
+
+    order = sorted(tasks, key=lambda task: (_deadline(task, deadlines_us), -task.priority))
+    for rank, task in enumerate(order):
+        task.priority = len(order) - rank
+
+
+def response_times(tasks, run_times_us, deadlines_us=None, interrupts=()):
+    """!
+        Finds the worst case response time of every periodic task
+        @param tasks List of cotask.Task, with their priorities assigned
+        @param run_times_us Dictionary of worst run times in microseconds by
+            task and interrupt name; missing entries count as 0
+        @param deadlines_us Dictionary of deadlines in microseconds by task
+            name, for tasks whose deadline is shorter than their period
+        @param interrupts List of (name, period in microseconds) of interrupts,
+            which delay every task
+        @return List of (task, run time, deadline, response time) tuples in
+            microseconds, highest priority first. The response time is None
+            when it is longer than the deadline.
+    """
+    results = []
+    for task in sorted(tasks, key=lambda task: -task.priority):
+        if task.period is None:
+            continue
+        run_us = run_times_us.get(task.name, 0)
+        deadline = _deadline(task, deadlines_us)
+
+        blocking = 0
+        higher = []
+        for other in tasks:
+            if other is task:
+                continue
+            if other.priority >= task.priority and other.period is not None:
+                higher.append((other.period, run_times_us.get(other.name, 0)))
+            else:
+                blocking = max(blocking, run_times_us.get(other.name, 0))
+
+        wait = blocking + sum(run for _, run in higher)
+        while True:
+            delayed = blocking
+            for period, run in higher:
+                delayed += (wait // period + 1) * run
+            for name, period in interrupts:
+                delayed += -(-(wait + run_us) // period) * run_times_us.get(name, 0)
+            if delayed + run_us > deadline:
+                wait = None
+                break
+            if delayed == wait:
+                break
+            wait = delayed
+
+        results.append((task, run_us, deadline, None if wait is None else wait + run_us))
+    return results
+
+
+def utilization(tasks, run_times_us, interrupts=()):
+    """!
+        @param tasks List of cotask.Task
+        @param run_times_us Dictionary of worst run times in microseconds by task and interrupt name
+        @param interrupts List of (name, period in microseconds) of interrupts
+        @return Fraction of the CPU the periodic tasks and interrupts need at
+            their worst run times
+    """
+    total = 0
+    for task in tasks:
+        if task.period is not None:
+            total += run_times_us.get(task.name, 0) / task.period
+    for name, period in interrupts:
+        total += run_times_us.get(name, 0) / period
+    return total
+
+
+def check(tasks, run_times_us, deadlines_us=None, interrupts=()):
+    """!
+        Checks that every periodic task meets its deadline
+        @param tasks List of cotask.Task, with their priorities assigned
+        @param run_times_us Dictionary of worst run times in microseconds by task and interrupt name
+        @param deadlines_us Dictionary of deadlines in microseconds by task name
+        @param interrupts List of (name, period in microseconds) of interrupts
+        @return Tuple of True if every deadline is met, and a table of every
+            task's priority, period, deadline, run time and response time
+    """
+    lines = ["{:<28s}{:>9s}{:>10s}{:>10s}{:>10s}{:>11s}".format(
+        "task", "priority", "period", "deadline", "run us", "response")]
+    feasible = True
+    unmeasured = []
+
+    for task, run_us, deadline, response in response_times(tasks, run_times_us,
+                                                           deadlines_us, interrupts):
+        if task.name not in run_times_us:
+            unmeasured.append(task.name)
+        if response is None:
+            feasible = False
+        lines.append("{:<28s}{:>9d}{:>10d}{:>10d}{:>10d}{:>11s}".format(
+            task.name, task.priority, task.period, deadline, run_us,
+            "MISS" if response is None else str(response)))
+
+    for name, period in interrupts:
+        if name not in run_times_us:
+            unmeasured.append(name)
+        lines.append("{:<28s}{:>9s}{:>10d}{:>10s}{:>10d}{:>11s}".format(
+            name, "isr", period, "-", run_times_us.get(name, 0), "-"))
+
+    load = utilization(tasks, run_times_us, interrupts)
+    count = sum(1 for task in tasks if task.period is not None) + len(interrupts)
+    bound = count * (2 ** (1 / count) - 1) if count else 1
+    if load > 1:
+        feasible = False
+    lines.append("CPU utilization {:.1f} %, rate-monotonic bound for {} tasks {:.1f} %".format(
+        100 * load, count, 100 * bound))
+    if unmeasured:
+        lines.append("No run time measured yet for " + ", ".join(unmeasured))
+    lines.append("Every deadline met" if feasible else "Deadlines can be missed")
+
+    return feasible, "\n".join(lines)
+
+
+def measured_run_times():
+    """!
+        @return Dictionary of the worst run time in microseconds of every
+            task in timing_stats.task_stats_list that has run
+    """
+    return {stats.name: stats.run_time.maximum
+            for stats in timing_stats.task_stats_list if stats.run_time.count}
+
+
+def run_times_changed(saved_us, measured_us, tolerance):
+    """!
+        Decides whether newly measured run times are worth saving
+        @param saved_us Dictionary of saved run times in microseconds by name
+        @param measured_us Dictionary of measured run times in microseconds by name
+        @param tolerance Fraction of the saved time a measurement must differ by
+        @return True if a name is new or its run time differs from the saved
+            one by more than the tolerance
+    """
+    for name, run_us in measured_us.items():
+        saved = saved_us.get(name)
+        if saved is None or abs(run_us - saved) > tolerance * saved:
+            return True
+    return False
+
+
+def save_run_times(run_times_us, path):
+    """!
+        Writes run times to a JSON file, so the next session can check its
+        schedule before it starts
+        @param run_times_us Dictionary of worst run times in microseconds by name
+        @param path File to write
+    """
+    with open(path, "w") as file:
+        json.dump(run_times_us, file)
+
+
+def load_run_times(path):
+    """!
+        Reads run times written by save_run_times
+        @param path File to read
+        @return Dictionary of worst run times in microseconds by name, empty if
+            the file cannot be read
+    """
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
@@ -8,16 +8,21 @@ https://deepbluembedded.com/stm32-servo-motor-control-with-pwm-servo-library-exa
 """
 
 import pyb
+from array import array
 
 class ServoDriver:
     """!
-    This class implements a servo controlled with PWM pulse width
+    This class implements a servo controlled with PWM pulse width.
+    Pulse widths for every angle step are computed once at construction, and
+    motions are planned ahead into a table of angle steps, so each update by
+    motion_task is a table lookup and, only when the pulse changes, a timer write.
     """
 
     def __init__(self,
                  pwm_pin: pyb.Pin.board, pwm_timer_num: int, pwm_channel_num: int,
                  pwm_min_pulse: int, pwm_max_pulse: int, full_angle_range: int,
-                 period_ARR: int, period_PS: int 
+                 period_ARR: int, period_PS: int,
+                 steps_per_degree: int = 1, motion_capacity: int = 1000
                  ):
         """! 
             Creates a servo driver by initializing GPIO pins.
@@ -29,12 +34,15 @@ class ServoDriver:
             @param full_angle_range Difference in physical angle for given min and max pulse
             @param period_ARR Auto reload value to use for timer
             @param period_PS Pre-scale value to use for timer
+            @param steps_per_degree Number of angle steps per degree in the pulse table
+            @param motion_capacity Largest number of task ticks in a planned motion
         """        
 
         # set self values for the pulse information
         self.__pwm_min_pulse = pwm_min_pulse
         self.__pwm_max_pulse = pwm_max_pulse
         self.__full_angle_range = full_angle_range
+        self.__steps_per_degree = steps_per_degree
 
         # set up a pin to write pwm to 
         self.__pwm_pin = pyb.Pin(pwm_pin, pyb.Pin.OUT_PP)
@@ -46,7 +54,18 @@ class ServoDriver:
         # determine the applicable angle resolution that can be used
         self.__angle_res = (pwm_max_pulse - pwm_min_pulse) / full_angle_range   # resolution in counts / deg
 
-        self.sweep_angle = 0
+        ## Pulse width count for each angle step, from 0 to the full angle range
+        self.pulse_table = array('H', (int(step * self.__angle_res / steps_per_degree + pwm_min_pulse)
+                                       for step in range(full_angle_range * steps_per_degree + 1)))
+
+        ## Angle step to apply at each task tick of the planned motion
+        self.motion = array('H', (0 for _ in range(motion_capacity)))
+        self.__motion_count = 0
+        self.__motion_index = 0
+        self.__motion_repeat = False
+
+        self.__step = 0
+        self.__pulse = -1
  
 
     def set_angle(self,
@@ -61,40 +80,100 @@ class ServoDriver:
         assert angle <= self.__full_angle_range, "Angle cannot be larger than given maximum"
         assert angle >= 0, "Angle cannot be non-positive"
         
-        self.__angle = angle
-    
-        # convert the input angle to a count that can be passed into pulse_width
-        angle_count = int( (self.__angle * self.__angle_res) + self.__pwm_min_pulse )
+        self.set_step(int(angle * self.__steps_per_degree))
+
+
+    def set_step(self, step: int):
+        """!
+            Sets the angle of the servo from the pulse table, writing the timer
+            only when the pulse width changes
+            @param step Index into the pulse table, from 0 to the full angle
+                range times steps_per_degree
+        """
+        self.__step = step
+        pulse = self.pulse_table[step]
 
-        #print(angle_count)
-        self.__pwm_timer_chan.pulse_width(angle_count)
+        if pulse != self.__pulse:
+            self.__pulse = pulse
+            self.__pwm_timer_chan.pulse_width(pulse)
 
 
     def get_angle(self):
         """!
             Returns the current angle of the servo.
         """
-        return self.__angle
+        return self.__step / self.__steps_per_degree
     
 
     def reset_pulse_width(self):
         """!
             Resets the pulse width to zero to prevent running of the servo after program shutdown.
         """
-        self.__pwm_timer_chan.pulse_width(0)
+        if self.__pulse != 0:
+            self.__pulse = 0
+            self.__pwm_timer_chan.pulse_width(0)
 
 
+    def plan_waypoints(self, waypoints, period_ms: int, repeat: bool = False):
+        """!
+            Plans a motion through waypoints, moving at a constant rate between
+            each pair, and restarts motion_task at its beginning
+            @param waypoints List of (time in ms, angle in degrees) pairs in
+                order of increasing time, starting at time 0
+            @param period_ms Period of the task running motion_task in ms
+            @param repeat True to start over after the last waypoint, False to
+                hold the last angle
+            @return Number of task ticks in the motion
+        """
+        last_time = waypoints[-1][0]
+        count = last_time // period_ms + 1
+        if count > len(self.motion):
+            raise ValueError("Motion needs {} ticks, more than the {} allocated".format(
+                count, len(self.motion)))
+
+        for time, angle in waypoints:
+            if angle < 0 or angle > self.__full_angle_range:
+                raise ValueError("Waypoint angle {} is outside 0 to {}".format(
+                    angle, self.__full_angle_range))
+
+        segment = 0
+        for tick in range(count):
+            time = tick * period_ms
+            while segment < len(waypoints) - 2 and time >= waypoints[segment + 1][0]:
+                segment += 1
+            start_time, start_angle = waypoints[segment]
+            end_time, end_angle = waypoints[min(segment + 1, len(waypoints) - 1)]
+
+            if end_time > start_time:
+                fraction = min(time - start_time, end_time - start_time) / (end_time - start_time)
+                angle = start_angle + (end_angle - start_angle) * fraction
+            else:
+                angle = end_angle
+            self.motion[tick] = int(angle * self.__steps_per_degree + 0.5)
 
-    def test_sweep_reset(self):
+        self.__motion_count = count
+        self.__motion_index = 0
+        self.__motion_repeat = repeat
+        return count
+
+
+    def plan_sweep(self, start_angle: float, end_angle: float, duration_ms: int, period_ms: int,
+                   repeat: bool = True):
         """!
-            Resets the current sweep angle.
+            Plans a constant rate sweep between two angles
+            @param start_angle Angle at the start of the sweep in degrees
+            @param end_angle Angle at the end of the sweep in degrees
+            @param duration_ms Length of the sweep in ms
+            @param period_ms Period of the task running motion_task in ms
+            @param repeat True to sweep again from the start angle after each sweep
+            @return Number of task ticks in the motion
         """
-        self.sweep_angle = 0
+        return self.plan_waypoints([(0, start_angle), (duration_ms, end_angle)], period_ms, repeat)
 
 
-    def test_sweep_run(self, shares):
+    def motion_task(self, shares):
         """!
-            Ramps through the full range of valid integer angles every time this function is called. Intended to be used as a task.
+            Applies one step of the planned motion every time this function is called. Intended to be used as a task.
             @param shares Includes the current task state to allow disabling of the servo
         """
         task_state_share = shares
@@ -104,13 +183,37 @@ class ServoDriver:
 
             if state == 0:
                 self.reset_pulse_width()
-                pass
             else:
-                if self.sweep_angle < self.__full_angle_range:
-                    self.sweep_angle += 1
-                    self.set_angle(self.sweep_angle)
-                    print (self.sweep_angle)
-                else:
-                    self.sweep_angle = 0
-
-            yield
\ No newline at end of file
+                index = self.__motion_index
+                if index < self.__motion_count:
+                    self.set_step(self.motion[index])
+                    index += 1
+                    if index >= self.__motion_count and self.__motion_repeat:
+                        index = 0
+                    self.__motion_index = index
+
+            yield
+
+
+    def test_sweep_reset(self):
+        """!
+            Plans a repeating sweep through the full range of angles, one
+            degree every time motion_task runs.
+        """
+        count = self.__full_angle_range + 1
+        if count > len(self.motion):
+            raise ValueError("Sweep needs {} ticks, more than the {} allocated".format(
+                count, len(self.motion)))
+        for tick in range(count):
+            self.motion[tick] = tick * self.__steps_per_degree
+        self.__motion_count = count
+        self.__motion_index = 0
+        self.__motion_repeat = True
+
+
+    def test_sweep_run(self, shares):
+        """!
+            Runs the sweep planned by test_sweep_reset. Intended to be used as a task.
+            @param shares Includes the current task state to allow disabling of the servo
+        """
+        return self.motion_task(shares)
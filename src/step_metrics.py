@@ -0,0 +1,91 @@
+"""! @file step_metrics.py
+
+Computes step response quality figures for many runs at once. Runs on a PC, not
+on the board. Each run is one row of a two dimensional array of positions
+sampled on a shared time grid, so every figure is found with whole-array NumPy
+operations instead of a Python loop over runs or samples.
+"""
+
+import numpy
+
+
+## Fraction of the step at which the rise starts
+RISE_LOW = 0.1
+## Fraction of the step at which the rise ends
+RISE_HIGH = 0.9
+## Settling band, as a fraction of the step
+SETTLING_BAND = 0.02
+## Fraction of the samples at the end of a run averaged for the steady state error
+STEADY_STATE_FRACTION = 0.1
+
+
+def resample(times, positions, grid):
+    """!
+    @brief Resample one run onto a common time grid.
+    Samples past the end of the run hold the last position.
+    @param times Sample times of the run in ms
+    @param positions Sample positions of the run
+    @param grid Times in ms to sample at
+    @return Array of positions at the grid times
+    """
+    times = numpy.asarray(times, dtype=float)
+    positions = numpy.asarray(positions, dtype=float)
+    if len(times) == 0:
+        return numpy.full(len(grid), numpy.nan)
+    return numpy.interp(grid, times, positions)
+
+
+def _first_index(mask):
+    # Index of the first True in each row, or -1 for rows without one
+    index = numpy.argmax(mask, axis=1)
+    return numpy.where(mask.any(axis=1), index, -1)
+
+
+def step_metrics(times, positions, target):
+    """!
+    @brief Compute step response figures for every run at once.
+    @param times Shared sample times in ms, of length N
+    @param positions Array of shape (runs, N) of positions, or of shape (N,) for one run
+    @param target Step size, a scalar or one value per run
+    @return Dictionary of arrays with one value per run: "rise_ms" (10 % to 90 %
+        of the step), "overshoot_pct", "settling_ms" (time after which the
+        response stays within 2 % of the step), "steady_state_error" (mean error
+        over the last 10 % of the run) and "iae" (integral of the absolute error
+        in step-size-seconds, so runs with different steps compare directly).
+        Figures that are never reached are NaN.
+    """
+    times = numpy.asarray(times, dtype=float)
+    positions = numpy.atleast_2d(numpy.asarray(positions, dtype=float))
+    target = numpy.broadcast_to(numpy.asarray(target, dtype=float), (len(positions),))[:, None]
+
+    # Work with the response as a fraction of the step so negative steps behave
+    fraction = positions / target
+    error = 1 - fraction
+
+    rise_start = _first_index(fraction >= RISE_LOW)
+    rise_end = _first_index(fraction >= RISE_HIGH)
+    rise_ms = numpy.where((rise_start >= 0) & (rise_end >= 0),
+                          times[rise_end] - times[rise_start], numpy.nan)
+
+    overshoot_pct = numpy.maximum(numpy.nanmax(fraction, axis=1) - 1, 0) * 100
+
+    outside = numpy.abs(error) > SETTLING_BAND
+    last_outside = outside.shape[1] - 1 - _first_index(outside[:, ::-1])
+    last_outside[~outside.any(axis=1)] = -1
+    settled = last_outside < outside.shape[1] - 1
+    settling_ms = numpy.where(settled, times[numpy.minimum(last_outside + 1, len(times) - 1)],
+                              numpy.nan)
+
+    tail = max(1, int(len(times) * STEADY_STATE_FRACTION))
+    steady_state_error = error[:, -tail:].mean(axis=1) * target[:, 0]
+
+    step_s = numpy.diff(times) / 1000
+    iae = (0.5 * (numpy.abs(error[:, 1:]) + numpy.abs(error[:, :-1])) * step_s).sum(axis=1)
+
+    return {
+        "rise_ms": rise_ms,
+        "overshoot_pct": overshoot_pct,
+        "settling_ms": settling_ms,
+        "steady_state_error": steady_state_error,
+        "iae": iae,
+    }
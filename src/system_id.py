@@ -0,0 +1,302 @@
+"""! @file system_id.py
+
+Fits a model of the motor to recorded step responses and suggests PID gains
+from it, so most tuning can be done on a PC instead of on the board. Runs on a
+PC, not on the board. Runs need the controller output of every sample, which
+capture mode records; they are read from a run archive, see run_archive.py.
+
+The model is a first order velocity response to the duty cycle u, in percent,
+with Coulomb friction f and a deadband d:
+
+    tau * dv/dt + v = K * (u - f * sign(v))    while moving
+    v = 0                                      while |u| <= d at rest
+
+where v is in encoder ticks per second, K is the speed per percent of duty and
+tau is the time constant. Velocities are found from position differences over
+each sample period, so with the controller output held over each period the
+model becomes the linear regression
+
+    v[k+1] = a * v[k] + b1 * u[k-n] + b2 * u[k+1-n] + c * sign(v[k])
+
+with a = exp(-T / tau), K = (b1 + b2) / (1 - a) and f = -c / (b1 + b2), where
+n is the number of samples the output takes to reach the motor. The
+regression is solved by least squares for every run at once and for all runs
+pooled, for each candidate delay, and the delay with the smallest residual is
+kept. The deadband is taken from the largest outputs that left the motor at rest.
+
+Usage: python src/system_id.py runs [--kp 0.03] [--last 20] [--damping 1] [--plot]
+"""
+
+import argparse
+import numpy
+import step_metrics
+
+
+## Largest delay in samples tried between the controller output and the motor
+MAX_DELAY = 3
+
+## Shortest sample period fitted at in ms. Runs sampled faster are averaged
+## down to it, since over a shorter period a velocity found from the change in
+## position is mostly encoder quantization.
+MIN_PERIOD_MS = 5
+
+## Percentile of the outputs that left the motor at rest taken as the deadband,
+## below 100 so a few samples where the motor crept less than a count do not count
+DEADBAND_PERCENTILE = 95
+
+
+def stack_runs(runs, period_ms=None):
+    """!
+    @brief Put runs on one evenly spaced time grid as rows of two dimensional arrays.
+    @param runs List of (times in ms, positions, controller outputs) tuples
+    @param period_ms Grid spacing in ms; by default the median sample period
+        of the runs, or MIN_PERIOD_MS if that is longer
+    @return Tuple of the grid spacing in ms and arrays of shape (runs, samples)
+        of positions at each grid time and the mean controller output from
+        each grid time to the next. Samples past the end of a run are NaN.
+    """
+    if period_ms is None:
+        period_ms = max(MIN_PERIOD_MS,
+                        numpy.median(numpy.concatenate([numpy.diff(run[0]) for run in runs])))
+
+    length = max(int(numpy.floor(run[0][-1] / period_ms)) + 1 for run in runs)
+    grid = numpy.arange(length) * period_ms
+    positions = numpy.full((len(runs), length), numpy.nan)
+    controls = numpy.full((len(runs), length), numpy.nan)
+
+    for row, (times, run_positions, run_controls) in enumerate(runs):
+        times = numpy.asarray(times, dtype=float)
+        count = numpy.searchsorted(grid, times[-1], side="right")
+        positions[row, :count] = step_metrics.resample(times, run_positions, grid[:count])
+        # Each output is held until the next sample, so its running integral
+        # is piecewise linear and the mean over a grid period is exact
+        run_controls = numpy.asarray(run_controls, dtype=float)
+        integral = numpy.concatenate(([0], numpy.cumsum(run_controls[:-1] * numpy.diff(times))))
+        controls[row, :count - 1] = numpy.diff(numpy.interp(grid[:count], times, integral)) / period_ms
+
+    return period_ms, positions, controls
+
+
+def _regression(velocity, controls, delay):
+    # Rows of the regression for every run and sample, with a mask of the rows
+    # where every value is known and the motor keeps moving the same way, as
+    # friction changes sign partway through a period where it reverses
+    current = velocity[:, delay:-1]
+    following = velocity[:, delay + 1:]
+    held = controls[:, :current.shape[1]]
+    next_held = controls[:, 1:current.shape[1] + 1]
+
+    regressors = numpy.stack((current, held, next_held, numpy.sign(current)), axis=2)
+    valid = (numpy.isfinite(regressors).all(axis=2) & numpy.isfinite(following)
+             & (current * following > 0))
+    regressors = numpy.where(valid[:, :, None], regressors, 0)
+    return regressors, numpy.where(valid, following, 0), valid
+
+
+def _solve(gram, moment):
+    # Least squares coefficients from normal equations, for one or many
+    # systems at once; pinv copes with runs that never excite every term
+    return numpy.einsum("...ij,...j->...i", numpy.linalg.pinv(gram), moment)
+
+
+def _plant(coefficients, period_s):
+    # Model parameters from regression coefficients, for one or many fits at once
+    a = coefficients[..., 0]
+    b = coefficients[..., 1] + coefficients[..., 2]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        time_constant_s = numpy.where((a > 0) & (a < 1), -period_s / numpy.log(a), numpy.nan)
+        gain = b / (1 - a)
+        friction_pct = -coefficients[..., 3] / b
+    return gain, time_constant_s, friction_pct
+
+
+def fit_plant(runs, period_ms=None, max_delay=MAX_DELAY):
+    """!
+    @brief Fit the motor model to runs by least squares.
+    @param runs List of (times in ms, positions, controller outputs) tuples
+    @param period_ms Sample period to fit at in ms; by default the median of the runs
+    @param max_delay Largest delay in samples tried between output and motor
+    @return Dictionary of "gain" (ticks per second per percent duty),
+        "time_constant_s", "friction_pct" and "deadband_pct" (both in percent
+        duty), "delay_samples", "period_ms", "residual_rms" (ticks per second),
+        and "run_gain", "run_time_constant_s" and "run_friction_pct", arrays of
+        the same figures fitted to each run alone. Figures a run cannot show
+        are NaN.
+    """
+    period_ms, positions, controls = stack_runs(runs, period_ms)
+    period_s = period_ms / 1000
+    velocity = numpy.diff(positions, axis=1) / period_s
+
+    best = None
+    for delay in range(max_delay + 1):
+        regressors, following, valid = _regression(velocity, controls, delay)
+        gram = numpy.einsum("rki,rkj->rij", regressors, regressors)
+        moment = numpy.einsum("rki,rk->ri", regressors, following)
+
+        pooled = _solve(gram.sum(axis=0), moment.sum(axis=0))
+        residual = following - regressors @ pooled
+        count = valid.sum()
+        rms = numpy.sqrt((residual[valid] ** 2).sum() / count) if count else numpy.inf
+
+        if best is None or rms < best[0]:
+            best = (rms, delay, pooled, _solve(gram, moment))
+
+    rms, delay, pooled, per_run = best
+    gain, time_constant_s, friction_pct = _plant(pooled, period_s)
+    run_gain, run_time_constant_s, run_friction_pct = _plant(per_run, period_s)
+
+    # Outputs reaching the motor while it stayed at rest were inside the deadband
+    at_rest = (velocity[:, delay:-1] == 0) & (velocity[:, delay + 1:] == 0)
+    rest_controls = numpy.abs(controls[:, 1:at_rest.shape[1] + 1])[at_rest]
+    rest_controls = rest_controls[numpy.isfinite(rest_controls)]
+    deadband_pct = (numpy.percentile(rest_controls, DEADBAND_PERCENTILE)
+                    if len(rest_controls) else numpy.nan)
+
+    return {
+        "gain": float(gain),
+        "time_constant_s": float(time_constant_s),
+        "friction_pct": float(friction_pct),
+        "deadband_pct": float(deadband_pct),
+        "delay_samples": delay,
+        "period_ms": float(period_ms),
+        "residual_rms": float(rms),
+        "run_gain": run_gain,
+        "run_time_constant_s": run_time_constant_s,
+        "run_friction_pct": run_friction_pct,
+    }
+
+
+def simulate_plant(plant, controls, period_ms=None):
+    """!
+    @brief Predict positions from controller outputs with a fitted model.
+    Every row of outputs is simulated at once, starting at rest at position 0.
+    @param plant Dictionary returned by fit_plant
+    @param controls Array of shape (runs, samples) of controller outputs
+    @param period_ms Sample period in ms; by default the one the model was fitted at
+    @return Array of the same shape of predicted positions
+    """
+    controls = numpy.atleast_2d(numpy.nan_to_num(numpy.asarray(controls, dtype=float)))
+    period_s = (plant["period_ms"] if period_ms is None else period_ms) / 1000
+    decay = numpy.exp(-period_s / plant["time_constant_s"])
+    delay = plant["delay_samples"]
+    controls = numpy.concatenate((numpy.zeros((len(controls), delay)), controls), axis=1)
+
+    velocity = numpy.zeros(len(controls))
+    positions = numpy.zeros((len(controls), controls.shape[1] - delay))
+    for index in range(1, positions.shape[1]):
+        drive = controls[:, index - 1]
+        moving = (velocity != 0) | (numpy.abs(drive) > plant["deadband_pct"])
+        direction = numpy.where(velocity != 0, numpy.sign(velocity), numpy.sign(drive))
+        target = plant["gain"] * (drive - plant["friction_pct"] * direction)
+        new_velocity = decay * velocity + (1 - decay) * target
+        # Friction stops the motor rather than reversing it
+        new_velocity[numpy.sign(new_velocity) * direction < 0] = 0
+        velocity = numpy.where(moving, new_velocity, 0)
+        positions[:, index] = positions[:, index - 1] + velocity * period_s
+
+    return positions
+
+
+def suggest_gains(plant, damping=1.0, natural_frequency=None):
+    """!
+    @brief Suggest PIDController gains that place the poles of the position loop.
+    With the model above, proportional gain Kp on the position error and
+    derivative gain on the measured velocity give the closed loop
+    tau * s^2 + (1 + K * Kd') * s + K * Kp, which is matched to
+    s^2 + 2 * damping * wn * s + wn^2. The integral gain then removes the
+    friction offset over about four times 1 / wn.
+    @param plant Dictionary returned by fit_plant
+    @param damping Damping ratio of the position loop; 1 for no overshoot
+    @param natural_frequency Natural frequency wn of the position loop in rad/s.
+        By default it is set from the sample period and delay, so the loop
+        keeps its phase margin, but no faster than four times 1 / tau.
+    @return Dictionary of "Kp", "Ki" and "Kd" per sample, as PIDController
+        uses them, with "natural_frequency" and "settling_ms", the expected 2 %
+        settling time of a step small enough not to saturate the output
+    """
+    period_s = plant["period_ms"] / 1000
+    gain = plant["gain"]
+    time_constant_s = plant["time_constant_s"]
+
+    if natural_frequency is None:
+        natural_frequency = min(0.25 / ((plant["delay_samples"] + 0.5) * period_s),
+                                4 / time_constant_s)
+
+    kp = time_constant_s * natural_frequency ** 2 / gain
+    # The derivative acts on the change in position per sample
+    kd = max(0.0, (2 * damping * natural_frequency * time_constant_s - 1) / gain) / period_s
+    ki = kp * period_s * natural_frequency / 4
+
+    return {
+        "Kp": kp,
+        "Ki": ki,
+        "Kd": kd,
+        "natural_frequency": natural_frequency,
+        "settling_ms": 1000 * (5.8 if damping >= 1 else 4 / damping) / natural_frequency,
+    }
+
+
+def main():
+    import run_archive
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("path", help="Directory of the run archive")
+    parser.add_argument("--kp", type=float, help="Only runs with this Kp")
+    parser.add_argument("--label", help="Only runs with this label")
+    parser.add_argument("--last", type=int, help="Only the most recent runs")
+    parser.add_argument("--damping", type=float, default=1.0,
+                        help="Damping ratio of the suggested position loop")
+    parser.add_argument("--frequency", type=float,
+                        help="Natural frequency of the suggested position loop in rad/s")
+    parser.add_argument("--plot", action="store_true",
+                        help="Plot the runs against the positions the model predicts")
+    args = parser.parse_args()
+
+    archive = run_archive.RunArchive(args.path)
+    criteria = {name: getattr(args, name) for name in ("kp", "label")
+                if getattr(args, name) is not None}
+    rows = archive.find(last=args.last, **criteria)
+
+    runs = []
+    for run_id in rows["run_id"]:
+        samples = archive.samples(run_id)
+        if len(samples) > 2 and numpy.isfinite(samples["control"]).all():
+            runs.append((samples["time_ms"], samples["position"], samples["control"]))
+    if not runs:
+        print("No runs with recorded controller outputs; record runs in capture mode")
+        return
+    print("Fitting {} of {} runs".format(len(runs), len(rows)))
+
+    plant = fit_plant(runs)
+    print("gain {:.4g} ticks/s per % duty, time constant {:.4g} s, friction {:.3g} % duty, "
+          "deadband {:.3g} % duty, delay {} samples of {:g} ms, residual {:.4g} ticks/s".format(
+              plant["gain"], plant["time_constant_s"], plant["friction_pct"],
+              plant["deadband_pct"], plant["delay_samples"], plant["period_ms"],
+              plant["residual_rms"]))
+    print("per run gain {} ticks/s per % duty, time constant {} s".format(
+        numpy.array2string(plant["run_gain"], precision=4),
+        numpy.array2string(plant["run_time_constant_s"], precision=4)))
+
+    gains = suggest_gains(plant, args.damping, args.frequency)
+    print("suggested Kp={:.4g} Ki={:.4g} Kd={:.4g}, settling in about {:.0f} ms "
+          "for steps that do not saturate".format(
+              gains["Kp"], gains["Ki"], gains["Kd"], gains["settling_ms"]))
+    print("send to the board as {:.4g},{:.4g},{:.4g}".format(gains["Kp"], gains["Ki"], gains["Kd"]))
+
+    if args.plot:
+        from matplotlib import pyplot
+        period_ms, positions, controls = stack_runs(runs, plant["period_ms"])
+        predicted = simulate_plant(plant, controls)
+        grid = numpy.arange(positions.shape[1]) * period_ms
+        for measured, model in zip(positions, predicted):
+            line, = pyplot.plot(grid, measured)
+            pyplot.plot(grid, model, linestyle="--", color=line.get_color())
+        pyplot.xlabel("Time [ms]")
+        pyplot.ylabel("Encoder Ticks [#]")
+        pyplot.title("Measured (solid) and model (dashed)")
+        pyplot.grid(True)
+        pyplot.show()
+
+
+if __name__ == "__main__":
+    main()
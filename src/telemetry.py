@@ -0,0 +1,87 @@
+"""! @file telemetry.py
+
+Packs motor data into fixed-size binary frames for streaming over the serial
+link. Frames are built in place in a preallocated buffer, so logging does not
+allocate on the heap, and several frames may be batched into one USB write.
+
+Frame layout, little endian, 16 bytes:
+sync 0xA5, sync 0x5A, time [us] (uint32), position (int32),
+control value (float32), task state (uint8), checksum (uint8).
+The checksum is the low byte of the sum of every byte between the sync bytes
+and the checksum.
+"""
+
+import struct
+import micropython
+
+
+## First sync byte of every frame
+SYNC_1 = 0xA5
+## Second sync byte of every frame
+SYNC_2 = 0x5A
+## Layout of a frame as a struct format string
+FRAME_FORMAT = "<BBIifBB"
+## Size of one frame in bytes
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+
+
+@micropython.native
+def checksum(buf, start, end):
+    """!
+        Computes the frame checksum over part of a buffer
+        @param buf Buffer holding the frame
+        @param start Index of the first byte to include
+        @param end Index one past the last byte to include
+        @return Low byte of the sum of the bytes
+    """
+    total = 0
+    for index in range(start, end):
+        total += buf[index]
+    return total & 0xFF
+
+
+class TelemetryWriter:
+    """!
+    Writes telemetry frames to a stream such as pyb.USB_VCP
+    """
+
+    def __init__(self, stream, frames_per_write=1):
+        """!
+            Creates a writer with a preallocated frame buffer
+            @param stream Object with a write() method accepting a buffer
+            @param frames_per_write Number of frames batched into each write
+        """
+        self.__stream = stream
+        self.__frames_per_write = frames_per_write
+        self.__buffer = bytearray(FRAME_SIZE * frames_per_write)
+        self.__view = memoryview(self.__buffer)
+        self.__pending = 0
+
+
+    def write(self, time_us, position, control, state):
+        """!
+            Adds a frame to the batch, writing the batch once it is full
+            @param time_us Time stamp in microseconds
+            @param position Position in encoder ticks
+            @param control Controller output
+            @param state Task state
+        """
+        offset = self.__pending * FRAME_SIZE
+        struct.pack_into(FRAME_FORMAT, self.__buffer, offset,
+                         SYNC_1, SYNC_2, time_us, position, control, state, 0)
+        self.__buffer[offset + FRAME_SIZE - 1] = checksum(self.__buffer, offset + 2,
+                                                          offset + FRAME_SIZE - 1)
+        self.__pending += 1
+
+        if self.__pending == self.__frames_per_write:
+            self.__stream.write(self.__buffer)
+            self.__pending = 0
+
+
+    def flush(self):
+        """!
+            Writes any frames waiting in a partially filled batch
+        """
+        if self.__pending:
+            self.__stream.write(self.__view[:self.__pending * FRAME_SIZE])
+            self.__pending = 0
@@ -0,0 +1,282 @@
+"""! @file timing_stats.py
+
+Fixed-memory statistics for timing measurements made in microseconds.
+Recording a value only uses integer arithmetic on preallocated storage, so it
+is cheap enough for every control tick and safe to call from an interrupt.
+TaskStats and timed() use them to instrument cotask tasks, in place of the
+cotask trace, which grows without limit.
+
+When track_allocations is set, timed() also records how many bytes of heap
+each resume of a task allocates, from gc.mem_alloc() before and after it.
+allocation_report() lists the tasks that allocate the most. A resume during
+which the heap shrank had a garbage collection run inside it, and is counted
+in the collections of its TaskStats.
+"""
+
+import gc
+import utime
+from array import array
+
+
+## Record the heap allocated by every task resume; costs two gc.mem_alloc()
+## calls per resume, so it is off unless allocations are being investigated
+track_allocations = False
+
+## Number of bits of the running sum kept below its chunk count. Each part of
+## the sum then stays well within MicroPython's small integers, so recording
+## never promotes it to a long integer, which would allocate in an interrupt.
+TOTAL_SHIFT = 20
+
+
+class TimingStats:
+    """!
+    Keeps the count, sum, minimum and maximum of a stream of integer
+    measurements along with a histogram of fixed-width bins. Values past the
+    last bin are counted in the last bin. The sum is kept as a count of whole
+    chunks of 2 ** TOTAL_SHIFT and the remainder, so it grows without bound
+    while every part of it stays a small integer.
+    """
+
+    def __init__(self, bin_width_us=100, bin_count=20, unit="us"):
+        """!
+            Creates an empty set of statistics
+            @param bin_width_us Width of each histogram bin in microseconds
+            @param bin_count Number of histogram bins
+            @param unit Unit of the measurements when printed, for statistics
+                of something other than time
+        """
+        self.bin_width_us = bin_width_us
+        self.bin_count = bin_count
+        self.unit = unit
+        ## Number of measurements in each histogram bin
+        self.histogram = array('l', (0 for _ in range(bin_count)))
+        self.reset()
+
+
+    def reset(self):
+        """!
+            Forgets every recorded measurement
+        """
+        self.count = 0
+        self.__total_low = 0
+        self.__total_chunks = 0
+        self.minimum = 0
+        self.maximum = 0
+        for index in range(self.bin_count):
+            self.histogram[index] = 0
+
+
+    def add(self, value):
+        """!
+            Records one measurement
+            @param value Integer measurement in microseconds
+        """
+        if self.count == 0 or value < self.minimum:
+            self.minimum = value
+        if self.count == 0 or value > self.maximum:
+            self.maximum = value
+        self.count += 1
+
+        low = self.__total_low + value
+        if low >> TOTAL_SHIFT:
+            self.__total_chunks += low >> TOTAL_SHIFT
+            low &= (1 << TOTAL_SHIFT) - 1
+        self.__total_low = low
+
+        index = value // self.bin_width_us
+        if index < 0:
+            index = 0
+        elif index >= self.bin_count:
+            index = self.bin_count - 1
+        self.histogram[index] += 1
+
+
+    def total(self):
+        """!
+            @return Sum of the recorded measurements; may allocate, so not for
+                use in an interrupt
+        """
+        return (self.__total_chunks << TOTAL_SHIFT) + self.__total_low
+
+
+    def mean(self):
+        """!
+            @return Mean of the recorded measurements, or 0 if there are none
+        """
+        if self.count == 0:
+            return 0
+        return self.total() / self.count
+
+
+    def __repr__(self):
+        return "n={} min={} mean={:.1f} max={} {} hist({} {} bins)={}".format(
+            self.count, self.minimum, self.mean(), self.maximum, self.unit,
+            self.bin_width_us, self.unit, list(self.histogram))
+
+
+## Every TaskStats created, in order of creation, for show_all()
+task_stats_list = []
+
+
+class TaskStats:
+    """!
+    Fixed-memory instrumentation of one periodic cotask task. Records how late
+    each run starts after its release, how long each run takes, and how many
+    runs finish after their deadline, taken to be the next release. Releases
+    are one period apart, in phase with the earliest run seen.
+    """
+
+    def __init__(self, name, period_ms, latency_bin_us=None, latency_bin_count=12,
+                 run_bin_us=50, run_bin_count=20, alloc_bin_bytes=32, alloc_bin_count=16):
+        """!
+            Creates empty statistics for a task and adds them to task_stats_list
+            @param name Name of the task, used when printing
+            @param period_ms Period of the task in ms, or None for a task that
+                only runs when triggered, in which case only run time is recorded
+            @param latency_bin_us Width of each start latency histogram bin in
+                microseconds; by default a tenth of the period
+            @param latency_bin_count Number of start latency histogram bins
+            @param run_bin_us Width of each run time histogram bin in microseconds
+            @param run_bin_count Number of run time histogram bins
+            @param alloc_bin_bytes Width of each allocation histogram bin in bytes
+            @param alloc_bin_count Number of allocation histogram bins
+        """
+        self.name = name
+        self.period_us = None if period_ms is None else int(period_ms * 1000)
+        if latency_bin_us is None:
+            latency_bin_us = max(1, (self.period_us or 10000) // 10)
+        ## Time from each release to the start of the run it released
+        self.latency = TimingStats(latency_bin_us, latency_bin_count)
+        ## Time taken by each run
+        self.run_time = TimingStats(run_bin_us, run_bin_count)
+        ## Heap bytes allocated by each run, while track_allocations is set
+        self.allocated = TimingStats(alloc_bin_bytes, alloc_bin_count, "bytes")
+        self.reset()
+        task_stats_list.append(self)
+
+
+    def reset(self):
+        """!
+            Forgets every recorded run
+        """
+        self.latency.reset()
+        self.run_time.reset()
+        self.allocated.reset()
+        ## Number of runs that finished after their deadline
+        self.misses = 0
+        ## Number of runs with a garbage collection inside them
+        self.collections = 0
+        self.__release_us = 0
+        self.__released = False
+
+
+    def record(self, start_us, end_us):
+        """!
+            Records one run of the task
+            @param start_us utime.ticks_us() value when the run started
+            @param end_us utime.ticks_us() value when the run finished
+        """
+        run_us = utime.ticks_diff(end_us, start_us)
+        self.run_time.add(run_us)
+
+        if self.period_us is None:
+            return
+
+        if self.__released:
+            self.__release_us = utime.ticks_add(self.__release_us, self.period_us)
+            latency = utime.ticks_diff(start_us, self.__release_us)
+        else:
+            latency = -1
+        if latency < 0:
+            # Earlier than any release seen so far, so releases are in phase with this run
+            self.__release_us = start_us
+            self.__released = True
+            latency = 0
+
+        self.latency.add(latency)
+        if latency + run_us > self.period_us:
+            self.misses += 1
+
+
+    def record_allocation(self, allocated):
+        """!
+            Records the heap allocated by one run of the task
+            @param allocated Change in gc.mem_alloc() over the run in bytes;
+                a negative change means a garbage collection ran during it
+        """
+        if allocated < 0:
+            self.collections += 1
+        else:
+            self.allocated.add(allocated)
+
+
+    def next_release(self):
+        """!
+            @return utime.ticks_us() value of the next release of the task,
+                or None if the task is not periodic or has not run yet
+        """
+        if self.period_us is None or not self.__released:
+            return None
+        return utime.ticks_add(self.__release_us, self.period_us)
+
+
+    def __repr__(self):
+        text = "{}: period {} us, {} misses\n  latency {}\n  run time {}".format(
+            self.name, self.period_us, self.misses, self.latency, self.run_time)
+        if self.allocated.count or self.collections:
+            text += "\n  allocated {}, {} collections".format(self.allocated, self.collections)
+        return text
+
+
+def show_all():
+    """!
+        @return String describing every TaskStats, one task after another
+    """
+    return "\n".join(str(stats) for stats in task_stats_list)
+
+
+def timed(task_function, stats):
+    """!
+        Wraps a task function so every resume is recorded
+        @param task_function Generator function taking a shares argument, as
+            passed to cotask.Task
+        @param stats TaskStats receiving the start and end time of each resume
+        @return Generator function to pass to cotask.Task in its place
+    """
+    def timed_task(shares=None):
+        generator = task_function(shares) if shares is not None else task_function()
+        while True:
+            if track_allocations:
+                allocated = gc.mem_alloc()
+                start = utime.ticks_us()
+                state = next(generator)
+                end = utime.ticks_us()
+                stats.record_allocation(gc.mem_alloc() - allocated)
+            else:
+                start = utime.ticks_us()
+                state = next(generator)
+                end = utime.ticks_us()
+            stats.record(start, end)
+            yield state
+
+    return timed_task
+
+
+def allocation_report(count=5):
+    """!
+        Lists the tasks that allocated the most heap per run while
+        track_allocations was set
+        @param count Number of tasks to list
+        @return Report as a string, worst offender first
+    """
+    measured = [stats for stats in task_stats_list
+                if stats.allocated.count or stats.collections]
+    if not measured:
+        return "No allocations recorded; set track_allocations to measure them"
+    measured.sort(key=lambda stats: (stats.allocated.maximum, stats.allocated.total()), reverse=True)
+
+    lines = []
+    for stats in measured[:count]:
+        lines.append("{:<28s} max {:>6d} mean {:>8.1f} bytes per run, {} collections".format(
+            stats.name, stats.allocated.maximum, stats.allocated.mean(), stats.collections))
+    return "\n".join(lines)
@@ -0,0 +1,23 @@
+import os
+import sys
+import pytest
+
+# The modules under test are flat files in src/, as they are on the board, and
+# sim/ supplies the host stand-ins for MicroPython modules
+_ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+sys.path.insert(0, os.path.join(_ROOT, "sim"))
+sys.path.insert(0, os.path.join(_ROOT, "src"))
+
+import pyb
+from sim_clock import clock
+
+
+@pytest.fixture(autouse=True)
+def fresh_board():
+    # The simulated clock, timers and pins are module globals shared by every
+    # test, so each test starts from time zero with no hardware set up
+    clock.reset()
+    pyb.reset()
+    yield
+    clock.reset()
+    pyb.reset()
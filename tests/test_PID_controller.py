@@ -0,0 +1,91 @@
+import math
+import pytest
+pytest.importorskip("me405_support")
+import PID_controller
+
+
+@pytest.mark.parametrize("setter", ["set_Kp", "set_Ki", "set_Kd", "set_Kf"])
+@pytest.mark.parametrize("value", [math.inf, -math.inf, math.nan])
+def test_non_finite_gain_is_rejected(setter, value):
+    controller = PID_controller.PIDController(0.03, 1000, Ki=0.0001)
+    gains = controller.get_gains()
+
+    with pytest.raises(ValueError):
+        getattr(controller, setter)(value)
+
+    assert controller.get_gains() == gains
+    assert math.isfinite(controller.run(0))
+
+
+def test_fixed_feedforward_follows_setpoint():
+    controller = PID_controller.PIDController(0, 0, Kf=0.5)
+    controller.set_setpoint(1000)
+
+    assert controller.run_fixed(1000) == 500
+    assert controller.run(1000) == 500
+
+
+def test_fixed_feedforward_operand_is_clamped():
+    # Kf times the setpoint would pass FIXED_LIMIT without the clamp
+    controller = PID_controller.PIDController(0, 0, Kf=1000)
+    controller.set_setpoint(1 << 20)
+
+    assert controller.run_fixed(1 << 20) == PID_controller.FIXED_DEFAULT_LIMIT
+
+
+def test_integral_sums_the_error_each_run():
+    controller = PID_controller.PIDController(0, 10, Ki=0.5)
+
+    assert controller.run(0) == 5
+    assert controller.run(0) == 10
+    assert controller.run(10) == 10
+
+
+def test_integral_is_limited():
+    controller = PID_controller.PIDController(0, 10, Ki=1, i_limit=25)
+    for _ in range(10):
+        output = controller.run(0)
+
+    assert output == 25
+
+
+def test_saturated_output_stops_integral_windup():
+    controller = PID_controller.PIDController(1, 100, Ki=1, out_max=50)
+    for _ in range(20):
+        assert controller.run(0) == 50
+
+    # Without anti-windup the integral of 20 saturated runs would hold the
+    # output at the limit long after the error changes sign
+    assert controller.run(150) < 0
+
+
+def test_setpoint_step_does_not_kick_the_derivative():
+    controller = PID_controller.PIDController(0, 0, Kd=10)
+    controller.run(0)
+    controller.set_setpoint(1000)
+
+    assert controller.run(0) == 0
+    assert controller.run(5) == -50
+
+
+def test_derivative_filter_smooths_a_step():
+    controller = PID_controller.PIDController(0, 0, Kd=1, d_filter=0.5)
+    controller.run(0)
+
+    assert controller.run(-8) == 4
+    assert controller.run(-8) == 2
+
+
+def test_fixed_point_output_follows_floating_point():
+    controller = PID_controller.PIDController(0.5, 1000, Ki=0.25, Kd=2, out_min=-400, out_max=400)
+    fixed = PID_controller.PIDController(0.5, 1000, Ki=0.25, Kd=2, out_min=-400, out_max=400)
+    for position in (0, 100, 300, 600, 850, 950, 1000, 1020, 1010, 1000):
+        assert abs(fixed.run_fixed(position) - controller.run(position)) <= 2
+
+
+def test_reset_clears_the_integral():
+    controller = PID_controller.PIDController(0, 10, Ki=1)
+    controller.run(0)
+    controller.reset()
+
+    assert controller.run(10) == 0
@@ -0,0 +1,130 @@
+import sys
+import pytest
+pytest.importorskip("me405_support")
+from me405_support import cotask, task_share
+sys.modules.setdefault("cotask", cotask)
+sys.modules.setdefault("task_share", task_share)
+import pyb
+import axis
+import main
+from axis_state import STATE, POSITION, POSITION_US, CONTROL_US, SETPOINT, CONTROL
+from sim_clock import clock
+
+
+def make_axis(loop_mode="split"):
+    config = dict(main.AXES[0], loop_mode=loop_mode)
+    config["profile"] = dict(config["profile"], type="trapezoid")
+    return axis.build_axes([config], main.TIMEOUT_MS)[0]
+
+
+def test_start_run_enables_axis():
+    each = make_axis()
+    each.start_run()
+
+    assert each.state.ints[STATE] == 1
+
+
+def test_unplannable_move_changes_nothing():
+    each = make_axis()
+    gains = each.controller.get_gains()
+    each.config["profile"]["max_velocity"] = 1
+
+    with pytest.raises(ValueError):
+        each.prepare_run()
+
+    assert each.state.ints[STATE] == 0
+    assert each.controller.get_gains() == gains
+
+
+def test_prepare_run_leaves_axis_disabled_until_enabled():
+    each = make_axis()
+    each.prepare_run()
+    assert each.state.ints[STATE] == 0
+
+    each.enable()
+    assert each.state.ints[STATE] == 1
+
+
+def test_disabled_axes_are_not_built():
+    axes = axis.build_axes(main.AXES, main.TIMEOUT_MS)
+
+    assert [each.name for each in axes] == ["motor1"]
+
+
+@pytest.mark.parametrize("loop_mode, tasks", [
+    ("split", ["position", "controller", "speed"]),
+    ("fused", ["loop"]),
+    ("cascade", ["inner", "outer"]),
+    ("timer", []),
+])
+def test_each_loop_mode_builds_its_tasks(loop_mode, tasks):
+    each = make_axis(loop_mode)
+
+    assert [task.name for task in each.tasks] == ["motor1_{}_task".format(name) for name in tasks]
+
+
+def test_cascade_control_period_is_the_inner_loop_period():
+    each = make_axis("cascade")
+
+    assert each.control_period_ms == 2
+    assert each.setpoint_period_ms == 10
+
+
+def test_task_cannot_be_made_faster_than_the_table():
+    each = make_axis()
+
+    with pytest.raises(ValueError):
+        each.set_period("controller", 5)
+    with pytest.raises(KeyError):
+        each.set_period("loop", 20)
+
+    each.set_period("controller", 20)
+    assert each.control_period_ms == 20
+
+
+def test_budget_report_sums_measured_task_time():
+    each = make_axis("fused")
+    each.task_stats[0].run_time.add(2500)
+
+    mean, worst = each.cpu_utilization()
+    assert mean == worst == 0.25
+
+    report = axis.budget_report([each]).splitlines()
+    assert "fits 4 axes" in report[0]
+    assert report[-1].startswith("total")
+    assert "25.0 %" in report[-1]
+
+
+def test_split_tasks_pass_values_through_the_state_block():
+    each = make_axis()
+    each.start_run()
+    pyb.timer(4).attach_encoder(lambda: -100)
+    state = each.state
+    tasks = (each.encoder.read_task(state), each.controller.run_task(state),
+             each.motor.set_duty_cycle_task(state))
+    clock.advance(10000)
+    for task in tasks:
+        next(task)
+
+    assert state.ints[POSITION] == 100
+    assert state.ints[POSITION_US] != 0
+    assert state.ints[CONTROL_US] == state.ints[POSITION_US]
+    assert state.ints[SETPOINT] == each.profile.positions[0]
+    # The planned acceleration fed forward, less Kp and Ki times the error
+    assert state.floats[CONTROL] == pytest.approx(each.profile.feedforwards[0] - 3 - 0.01)
+    assert pyb.timer(2).channel(2).compare() == int(state.floats[CONTROL] * each.motor.compare_span) // 100
+
+
+def test_sampler_task_is_added_to_fused_mode():
+    config = dict(main.AXES[0], loop_mode="fused")
+    config["tasks"] = dict(config["tasks"], sampler=(4, 2))
+    each = axis.build_axes([config], main.TIMEOUT_MS)[0]
+
+    assert [task.name for task in each.tasks] == ["motor1_loop_task", "motor1_sampler_task"]
+    assert each.sample_period_ms == 2
+    assert each.control_period_ms == 10
+
+
+def test_unknown_sample_filter_is_rejected():
+    with pytest.raises(ValueError):
+        axis.build_axes([dict(main.AXES[0], sample_filter="median")], main.TIMEOUT_MS)
@@ -0,0 +1,32 @@
+import axis_state
+from axis_state import AxisState, POSITION, POSITION_SUM, SAMPLE_COUNT
+
+
+def test_every_field_has_its_own_word():
+    ints = [axis_state.STATE, axis_state.POSITION, axis_state.VELOCITY, axis_state.SETPOINT,
+            axis_state.POSITION_US, axis_state.CONTROL_US, axis_state.POSITION_SUM,
+            axis_state.SAMPLE_COUNT]
+
+    assert sorted(ints) == list(range(axis_state.INT_COUNT))
+    assert axis_state.CONTROL < axis_state.FLOAT_COUNT
+
+
+def test_new_block_is_all_zero():
+    state = AxisState("motor1")
+
+    assert list(state.ints) == [0] * axis_state.INT_COUNT
+    assert list(state.floats) == [0] * axis_state.FLOAT_COUNT
+    assert state.name == "motor1"
+
+
+def test_mean_position_starts_a_new_window():
+    state = AxisState("motor1")
+    state.ints[POSITION] = 30
+    state.ints[POSITION_SUM] = 10 + 20 + 30
+    state.ints[SAMPLE_COUNT] = 3
+
+    assert axis_state.take_mean_position(state.ints) == 20
+    assert state.ints[POSITION_SUM] == 0
+    assert state.ints[SAMPLE_COUNT] == 0
+    # With no new samples the latest position is used
+    assert axis_state.take_mean_position(state.ints) == 30
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+import numpy
+import bench_host
+import capture
+import telemetry
+from sim_clock import clock
+
+
+class FakeStream:
+    """Stream collecting everything written, like pyb.USB_VCP"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, buffer):
+        self.data += bytes(buffer)
+
+
+class FakePort:
+    """Serial port stand-in which answers chosen lines with chosen bytes"""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.lines = []
+        self.closed = False
+        self.__pending = bytearray()
+        self.__lock = threading.Lock()
+
+    @property
+    def in_waiting(self):
+        with self.__lock:
+            return len(self.__pending)
+
+    def write(self, data):
+        line = data.decode().strip()
+        self.lines.append(line)
+        with self.__lock:
+            self.__pending += self.replies.get(line, b"")
+
+    def read(self, size=1):
+        with self.__lock:
+            chunk = bytes(self.__pending[:size])
+            del self.__pending[:size]
+        if not chunk:
+            time.sleep(0.002)
+        return chunk
+
+    def close(self):
+        self.closed = True
+
+
+def capture_dump(positions):
+    buffer = capture.CaptureBuffer(1000, len(positions))
+    buffer.start()
+    for position in positions:
+        clock.advance(10000)
+        buffer.record_position(position)
+        buffer.record_control(0.5)
+    stream = FakeStream()
+    buffer.dump(stream)
+    return bytes(stream.data)
+
+
+def make_run(board, sent_s, times, positions, controls=None):
+    return dict(board=board, command="0.03", sent_s=sent_s, times=numpy.array(times),
+                positions=numpy.array(positions), controls=controls)
+
+
+def test_runs_merge_in_host_time_order():
+    runs = [make_run("a", 1.0, [50, 60, 70], [0, 1, 2], [0.5, 0.5, 0.5]),
+            None,
+            make_run("b", 1.015, [900, 910], [5, 6])]
+    merged = bench_host.merge_runs(runs, ["a", "b"])
+
+    assert list(merged["host_s"]) == [1.0, 1.01, 1.015, 1.02, 1.025]
+    assert list(merged["board"]) == [0, 0, 1, 0, 1]
+    assert list(merged["run"]) == [0, 0, 2, 0, 2]
+    assert list(merged["time_ms"]) == [50, 60, 900, 70, 910]
+    assert numpy.isnan(merged["control"][merged["board"] == 1]).all()
+
+
+def test_no_runs_merge_to_an_empty_table():
+    merged = bench_host.merge_runs([None], ["a"])
+
+    assert len(merged) == 0
+    assert merged.dtype == bench_host.SAMPLE_DTYPE
+
+
+async def open_boards(ports):
+    boards = [bench_host.Board(name, port, time.monotonic()) for name, port in ports]
+    for board in boards:
+        board.start()
+    return boards
+
+
+def test_every_board_runs_the_test_at_once():
+    ports = [("a", FakePort({"0.03": capture_dump([0, 10, 20])})),
+             ("b", FakePort({"0.03": capture_dump([0, 30])})),
+             ("c", FakePort({}))]
+
+    async def session():
+        boards = await open_boards(ports)
+        try:
+            return await bench_host.run_all(boards, "0.03", wait_s=0.2, idle_s=0.05)
+        finally:
+            await asyncio.gather(*(board.close() for board in boards))
+
+    runs = asyncio.run(session())
+
+    assert [run["board"] for run in runs[:2]] == ["a", "b"]
+    assert list(runs[0]["positions"]) == [0, 10, 20]
+    assert list(runs[1]["positions"]) == [0, 30]
+    assert abs(runs[1]["times"][1] - runs[1]["times"][0] - 10) < 0.1
+    assert runs[2] is None
+    assert all(port.closed for _, port in ports)
+
+
+def test_streamed_run_ends_when_the_board_goes_quiet():
+    stream = FakeStream()
+    writer = telemetry.TelemetryWriter(stream)
+    for index in range(5):
+        writer.write(index * 10000, index * 7, 0.25, 1)
+    writer.flush()
+    port = FakePort({"0.03": b"idle text\r\n" + bytes(stream.data)})
+
+    async def session():
+        boards = await open_boards([("a", port)])
+        try:
+            return await boards[0].run_test("0.03", capture=False, wait_s=2, idle_s=0.05)
+        finally:
+            await boards[0].close()
+
+    run = asyncio.run(session())
+
+    assert list(run["positions"]) == [0, 7, 14, 21, 28]
+    assert list(run["times"]) == [0, 10, 20, 30, 40]
+
+
+def test_bench_sends_settings_before_running_every_command(capsys):
+    port = FakePort({"0.03": capture_dump([0, 10]), "0.05": capture_dump([0, 20])})
+    runs, merged = asyncio.run(bench_host.run_bench(
+        [("a", port)], ["period controller 20"], ["0.03", "0.05"], 20, wait_s=0.5))
+
+    assert port.lines == ["period controller 20", "0.03", "0.05"]
+    assert [run["command"] for run in runs] == ["0.03", "0.05"]
+    assert list(merged["host_s"]) == sorted(merged["host_s"])
+    assert list(merged["position"][merged["run"] == 0]) == [0, 10]
+    assert list(merged["position"][merged["run"] == 1]) == [0, 20]
+    assert "rise ms" in capsys.readouterr().out
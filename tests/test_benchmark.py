@@ -0,0 +1,53 @@
+import sys
+import pytest
+import benchmark
+
+
+def test_slower_path_is_a_regression(capsys):
+    baseline = {"Encoder.read": 10.0, "PIDController.run": 20.0}
+    results = {"Encoder.read": 13.0, "PIDController.run": 21.0}
+
+    assert benchmark.compare_results(results, baseline) == ["Encoder.read"]
+    assert "Encoder.read: 13.00 us, expected 10.00 us (+30 %) REGRESSION" in capsys.readouterr().out
+
+
+def test_baseline_is_scaled_by_the_reference_workload():
+    baseline = {benchmark.REFERENCE: 100.0, "Encoder.read": 10.0}
+    results = {benchmark.REFERENCE: 150.0, "Encoder.read": 14.0}
+
+    # The whole machine is half as fast again, so 14 us is within 15 us
+    assert benchmark.compare_results(results, baseline) == []
+
+
+def test_slowdown_below_the_floor_is_not_a_regression():
+    assert benchmark.compare_results({"AxisState field read": 0.15},
+                                     {"AxisState field read": 0.1}) == []
+
+
+def test_paths_missing_from_the_baseline_are_skipped():
+    assert benchmark.compare_results({"new path": 5.0}, {}) == []
+
+
+def test_results_round_trip_through_a_file(tmp_path):
+    path = str(tmp_path / "bench.json")
+    benchmark.save_results({"Encoder.read": 1.5}, path)
+
+    assert benchmark.load_results(path) == {"Encoder.read": 1.5}
+
+
+def test_time_call_subtracts_the_loop_overhead():
+    assert benchmark.time_call(benchmark._empty, None, 100) >= 0
+    assert benchmark.time_sequence(sum, [[1, 2], [3]], 100) >= 0
+
+
+def test_every_hot_path_is_measured(capsys):
+    pytest.importorskip("me405_support")
+    from me405_support import cotask, task_share
+    sys.modules.setdefault("cotask", cotask)
+    sys.modules.setdefault("task_share", task_share)
+    results = benchmark.bench_all(iterations=10, repeats=1)
+
+    for name in (benchmark.REFERENCE, "Encoder.read", "PIDController.run_fixed",
+                 "MotorDriver.set_duty_cycle unchanged", "ControlLoop.update_fixed",
+                 "timed(Encoder.read_task) resume"):
+        assert results[name] >= 0
@@ -0,0 +1,70 @@
+import capture
+import display
+from sim_clock import clock
+
+
+class FakeStream:
+    """Stream collecting everything written, like pyb.USB_VCP"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, buffer):
+        self.data += bytes(buffer)
+
+
+def record_run(samples, period_us=10000):
+    buffer = capture.CaptureBuffer(1000, 10)
+    buffer.start()
+    for position, control in samples:
+        clock.advance(period_us)
+        buffer.record_position(position)
+        buffer.record_control(control)
+    return buffer
+
+
+def test_dump_decodes_to_the_recorded_samples():
+    buffer = record_run([(0, 1.5), (40, 0.75), (55, -0.25)])
+    stream = FakeStream()
+    buffer.dump(stream)
+
+    times, positions, controls = display.decode_capture(bytes(stream.data))
+    assert list(positions) == [0, 40, 55]
+    assert list(controls) == [1.5, 0.75, -0.25]
+    assert list(times) == sorted(times)
+    assert times[1] - times[0] >= 10000
+
+
+def test_control_is_held_until_the_controller_runs():
+    buffer = capture.CaptureBuffer(1000, 10)
+    buffer.start()
+    buffer.record_position(1)
+    buffer.record_control(2.0)
+    buffer.record_position(3)
+
+    assert buffer.controls[1] == 2.0
+
+
+def test_samples_past_the_end_are_dropped():
+    buffer = capture.CaptureBuffer(20, 10)
+    for position in range(buffer.size + 3):
+        buffer.record_position(position)
+
+    assert buffer.count() == buffer.size
+    assert buffer.positions[buffer.size - 1] == buffer.size - 1
+
+
+def test_text_before_the_dump_is_skipped():
+    stream = FakeStream()
+    stream.data += b"beat\r\n" + bytes((capture.CAPTURE_SYNC,))
+    record_run([(7, 0.5)]).dump(stream)
+
+    _, positions, _ = display.decode_capture(bytes(stream.data))
+    assert list(positions) == [7]
+
+
+def test_incomplete_dump_is_not_decoded():
+    stream = FakeStream()
+    record_run([(7, 0.5), (8, 0.5)]).dump(stream)
+
+    assert display.decode_capture(bytes(stream.data[:-1])) is None
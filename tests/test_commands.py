@@ -0,0 +1,95 @@
+import commands
+import display
+
+
+class FakeStream:
+    """Serial stream holding bytes written by a host, read like pyb.USB_VCP"""
+
+    def __init__(self, data=b""):
+        self.data = bytearray(data)
+
+    def any(self):
+        return len(self.data)
+
+    def readinto(self, buffer):
+        count = min(len(buffer), len(self.data))
+        buffer[:count] = self.data[:count]
+        del self.data[:count]
+        return count
+
+
+def test_gui_command_reaches_line_reader():
+    # The GUI text box holds no newline; the board only acts on whole lines
+    stream = FakeStream(display.command_bytes("0.03,0.0001,0"))
+    reader = commands.LineReader(stream)
+
+    assert reader.poll() == "0.03,0.0001,0"
+    assert reader.poll() is None
+
+
+def test_command_bytes_keeps_existing_newline():
+    assert display.command_bytes("stats\n") == b"stats\n"
+
+
+def test_line_without_newline_is_held():
+    stream = FakeStream(b"0.03")
+    reader = commands.LineReader(stream)
+
+    assert reader.poll() is None
+    stream.data.extend(b"\n")
+    assert reader.poll() == "0.03"
+
+
+def test_arithmetic_error_is_reported(capsys):
+    dispatcher = commands.CommandDispatcher()
+    dispatcher.add("setpoint", lambda words: int(float(words[0])))
+
+    assert dispatcher.dispatch("setpoint inf") is False
+    assert "error" in capsys.readouterr().out
+
+
+def test_usage_lists_default_command_first():
+    dispatcher = commands.CommandDispatcher(lambda words: None, "Kp[,Ki[,Kd]] - run")
+    dispatcher.add("kp", lambda words: None, "GAIN")
+
+    assert dispatcher.usage().splitlines() == ["Kp[,Ki[,Kd]] - run", "kp GAIN"]
+
+
+def test_lines_arriving_together_are_returned_one_per_poll():
+    reader = commands.LineReader(FakeStream(b"kp 0.1\r\nstats\n"))
+
+    assert reader.poll() == "kp 0.1"
+    assert reader.poll() == "stats"
+    assert reader.poll() is None
+
+
+def test_overlong_line_is_dropped_up_to_its_newline():
+    reader = commands.LineReader(FakeStream(b"x" * 20 + b"\nstats\n"), size=8)
+
+    assert [reader.poll() for _ in range(5)] == [None, None, None, "stats", None]
+    assert reader.overflows == 1
+
+
+def test_command_words_split_on_commas_and_ignore_case():
+    received = []
+    dispatcher = commands.CommandDispatcher()
+    dispatcher.add("kp", received.append)
+
+    assert dispatcher.dispatch("KP 0.1,2") is True
+    assert received == [["0.1", "2"]]
+
+
+def test_other_lines_go_to_the_default_command():
+    received = []
+    dispatcher = commands.CommandDispatcher(received.append)
+
+    assert dispatcher.dispatch("0.03,0.0001") is True
+    assert received == [["0.03", "0.0001"]]
+
+
+def test_unknown_command_is_reported(capsys):
+    dispatcher = commands.CommandDispatcher()
+
+    assert dispatcher.dispatch("bogus 1") is False
+    assert dispatcher.dispatch("   ") is False
+    assert "error: bogus 1" in capsys.readouterr().out
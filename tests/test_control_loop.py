@@ -0,0 +1,200 @@
+import control_loop
+from axis_state import AxisState, STATE, POSITION, SETPOINT, CONTROL, POSITION_SUM, SAMPLE_COUNT
+from sim_clock import clock
+
+
+class FakeEncoder:
+    """Encoder reporting a set position and velocity"""
+
+    def __init__(self, position=0, velocity=0):
+        self.position = position
+        self.velocity = velocity
+        self.reads = 0
+
+    def read(self):
+        self.reads += 1
+        return self.position
+
+    def get_position(self):
+        return self.position
+
+    def get_velocity(self):
+        return self.velocity
+
+    def publish(self, ints):
+        ints[POSITION] = self.position
+
+
+class FakeController:
+    """Proportional controller recording what it was run on"""
+
+    def __init__(self, Kp=2, setpoint=0, compute_us=0):
+        self.Kp = Kp
+        self.setpoint = setpoint
+        self.compute_us = compute_us
+        self.inputs = []
+
+    def run(self, value):
+        self.inputs.append(value)
+        clock.advance(self.compute_us)
+        return self.Kp * (self.setpoint - value)
+
+    def run_fixed(self, value):
+        return int(self.run(value))
+
+    def set_setpoint(self, setpoint):
+        self.setpoint = setpoint
+
+    def get_setpoint(self):
+        return self.setpoint
+
+
+class FakeMotor:
+    """Motor recording every duty cycle applied"""
+
+    def __init__(self):
+        self.duties = []
+
+    def set_duty_cycle(self, level):
+        self.duties.append(level)
+
+
+def test_update_applies_the_output_of_the_position_just_read():
+    encoder = FakeEncoder(position=30)
+    controller = FakeController(setpoint=100)
+    motor = FakeMotor()
+    loop = control_loop.ControlLoop(encoder, controller, motor)
+
+    assert loop.update() == 140
+    assert encoder.reads == 1
+    assert controller.inputs == [30]
+    assert motor.duties == [140]
+
+
+def test_probe_measures_from_sample_to_actuation():
+    controller = FakeController(compute_us=200)
+    loop = control_loop.ControlLoop(FakeEncoder(), controller, FakeMotor())
+    probe = control_loop.LatencyProbe()
+    loop.set_probe(probe)
+    loop.update()
+
+    assert probe.stats.count == 1
+    assert probe.stats.maximum == 200 + clock.poll_cost_us
+
+
+def test_probe_ignores_actuation_before_any_output():
+    probe = control_loop.LatencyProbe()
+    probe.sensed()
+    probe.actuated()
+
+    assert probe.stats.count == 0
+
+
+def test_split_probe_measures_from_the_sample_the_output_used():
+    probe = control_loop.LatencyProbe()
+    probe.sensed()
+    probe.computed()
+    clock.advance(10000)
+    # A newer sample that no output has been computed from yet
+    probe.sensed()
+    probe.actuated()
+
+    assert probe.stats.maximum >= 10000
+
+
+def test_run_task_publishes_only_while_enabled():
+    state = AxisState("test")
+    loop = control_loop.ControlLoop(FakeEncoder(position=5), FakeController(setpoint=9),
+                                    FakeMotor())
+    task = loop.run_task(state)
+    next(task)
+    assert state.ints[POSITION] == 0
+
+    state.ints[STATE] = 1
+    next(task)
+    assert state.ints[POSITION] == 5
+    assert state.ints[SETPOINT] == 9
+    assert state.floats[CONTROL] == 8
+
+
+def test_timer_runs_fixed_updates_at_its_rate_while_enabled():
+    state = AxisState("test")
+    motor = FakeMotor()
+    loop = control_loop.ControlLoop(FakeEncoder(position=5), FakeController(setpoint=9), motor)
+    loop.start_timer(6, 1000, state)
+    clock.advance(5500)
+    assert motor.duties == []
+
+    state.ints[STATE] = 1
+    clock.advance(5000)
+    assert motor.duties == [8] * 5
+    assert state.ints[POSITION] == 5
+    assert loop.isr_time.count == 5
+    assert loop.jitter.count == 9
+    assert loop.jitter.maximum < 50
+
+
+def test_stopped_timer_runs_no_more_updates():
+    state = AxisState("test")
+    state.ints[STATE] = 1
+    motor = FakeMotor()
+    loop = control_loop.ControlLoop(FakeEncoder(), FakeController(), motor)
+    loop.start_timer(6, 1000, state)
+    clock.advance(2500)
+    loop.stop_timer()
+    clock.advance(5000)
+
+    assert len(motor.duties) == 2
+
+
+def test_cascade_outer_loop_sets_the_inner_velocity_setpoint():
+    encoder = FakeEncoder(position=100, velocity=50)
+    position_controller = FakeController(Kp=10, setpoint=400)
+    velocity_controller = FakeController(Kp=0.5)
+    motor = FakeMotor()
+    loop = control_loop.ControlLoop(encoder, velocity_controller, motor, position_controller)
+
+    assert loop.outer_update() == 3000
+    assert velocity_controller.setpoint == 3000
+
+    loop.update()
+    assert velocity_controller.inputs == [50]
+    assert motor.duties == [1475]
+
+
+def test_cascade_publishes_the_position_setpoint():
+    state = AxisState("test")
+    state.ints[STATE] = 1
+    loop = control_loop.ControlLoop(FakeEncoder(), FakeController(setpoint=7),
+                                    FakeMotor(), FakeController(setpoint=400))
+    next(loop.run_task(state))
+
+    assert state.ints[SETPOINT] == 400
+
+
+def test_outer_loop_acts_on_the_mean_of_the_samples():
+    state = AxisState("test")
+    state.ints[POSITION_SUM] = 10 + 20 + 30
+    state.ints[SAMPLE_COUNT] = 3
+    position_controller = FakeController(Kp=1, setpoint=100)
+    loop = control_loop.ControlLoop(FakeEncoder(position=30), FakeController(),
+                                    FakeMotor(), position_controller)
+    loop.set_sampler(state)
+    loop.outer_update()
+
+    assert position_controller.inputs == [20]
+    assert state.ints[SAMPLE_COUNT] == 0
+
+
+def test_fused_loop_acts_on_the_mean_of_the_samples():
+    state = AxisState("test")
+    state.ints[POSITION_SUM] = 4 + 6
+    state.ints[SAMPLE_COUNT] = 2
+    encoder = FakeEncoder(position=6)
+    controller = FakeController()
+    loop = control_loop.ControlLoop(encoder, controller, FakeMotor())
+    loop.set_sampler(state)
+    loop.update()
+
+    assert controller.inputs == [5]
+    assert encoder.reads == 0
@@ -0,0 +1,78 @@
+import display
+import telemetry
+
+
+class FakePort:
+    """Serial port returning prepared chunks, then failing like a closed port"""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.in_waiting = 0
+
+    def read(self, size):
+        if not self.chunks:
+            raise OSError("port closed")
+        return self.chunks.pop(0)
+
+
+class FakeStream:
+    """Stream collecting everything written, like pyb.USB_VCP"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, buffer):
+        self.data += bytes(buffer)
+
+
+def read_all(chunks, binary, capacity=10):
+    buffer = display.RingBuffer(capacity)
+    reader = display.SerialReader(FakePort(chunks), buffer, binary)
+    reader.start()
+    reader.join(5)
+    assert not reader.is_alive()
+    return buffer
+
+
+def test_ring_buffer_keeps_rows_in_order_until_full():
+    buffer = display.RingBuffer(4)
+    buffer.extend([[0, 10], [1, 11]])
+    buffer.extend([[2, 12]])
+
+    assert buffer.latest().tolist() == [[0, 10], [1, 11], [2, 12]]
+    assert buffer.total() == 3
+
+
+def test_ring_buffer_overwrites_oldest_rows():
+    buffer = display.RingBuffer(4)
+    buffer.extend([[time, 0] for time in range(3)])
+    buffer.extend([[time, 0] for time in range(3, 10)])
+
+    assert buffer.latest()[:, 0].tolist() == [6, 7, 8, 9]
+    assert buffer.total() == 10
+
+
+def test_ring_buffer_clear_forgets_rows():
+    buffer = display.RingBuffer(4)
+    buffer.extend([[0, 1]])
+    buffer.clear()
+
+    assert len(buffer.latest()) == 0
+
+
+def test_reader_decodes_frames_split_across_reads():
+    stream = FakeStream()
+    writer = telemetry.TelemetryWriter(stream)
+    writer.write(2000, 10, 0.0, 1)
+    writer.write(4000, 20, 0.0, 1)
+    writer.flush()
+    data = bytes(stream.data)
+
+    buffer = read_all([data[:7], data[7:20], b"", data[20:]], binary=True)
+    assert buffer.latest().tolist() == [[2, 10], [4, 20]]
+
+
+def test_reader_decodes_text_lines_split_across_reads():
+    buffer = read_all([b"10,5\r\n20,", b"7\r\nbeat\r\n"], binary=False)
+
+    assert buffer.latest().tolist() == [[10, 5], [20, 7]]
@@ -0,0 +1,182 @@
+import pyb
+import pytest
+pytest.importorskip("me405_support")
+import encoder_reader
+from axis_state import AxisState, STATE, POSITION, VELOCITY, POSITION_SUM, SAMPLE_COUNT, MAX_SAMPLES
+from sim_clock import clock
+
+
+def make_encoder(source, **kwargs):
+    encoder = encoder_reader.Encoder(pyb.Pin.board.PB6, pyb.Pin.board.PB7, 4, pyb.Pin.AF2_TIM4,
+                                     **kwargs)
+    pyb.timer(4).attach_encoder(source)
+    encoder.zero()
+    return encoder
+
+
+def moving_at(counts_per_s):
+    # Raw encoder count of a shaft turning at a constant speed; the timer
+    # counts down for positive positions
+    return lambda: -(clock.now_us * counts_per_s // 1000000)
+
+
+def read_every(encoder, period_us, reads):
+    for _ in range(reads):
+        clock.advance(period_us)
+        encoder.read()
+
+
+@pytest.mark.parametrize("counts, time_us", [
+    (30, 1000), (-30, 1000), (1, 7), (123457, 999983), (0, 10),
+])
+def test_rate_matches_exact_division(counts, time_us):
+    exact = abs(counts) * 1000000 // time_us
+    assert encoder_reader._rate(counts, time_us) == (exact if counts >= 0 else -exact)
+
+
+def test_rate_is_limited():
+    assert encoder_reader._rate(1 << 29, 1) == encoder_reader.VELOCITY_LIMIT
+
+
+def test_unfiltered_velocity_follows_the_speed():
+    encoder = make_encoder(moving_at(30000), velocity_tau_us=0, low_speed=False)
+    read_every(encoder, 1000, 10)
+
+    assert encoder.get_velocity() == pytest.approx(30000, rel=0.01)
+
+
+def test_filtered_velocity_converges_to_the_speed():
+    encoder = make_encoder(moving_at(-20000), velocity_tau_us=5000)
+    read_every(encoder, 1000, 5)
+    assert -20000 < encoder.get_velocity() < -5000
+
+    read_every(encoder, 1000, 60)
+    assert encoder.get_velocity() == pytest.approx(-20000, rel=0.01)
+
+
+def test_low_speed_velocity_is_measured_between_count_changes():
+    # Under one count per read, so reads alone would see 0 or 1000 counts per second
+    encoder = make_encoder(moving_at(250), velocity_tau_us=0)
+    read_every(encoder, 1000, 40)
+
+    assert encoder.get_velocity() == pytest.approx(250, rel=0.05)
+
+
+def test_stopped_motor_reads_zero_velocity():
+    encoder = make_encoder(moving_at(300), velocity_tau_us=0)
+    read_every(encoder, 1000, 40)
+    raw = pyb.timer(4).counter()
+    pyb.timer(4).attach_encoder(lambda: raw)
+    read_every(encoder, 1000, encoder_reader.VELOCITY_MAX_WINDOW_US // 1000 + 1)
+
+    assert encoder.get_velocity() == 0
+
+
+def test_publish_copies_the_latest_read():
+    encoder = make_encoder(moving_at(10000), velocity_tau_us=0, low_speed=False)
+    read_every(encoder, 1000, 3)
+    state = AxisState("test")
+    encoder.publish(state.ints)
+
+    assert state.ints[POSITION] == encoder.get_position() == 30
+    assert state.ints[VELOCITY] == encoder.get_velocity()
+
+
+def test_position_stays_exact_through_many_counter_wraps():
+    raw = [0]
+    encoder = make_encoder(lambda: raw[0])
+    for _ in range(20):
+        # Just under half the 16 bit range per read, backwards then forwards
+        raw[0] -= 30000
+        clock.advance(100000)
+        encoder.read()
+    assert encoder.get_position() == 20 * 30000
+
+    for _ in range(25):
+        raw[0] += 30000
+        clock.advance(100000)
+        encoder.read()
+    assert encoder.get_position() == -5 * 30000
+
+
+def test_short_range_counter_wraps_at_its_reload_value():
+    raw = [0]
+    encoder = make_encoder(lambda: raw[0], full_range=False)
+    for _ in range(7):
+        raw[0] -= 4000
+        clock.advance(100000)
+        encoder.read()
+
+    assert encoder.get_position() == 28000
+    assert pyb.timer(4).counter() < encoder_reader._AUTO_RELOAD_VALUE
+
+
+def test_change_near_half_the_range_is_suspect_until_zeroed():
+    raw = [0]
+    encoder = make_encoder(lambda: raw[0])
+    raw[0] = -1000
+    clock.advance(100000)
+    encoder.read()
+    assert not encoder.wrap_suspect
+
+    raw[0] -= 30000
+    clock.advance(100000)
+    encoder.read()
+    assert encoder.wrap_suspect
+
+    encoder.zero()
+    assert not encoder.wrap_suspect
+
+
+def test_speed_predicting_a_missed_wrap_is_suspect():
+    encoder = make_encoder(moving_at(1000000), velocity_tau_us=0, low_speed=False)
+    read_every(encoder, 1000, 3)
+    assert not encoder.wrap_suspect
+
+    # A read 65 ms late sees nearly a whole turn of the counter as a small
+    # step backwards, so only the speed shows that a wrap was missed
+    read_every(encoder, 65000, 1)
+    assert encoder.wrap_suspect
+
+
+def test_max_safe_speed_is_half_the_range_per_read():
+    encoder = make_encoder(lambda: 0)
+
+    assert encoder.max_safe_speed(1000) == 32767 * 1000
+
+
+def test_read_task_sums_samples_for_the_controller():
+    encoder = make_encoder(moving_at(10000), velocity_tau_us=0)
+    encoder.set_averaging(True)
+    state = AxisState("test")
+    state.ints[STATE] = 1
+    task = encoder.read_task(state)
+    for _ in range(3):
+        clock.advance(1000)
+        next(task)
+
+    assert state.ints[SAMPLE_COUNT] == 3
+    assert state.ints[POSITION_SUM] == 10 + 20 + 30
+    assert state.ints[POSITION] == 30
+
+
+def test_unread_window_restarts_when_full():
+    encoder = make_encoder(lambda: 0)
+    encoder.set_averaging(True)
+    state = AxisState("test")
+    state.ints[STATE] = 1
+    task = encoder.read_task(state)
+    for _ in range(MAX_SAMPLES + 1):
+        next(task)
+
+    assert state.ints[SAMPLE_COUNT] == 1
+
+
+def test_read_task_without_averaging_leaves_only_the_latest_sample():
+    encoder = make_encoder(moving_at(10000))
+    encoder.set_averaging(False)
+    state = AxisState("test")
+    state.ints[STATE] = 1
+    next(encoder.read_task(state))
+
+    assert state.ints[SAMPLE_COUNT] == 0
@@ -0,0 +1,41 @@
+import numpy
+import gain_sweep
+
+
+def test_gain_grid_has_every_combination():
+    grid = gain_sweep.gain_grid([1, 2], [0, 0.5])
+
+    assert grid.tolist() == [[1, 0, 0], [1, 0.5, 0], [2, 0, 0], [2, 0.5, 0]]
+
+
+def test_failed_runs_score_as_nan():
+    times = numpy.arange(0, 101, 10.0)
+    run = (times, numpy.minimum(times * 20, 1000), None)
+    grid, positions, metrics = gain_sweep.score_runs([run, None], 1000)
+
+    assert grid[-1] == 100
+    assert positions.shape == (2, len(grid))
+    assert metrics["overshoot_pct"][0] == 0
+    assert numpy.isnan(positions[1]).all()
+    assert all(numpy.isnan(values[1]) for values in metrics.values())
+
+
+def test_short_runs_hold_their_last_position():
+    short = (numpy.array([0, 50.0]), numpy.array([0, 1000.0]), None)
+    long = (numpy.array([0, 100.0]), numpy.array([0, 1000.0]), None)
+    grid, positions, _ = gain_sweep.score_runs([short, long], 1000)
+
+    assert positions[0, -1] == 1000
+
+
+def test_cheapest_period_is_the_slowest_that_meets_the_limits():
+    result = {
+        "period_ms": numpy.array([10, 10, 20, 20, 40]),
+        "overshoot_pct": numpy.array([1, 0, 2, 3, 20]),
+        "settling_ms": numpy.array([500, 600, 700, 650, 900]),
+        "iae": numpy.array([0.1, 0.2, 0.3, 0.25, 0.5]),
+    }
+
+    assert gain_sweep.cheapest_period(result, 5, 800) == 3
+    assert gain_sweep.cheapest_period(result, 0.5, 800) == 1
+    assert gain_sweep.cheapest_period(result, 0, 100) is None
@@ -0,0 +1,128 @@
+import idle_gc
+from sim_clock import clock
+
+
+class FakeStats:
+    """Task statistics with only the parts IdleCollector reads"""
+
+    def __init__(self, period_us, release_us=None):
+        self.period_us = period_us
+        self.release_us = release_us
+
+    def next_release(self):
+        return self.release_us
+
+
+class FakeGc:
+    """Heap with a set amount free, whose collections take a fixed time"""
+
+    def __init__(self, free, pause_us=2000):
+        self.free = free
+        self.pause_us = pause_us
+        self.collections = 0
+
+    def mem_free(self):
+        return self.free
+
+    def collect(self):
+        clock.advance(self.pause_us)
+        self.collections += 1
+
+
+def test_guard_follows_shortest_period_before_any_pause():
+    collector = idle_gc.IdleCollector([FakeStats(10000), FakeStats(None), FakeStats(2000)])
+
+    assert collector.shortest_period_us() == 2000
+    assert collector.guard() == 2000 // idle_gc.GUARD_DIVISOR
+
+
+def test_guard_follows_longest_pause():
+    collector = idle_gc.IdleCollector([FakeStats(10000)])
+    collector.pause.add(2000)
+    collector.pause.add(3000)
+
+    assert collector.guard() == 3000 // idle_gc.GUARD_DIVISOR
+
+
+def test_given_guard_is_kept():
+    collector = idle_gc.IdleCollector([FakeStats(10000)], guard_us=123)
+
+    assert collector.guard() == 123
+
+
+def test_no_warning_without_deferrals():
+    collector = idle_gc.IdleCollector([FakeStats(1000)])
+
+    assert collector.warning() is None
+
+
+def test_warning_when_no_idle_collection_ran():
+    collector = idle_gc.IdleCollector([FakeStats(10000)])
+    collector.deferrals = 3
+
+    assert "0 idle garbage collections" in collector.warning()
+
+
+def test_warning_when_period_is_shorter_than_a_pause():
+    collector = idle_gc.IdleCollector([FakeStats(1000)])
+    collector.pause.add(2000)
+    collector.deferrals = 1
+
+    assert collector.warning() is not None
+
+
+def test_no_warning_when_idle_collections_fit():
+    collector = idle_gc.IdleCollector([FakeStats(10000)])
+    collector.pause.add(2000)
+    collector.deferrals = 1
+
+    assert collector.warning() is None
+
+
+def test_no_collection_while_the_reserve_is_free(monkeypatch):
+    heap = FakeGc(idle_gc.RESERVE_BYTES)
+    monkeypatch.setattr(idle_gc, "gc", heap)
+    collector = idle_gc.IdleCollector([FakeStats(10000, 10000)])
+
+    assert not collector.poll()
+    assert heap.collections == 0
+
+
+def test_low_memory_is_collected_in_a_long_gap(monkeypatch):
+    heap = FakeGc(100)
+    monkeypatch.setattr(idle_gc, "gc", heap)
+    collector = idle_gc.IdleCollector([FakeStats(10000, 10000)])
+
+    assert collector.poll()
+    assert heap.collections == 1
+    assert collector.pause.maximum >= 2000
+
+
+def test_collection_waits_for_a_gap_longer_than_a_pause(monkeypatch):
+    heap = FakeGc(100)
+    monkeypatch.setattr(idle_gc, "gc", heap)
+    stats = FakeStats(10000, 1000)
+    collector = idle_gc.IdleCollector([stats])
+    collector.pause.add(2000)
+
+    assert not collector.poll()
+    assert not collector.poll()
+    assert collector.deferrals == 1
+
+    stats.release_us = clock.now_us + 5000
+    assert collector.poll()
+    assert heap.collections == 1
+
+
+def test_no_slack_while_a_task_is_due():
+    clock.advance(500)
+    collector = idle_gc.IdleCollector([FakeStats(10000, 400), FakeStats(10000, 9000)])
+
+    assert collector.slack_us() is None
+
+
+def test_slack_is_the_time_to_the_next_release():
+    collector = idle_gc.IdleCollector([FakeStats(10000, 9000), FakeStats(2000, 3000),
+                                       FakeStats(None)])
+
+    assert 2900 < collector.slack_us() <= 3000
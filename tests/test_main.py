@@ -0,0 +1,76 @@
+import sys
+import pytest
+pytest.importorskip("me405_support")
+from me405_support import cotask, task_share
+sys.modules.setdefault("cotask", cotask)
+sys.modules.setdefault("task_share", task_share)
+import idle_gc
+import main
+import run_sim
+import sim_gc
+import timing_stats
+
+
+class FakeShare:
+    """Task state share holding a fixed value"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+@pytest.mark.parametrize("mode", main.BINARY_TELEMETRY_MODES)
+def test_heartbeat_is_quiet_on_binary_link(mode, monkeypatch, capsys):
+    monkeypatch.setattr(main, "telemetry_mode", mode, raising=False)
+    beat = main.heartbeat(FakeShare(1))
+    next(beat)
+
+    assert capsys.readouterr().out == ""
+
+
+def test_heartbeat_prints_in_text_mode(monkeypatch, capsys):
+    monkeypatch.setattr(main, "telemetry_mode", "text", raising=False)
+    beat = main.heartbeat(FakeShare(1))
+    next(beat)
+
+    assert capsys.readouterr().out == "beat\n"
+
+
+def simulate(monkeypatch, commands, duration_s=0.3, trace_heap=False, **overrides):
+    # Runs main.py in the simulator, sending each (time in ms, line) command.
+    # The simulator swaps in its own gc module, which modules imported by
+    # earlier tests have to see too, and which must not outlive the test.
+    # Every run starts with no task statistics, as it would after a reset.
+    monkeypatch.setitem(sys.modules, "gc", sim_gc)
+    for module in (idle_gc, timing_stats):
+        monkeypatch.setattr(module, "gc", sim_gc)
+    monkeypatch.setattr(timing_stats, "task_stats_list", [])
+    output, program, _, _ = run_sim.simulate(commands=commands, duration_s=duration_s,
+                                             overrides=overrides, trace_heap=trace_heap)
+    return output.decode(errors="replace"), program
+
+
+def test_run_gains_go_to_the_velocity_loop_in_cascade_mode(monkeypatch):
+    _, program = simulate(monkeypatch, [(100, "0.01,0.002\n")], LOOP_MODE="cascade")
+    each = program["axes"][0]
+
+    assert each.velocity_controller.get_gains()[:2] == (0.01, 0.002)
+    assert each.controller.get_gains() == (10, 0, 0, 0)
+
+
+def test_setpoint_outside_32_bits_is_rejected(monkeypatch):
+    output, program = simulate(monkeypatch, [(100, "setpoint 5000\n"), (150, "setpoint 3e9\n")])
+
+    assert "error: setpoint 3e9" in output
+    assert program["AXES"][0]["target"] == 5000
+
+
+
+def test_garbage_is_collected_in_idle_time(monkeypatch):
+    _, program = simulate(monkeypatch, [(100, "0.03\n")], duration_s=1.5, trace_heap=True)
+    collector = program["collector"]
+
+    assert collector.pause.count > 0
+    assert collector.warning() is None
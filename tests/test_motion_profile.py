@@ -0,0 +1,114 @@
+import pytest
+import motion_profile
+
+
+class FakeController:
+    """Controller recording the setpoint and feed-forward it is given"""
+
+    def __init__(self):
+        self.setpoint = None
+        self.feedforward = None
+
+    def set_setpoint(self, setpoint):
+        self.setpoint = setpoint
+
+    def set_feedforward(self, feedforward):
+        self.feedforward = feedforward
+
+
+def planned(profile_type="trapezoid", start=0, end=16384, **kwargs):
+    profile = motion_profile.MotionProfile(500)
+    count = profile.plan(start, end, 10, 30000, 400000, profile_type, **kwargs)
+    return profile, list(profile.positions[:count])
+
+
+def differences(values):
+    return [after - before for before, after in zip(values, values[1:])]
+
+
+def test_trapezoid_respects_speed_and_acceleration_limits():
+    _, positions = planned()
+    steps = differences(positions)
+    changes = differences(steps)
+
+    assert positions[0] == 0 and positions[-1] == 16384
+    assert min(steps) >= 0
+    # 30000 ticks/s is 300 ticks per 10 ms tick, and 400000 ticks/s^2 is 40
+    # ticks per tick per tick, within rounding
+    assert max(steps) == pytest.approx(300, abs=1)
+    assert max(abs(change) for change in changes) <= 41
+
+
+def test_trapezoid_takes_the_planned_time():
+    # 75 ms to reach speed, and the same to stop, with the rest at 30000 ticks/s
+    profile, positions = planned()
+    total_s = 2 * 0.075 + (16384 - 30000 * 0.075) / 30000
+
+    assert len(positions) == pytest.approx(total_s / 0.01 + 1, abs=1)
+
+
+def test_short_move_never_reaches_full_speed():
+    _, positions = planned(end=1000)
+
+    assert max(differences(positions)) < 250
+    assert positions[-1] == 1000
+
+
+def test_reverse_move_mirrors_forward_move():
+    _, forward = planned(start=100, end=5100)
+    _, reverse = planned(start=100, end=-4900)
+
+    assert [100 - position for position in reverse] == [position - 100 for position in forward]
+
+
+def test_s_curve_limits_jerk_and_takes_one_jerk_time_longer():
+    _, trapezoid = planned()
+    _, s_curve = planned("s_curve", max_jerk=8000000)
+
+    # A jerk time of 400000 / 8000000 s is five ticks, averaged over five
+    # samples, which spreads the move over four more ticks
+    assert len(s_curve) == len(trapezoid) + 4
+    assert s_curve[-1] == 16384
+    trapezoid_jerk = max(abs(value) for value in differences(differences(differences(trapezoid))))
+    s_curve_jerk = max(abs(value) for value in differences(differences(differences(s_curve))))
+    assert s_curve_jerk <= 10 < trapezoid_jerk
+
+
+def test_feedforward_follows_planned_velocity():
+    profile, positions = planned(start=0, end=-16384, velocity_gain=0.001)
+
+    assert profile.feedforwards[len(positions) // 2] == -30
+    assert profile.feedforwards[0] == 0
+
+
+def test_playback_holds_the_last_sample():
+    profile, positions = planned(end=1000)
+    controller = FakeController()
+    for _ in range(len(positions) + 5):
+        profile.apply(controller)
+
+    assert profile.done()
+    assert controller.setpoint == 1000
+    assert controller.feedforward == 0
+
+
+def test_hold_replaces_the_move():
+    profile, _ = planned()
+    controller = FakeController()
+    profile.hold(42)
+    profile.apply(controller)
+
+    assert profile.done()
+    assert controller.setpoint == 42
+
+
+def test_move_longer_than_the_table_is_rejected():
+    profile = motion_profile.MotionProfile(10)
+
+    with pytest.raises(ValueError):
+        profile.plan(0, 16384, 10, 30000, 400000)
+
+
+def test_unknown_profile_type_is_rejected():
+    with pytest.raises(ValueError):
+        planned("sine")
@@ -0,0 +1,75 @@
+import pyb
+import pytest
+pytest.importorskip("me405_support")
+import motor_driver
+
+
+def make_motor():
+    return motor_driver.MotorDriver(pyb.Pin.board.PC1, pyb.Pin.board.PA0, 2, 1,
+                                    pyb.Pin.board.PA1, 2, 2, 30000)
+
+
+def compares():
+    return pyb.timer(2).channel(1).compare(), pyb.timer(2).channel(2).compare()
+
+
+def record_writes(monkeypatch):
+    writes = []
+    for number in (1, 2):
+        channel = pyb.timer(2).channel(number)
+        monkeypatch.setattr(channel, "compare",
+                            lambda value, number=number: writes.append((number, value)))
+    return writes
+
+
+def test_duty_cycle_sets_one_input_by_direction():
+    motor = make_motor()
+    span = motor.compare_span
+
+    motor.set_duty_cycle(50)
+    assert compares() == (0, span // 2)
+
+    motor.set_duty_cycle(-25)
+    assert compares() == (span // 4, 0)
+
+
+def test_duty_cycle_is_saturated_to_the_limits():
+    motor = make_motor()
+    motor.set_limits(-30, 150)
+
+    motor.set_duty_cycle(200)
+    assert compares() == (0, motor.compare_span)
+
+    motor.set_duty_cycle(-80)
+    assert compares() == (motor.compare_span * 30 // 100, 0)
+
+
+def test_unchanged_duty_cycle_is_not_written(monkeypatch):
+    motor = make_motor()
+    writes = record_writes(monkeypatch)
+    for _ in range(3):
+        motor.set_duty_cycle(40)
+    motor.set_duty_cycle(40.0001)
+
+    assert writes == [(2, motor.compare_span * 40 // 100)]
+
+
+def test_reversing_clears_the_other_input_first(monkeypatch):
+    motor = make_motor()
+    motor.set_duty_cycle(40)
+    writes = record_writes(monkeypatch)
+    motor.set_duty_cycle(-40)
+
+    assert writes == [(2, 0), (1, motor.compare_span * 40 // 100)]
+
+
+def test_coast_disables_and_brake_enables_the_bridge():
+    motor = make_motor()
+    motor.set_duty_cycle(60)
+
+    motor.coast()
+    assert compares() == (0, 0)
+    assert pyb.pin("PC1").value() == 0
+
+    motor.brake()
+    assert pyb.pin("PC1").value() == 1
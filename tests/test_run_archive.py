@@ -0,0 +1,61 @@
+import numpy
+import pytest
+import run_archive
+
+
+def step_run(tau_ms, target=1000):
+    times = numpy.arange(0, 500, 2.0)
+    return times, target * (1 - numpy.exp(-times / tau_ms))
+
+
+def test_runs_survive_reopening(tmp_path):
+    archive = run_archive.RunArchive(str(tmp_path))
+    times, positions = step_run(20)
+    archive.add(times, positions, numpy.ones(len(times)), (0.03, 0, 0), 1000, label="first")
+    archive.add(*step_run(40), gains=(0.02, 0, 0), target=1000)
+
+    reopened = run_archive.RunArchive(str(tmp_path))
+    assert len(reopened) == 2
+    samples = reopened.samples(0)
+    assert samples["position"].tolist() == positions.tolist()
+    assert samples["control"].tolist() == [1] * len(times)
+    assert reopened.entry(0)["label"] == "first"
+    assert reopened.entry(1)["offset"] == len(times)
+    assert reopened.entry(1)["period_ms"] == 2
+
+
+def test_index_holds_the_step_response_figures(tmp_path):
+    archive = run_archive.RunArchive(str(tmp_path))
+    times, positions = step_run(20)
+    entry = archive.add(times, positions, target=1000)
+    metrics = run_archive.step_metrics.step_metrics(times, positions, 1000)
+
+    assert entry["iae"] == pytest.approx(metrics["iae"][0])
+    assert entry["rise_ms"] == pytest.approx(metrics["rise_ms"][0])
+    assert numpy.isnan(archive.add(times, positions)["iae"])
+
+
+def test_find_filters_sorts_and_limits(tmp_path):
+    archive = run_archive.RunArchive(str(tmp_path))
+    for kp, tau in ((0.01, 80), (0.03, 20), (0.03, 40), (0.02, 30)):
+        archive.add(*step_run(tau), gains=(kp, 0, 0), target=1000)
+
+    assert archive.find(kp=0.03)["run_id"].tolist() == [1, 2]
+    assert archive.find(sort="iae")["run_id"].tolist() == [1, 3, 2, 0]
+    assert archive.find(last=2)["run_id"].tolist() == [2, 3]
+    assert archive.find(kp=(0.015, None), sort="iae")["run_id"].tolist() == [1, 3, 2]
+
+
+def test_unknown_run_is_a_key_error(tmp_path):
+    with pytest.raises(KeyError):
+        run_archive.RunArchive(str(tmp_path)).samples(0)
+
+
+def test_resampled_runs_share_one_grid(tmp_path):
+    archive = run_archive.RunArchive(str(tmp_path))
+    archive.add([0, 10], [0, 100])
+    archive.add([0, 20], [0, 100])
+    grid, positions = archive.resampled([0, 1], grid_ms=10)
+
+    assert grid.tolist() == [0, 10, 20]
+    assert positions.tolist() == [[0, 100, 100], [0, 50, 100]]
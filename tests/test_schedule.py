@@ -0,0 +1,113 @@
+import schedule
+
+
+class FakeTask:
+    """Task with the name, priority and period in us that cotask.Task has"""
+
+    def __init__(self, name, priority, period):
+        self.name = name
+        self.priority = priority
+        self.period = period
+
+
+def task_set():
+    return [FakeTask("slow", 3, 10000), FakeTask("fast", 1, 3000), FakeTask("mid", 2, 5000)]
+
+
+RUN_TIMES = {"fast": 500, "mid": 1000, "slow": 2000}
+
+
+def priorities(tasks):
+    return {task.name: task.priority for task in tasks}
+
+
+def test_rate_monotonic_ranks_by_period():
+    tasks = task_set() + [FakeTask("print", 9, None)]
+    schedule.assign_priorities(tasks)
+
+    assert priorities(tasks) == {"fast": 4, "mid": 3, "slow": 2, "print": 1}
+
+
+def test_equal_periods_keep_the_table_order():
+    tasks = [FakeTask("a", 1, 10000), FakeTask("b", 2, 10000)]
+    schedule.assign_priorities(tasks)
+
+    assert priorities(tasks) == {"a": 1, "b": 2}
+
+
+def test_deadline_monotonic_ranks_by_deadline():
+    tasks = task_set()
+    schedule.assign_priorities(tasks, "deadline_monotonic", {"slow": 1000})
+
+    assert priorities(tasks) == {"slow": 3, "fast": 2, "mid": 1}
+
+
+def test_table_policy_keeps_priorities():
+    tasks = task_set()
+    schedule.assign_priorities(tasks, "table")
+
+    assert priorities(tasks) == {"slow": 3, "fast": 1, "mid": 2}
+
+
+def test_response_times_include_blocking_and_higher_priority_runs():
+    tasks = task_set()
+    schedule.assign_priorities(tasks)
+    results = {task.name: response for task, _, _, response in
+               schedule.response_times(tasks, RUN_TIMES)}
+
+    # fast and mid each wait for the longest lower priority run, mid also for
+    # one run of fast, and slow for one run each of fast and mid
+    assert results == {"fast": 2500, "mid": 3500, "slow": 3500}
+
+
+def test_interrupts_delay_every_task():
+    tasks = task_set()
+    schedule.assign_priorities(tasks)
+    run_times = dict(RUN_TIMES, isr=100)
+    results = schedule.response_times(tasks, run_times, interrupts=[("isr", 1000)])
+
+    assert results[0][0].name == "fast"
+    assert results[0][3] == 2800
+
+
+def test_missed_deadline_fails_the_check():
+    tasks = task_set()
+    schedule.assign_priorities(tasks)
+    feasible, table = schedule.check(tasks, RUN_TIMES, deadlines_us={"mid": 3000})
+
+    assert not feasible
+    assert "MISS" in table
+    assert table.endswith("Deadlines can be missed")
+
+
+def test_feasible_set_passes_and_reports_unmeasured_tasks():
+    tasks = task_set()
+    schedule.assign_priorities(tasks)
+    feasible, table = schedule.check(tasks, {"fast": 500, "mid": 1000})
+
+    assert feasible
+    assert "No run time measured yet for slow" in table
+    assert "CPU utilization 36.7 %" in table
+
+
+def test_overloaded_cpu_fails_the_check():
+    tasks = [FakeTask("a", 1, 1000)]
+    feasible, _ = schedule.check(tasks, {"a": 500}, interrupts=[("isr", 100)])
+    assert feasible
+
+    feasible, _ = schedule.check(tasks, {"a": 500, "isr": 60}, interrupts=[("isr", 100)])
+    assert not feasible
+
+
+def test_run_times_worth_saving():
+    assert schedule.run_times_changed({"a": 100}, {"a": 150}, 0.2)
+    assert schedule.run_times_changed({"a": 100}, {"b": 10}, 0.2)
+    assert not schedule.run_times_changed({"a": 100}, {"a": 110}, 0.2)
+
+
+def test_run_times_round_trip_through_a_file(tmp_path):
+    path = str(tmp_path / "run_times.json")
+    assert schedule.load_run_times(path) == {}
+
+    schedule.save_run_times({"a": 100}, path)
+    assert schedule.load_run_times(path) == {"a": 100}
@@ -0,0 +1,97 @@
+import pyb
+import pytest
+import servo_driver
+
+
+def make_servo(motion_capacity):
+    return servo_driver.ServoDriver(pyb.Pin.board.PA8, 1, 1, 600, 2600, 180, 19999, 79,
+                                    motion_capacity=motion_capacity)
+
+
+def test_sweep_larger_than_motion_is_rejected():
+    servo = make_servo(100)
+
+    with pytest.raises(ValueError):
+        servo.test_sweep_reset()
+
+
+def test_sweep_fills_full_range():
+    servo = make_servo(181)
+    servo.test_sweep_reset()
+
+    assert list(servo.motion[:181]) == list(range(181))
+
+
+class FakeShare:
+    """Task state share holding a settable value"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def record_writes(monkeypatch):
+    writes = []
+    channel = pyb.timer(1).channel(1)
+    monkeypatch.setattr(channel, "pulse_width", writes.append)
+    return writes
+
+
+def test_pulse_table_spans_the_pulse_range():
+    servo = make_servo(10)
+
+    assert servo.pulse_table[0] == 600
+    assert servo.pulse_table[90] == 1600
+    assert servo.pulse_table[180] == 2600
+
+
+def test_waypoints_are_interpolated_every_tick():
+    servo = make_servo(10)
+    count = servo.plan_waypoints([(0, 0), (40, 20), (60, 20), (80, 0)], 10)
+
+    assert count == 9
+    assert list(servo.motion[:count]) == [0, 5, 10, 15, 20, 20, 20, 10, 0]
+
+
+def test_bad_waypoints_are_rejected():
+    servo = make_servo(10)
+
+    with pytest.raises(ValueError):
+        servo.plan_waypoints([(0, 0), (50, 181)], 10)
+    with pytest.raises(ValueError):
+        servo.plan_waypoints([(0, 0), (100, 90)], 10)
+
+
+def test_motion_holds_last_angle_and_writes_only_changes(monkeypatch):
+    servo = make_servo(10)
+    servo.plan_waypoints([(0, 0), (20, 10), (40, 10)], 10)
+    writes = record_writes(monkeypatch)
+    task = servo.motion_task(FakeShare(1))
+    for _ in range(8):
+        next(task)
+
+    assert writes == [600, 655, 711]
+    assert servo.get_angle() == 10
+
+
+def test_repeating_motion_starts_over():
+    servo = make_servo(10)
+    servo.plan_sweep(0, 20, 10, 10)
+    task = servo.motion_task(FakeShare(1))
+    angles = []
+    for _ in range(4):
+        next(task)
+        angles.append(servo.get_angle())
+
+    assert angles == [0, 20, 0, 20]
+
+
+def test_disabled_task_turns_the_pulse_off(monkeypatch):
+    servo = make_servo(10)
+    servo.set_angle(90)
+    writes = record_writes(monkeypatch)
+    next(servo.motion_task(FakeShare(0)))
+
+    assert writes == [0]
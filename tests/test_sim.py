@@ -0,0 +1,77 @@
+import pytest
+import pyb
+import utime
+from plant import DCMotorPlant
+from sim_clock import clock, TICKS_MAX
+
+
+def test_clock_advances_by_poll_cost_on_every_read():
+    clock.poll_cost_us = 5
+    first = clock.read_us()
+    second = clock.read_us()
+
+    assert second - first == 5
+    assert clock.reads == 2
+
+
+def test_events_fire_in_time_order_at_their_time():
+    fired = []
+    clock.call_at(300, lambda: fired.append(("late", clock.now_us)))
+    clock.call_at(100, lambda: fired.append(("early", clock.now_us)))
+    clock.advance(1000)
+
+    assert fired == [("early", 100), ("late", 300)]
+    assert clock.now_us == 1000
+
+
+def test_stop_at_raises_keyboard_interrupt():
+    clock.stop_at(500)
+    clock.advance(499)
+
+    with pytest.raises(KeyboardInterrupt):
+        clock.advance(1)
+
+
+def test_ticks_wrap_like_micropython():
+    later = utime.ticks_add(TICKS_MAX - 4, 10)
+
+    assert later == 5
+    assert utime.ticks_diff(later, TICKS_MAX - 4) == 10
+    assert utime.ticks_diff(TICKS_MAX - 4, later) == -10
+
+
+def test_timer_callback_fires_at_its_rate():
+    ticks = []
+    pyb.Timer(6, freq=1000).callback(lambda timer: ticks.append(clock.now_us))
+    clock.advance(10500)
+
+    assert len(ticks) == 10
+    assert ticks[1] - ticks[0] == 1000
+
+
+def _drive(percent):
+    timer = pyb.Timer(2, freq=30000)
+    timer.channel(1, pyb.Timer.PWM, pin=pyb.Pin(pyb.Pin.board.PA0)).pulse_width_percent(0)
+    timer.channel(2, pyb.Timer.PWM, pin=pyb.Pin(pyb.Pin.board.PA1)).pulse_width_percent(percent)
+    pyb.Pin(pyb.Pin.board.PC1, pyb.Pin.OUT_PP).high()
+
+
+def test_motor_turns_forward_and_encoder_counts_down():
+    motor = DCMotorPlant()
+    pyb.Timer(4, prescaler=0, period=0xFFFF)
+    _drive(50)
+    clock.advance(100000)
+
+    position = motor.position_counts()
+    assert position > 0
+    # The encoder timer counts down for forward motion
+    assert pyb.timer(4).counter() == (-position) % 0x10000
+
+
+def test_motor_coasts_when_disabled():
+    motor = DCMotorPlant()
+    _drive(100)
+    pyb.pin("PC1").low()
+    clock.advance(100000)
+
+    assert motor.position_counts() == 0
@@ -0,0 +1,58 @@
+import numpy
+import pytest
+import step_metrics
+
+
+def first_order(times, tau_ms, target):
+    return target * (1 - numpy.exp(-times / tau_ms))
+
+
+def test_first_order_rise_and_settling_times():
+    times = numpy.arange(0, 1000, 0.1)
+    metrics = step_metrics.step_metrics(times, first_order(times, 50, 1000), 1000)
+
+    # 10 % to 90 % of a first order step takes ln(9) time constants, and it
+    # enters the 2 % band after ln(50)
+    assert metrics["rise_ms"][0] == pytest.approx(50 * numpy.log(9), abs=0.2)
+    assert metrics["settling_ms"][0] == pytest.approx(50 * numpy.log(50), abs=0.2)
+    assert metrics["overshoot_pct"][0] == 0
+    assert metrics["steady_state_error"][0] == pytest.approx(0, abs=0.1)
+    assert metrics["iae"][0] == pytest.approx(0.05, rel=0.01)
+
+
+def test_overshoot_and_negative_steps():
+    times = numpy.arange(0, 100, 1.0)
+    response = numpy.minimum(times / 10, 1) * 1.2
+    response[30:] = 1
+
+    for target in (500, -500):
+        metrics = step_metrics.step_metrics(times, response * target, target)
+        assert metrics["overshoot_pct"][0] == pytest.approx(20)
+        assert metrics["settling_ms"][0] == 30
+
+
+def test_unreached_figures_are_nan():
+    times = numpy.arange(0, 100, 1.0)
+    metrics = step_metrics.step_metrics(times, numpy.full(len(times), 50.0), 1000)
+
+    assert numpy.isnan(metrics["rise_ms"][0])
+    assert numpy.isnan(metrics["settling_ms"][0])
+    assert metrics["steady_state_error"][0] == pytest.approx(950)
+
+
+def test_each_run_is_scored_as_if_alone():
+    times = numpy.arange(0, 500, 1.0)
+    runs = numpy.array([first_order(times, tau, 1000) for tau in (20, 40, 80)])
+    together = step_metrics.step_metrics(times, runs, 1000)
+
+    for index, run in enumerate(runs):
+        alone = step_metrics.step_metrics(times, run, 1000)
+        for name, values in together.items():
+            assert values[index] == pytest.approx(alone[name][0], nan_ok=True)
+
+
+def test_resample_holds_the_last_position():
+    grid = numpy.arange(0, 40, 10.0)
+
+    assert step_metrics.resample([0, 20], [0, 100], grid).tolist() == [0, 50, 100, 100]
+    assert numpy.isnan(step_metrics.resample([], [], grid)).all()
@@ -0,0 +1,70 @@
+import numpy
+import pytest
+import system_id
+
+
+## Motor the test runs are made with
+PLANT = {"gain": 300.0, "time_constant_s": 0.05, "friction_pct": 5.0, "deadband_pct": 8.0,
+         "delay_samples": 1, "period_ms": 5.0}
+
+
+def recorded_runs(count=3, seed=1):
+    # Runs of outputs held for 50 ms at a time, at random levels in both directions
+    random = numpy.random.default_rng(seed)
+    controls = numpy.repeat(random.uniform(-60, 60, (count, 20)), 10, axis=1)
+    positions = system_id.simulate_plant(PLANT, controls)
+    times = numpy.arange(controls.shape[1]) * PLANT["period_ms"]
+    return [(times, run_positions, run_controls)
+            for run_positions, run_controls in zip(positions, controls)]
+
+
+def test_fit_recovers_the_motor_the_runs_came_from():
+    plant = system_id.fit_plant(recorded_runs())
+
+    assert plant["gain"] == pytest.approx(300)
+    assert plant["time_constant_s"] == pytest.approx(0.05)
+    assert plant["friction_pct"] == pytest.approx(5)
+    assert plant["delay_samples"] == 1
+    assert plant["period_ms"] == 5
+    assert plant["residual_rms"] < 1e-6
+    assert plant["run_gain"] == pytest.approx([300] * 3)
+    # Only outputs that left the motor at rest are seen, so the deadband found
+    # is at most the true one
+    assert 0 < plant["deadband_pct"] <= 8
+
+
+def test_fitted_model_predicts_the_runs():
+    runs = recorded_runs()
+    plant = system_id.fit_plant(runs)
+    predicted = system_id.simulate_plant(plant, [run[2] for run in runs])
+
+    # Only the smaller deadband found keeps the prediction from being exact
+    assert numpy.abs(predicted - [run[1] for run in runs]).max() < 0.05 * numpy.abs(predicted).max()
+
+
+def test_fast_runs_are_averaged_down_to_the_shortest_period():
+    times = numpy.arange(0, 20, 1.0)
+    controls = numpy.where(times < 7, 10.0, 30.0)
+    period_ms, positions, stacked = system_id.stack_runs([(times, times * 2, controls)])
+
+    assert period_ms == system_id.MIN_PERIOD_MS
+    assert positions[0].tolist() == [0, 10, 20, 30]
+    assert stacked[0, :3].tolist() == pytest.approx([10, 22, 30])
+    assert numpy.isnan(stacked[0, 3])
+
+
+def test_suggested_gains_place_the_closed_loop_poles():
+    gains = system_id.suggest_gains(PLANT, damping=1.0, natural_frequency=20)
+    period_s = PLANT["period_ms"] / 1000
+    gain, tau = PLANT["gain"], PLANT["time_constant_s"]
+
+    # tau s^2 + (1 + K Kd') s + K Kp matches tau (s^2 + 2 zeta wn s + wn^2)
+    assert gain * gains["Kp"] == pytest.approx(tau * 20 ** 2)
+    assert 1 + gain * gains["Kd"] * period_s == pytest.approx(tau * 2 * 20)
+    assert gains["settling_ms"] == pytest.approx(1000 * 5.8 / 20)
+
+
+def test_default_natural_frequency_is_limited_by_the_delay():
+    gains = system_id.suggest_gains(PLANT)
+
+    assert gains["natural_frequency"] == pytest.approx(0.25 / (1.5 * 0.005))
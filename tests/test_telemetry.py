@@ -0,0 +1,81 @@
+import display
+import telemetry
+
+
+class FakeStream:
+    """Stream collecting everything written, like pyb.USB_VCP"""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, buffer):
+        self.writes.append(bytes(buffer))
+
+    def data(self):
+        return b"".join(self.writes)
+
+
+def frames(*samples):
+    stream = FakeStream()
+    writer = telemetry.TelemetryWriter(stream)
+    for sample in samples:
+        writer.write(*sample)
+    return stream.data()
+
+
+def test_frames_are_batched_until_full_or_flushed():
+    stream = FakeStream()
+    writer = telemetry.TelemetryWriter(stream, frames_per_write=3)
+    for time_us in range(4):
+        writer.write(time_us, 0, 0.0, 1)
+
+    assert [len(write) for write in stream.writes] == [3 * telemetry.FRAME_SIZE]
+
+    writer.flush()
+    assert [len(write) for write in stream.writes] == [3 * telemetry.FRAME_SIZE,
+                                                       telemetry.FRAME_SIZE]
+
+
+def test_decoded_frames_match_what_was_written():
+    decoded, consumed = display.decode_telemetry(frames((1000, -5, 12.5, 1), (2000, 7, -3.25, 2)))
+
+    assert consumed == 2 * telemetry.FRAME_SIZE
+    assert list(decoded["time_us"]) == [1000, 2000]
+    assert list(decoded["position"]) == [-5, 7]
+    assert list(decoded["control"]) == [12.5, -3.25]
+    assert list(decoded["state"]) == [1, 2]
+
+
+def test_text_between_frames_is_skipped():
+    data = frames((1, 10, 0.0, 1)) + b"beat\r\n" + frames((2, 20, 0.0, 1))
+    decoded, consumed = display.decode_telemetry(data)
+
+    assert list(decoded["position"]) == [10, 20]
+    assert consumed == len(data)
+
+
+def test_frame_with_bad_checksum_is_dropped():
+    data = bytearray(frames((1, 10, 0.0, 1), (2, 20, 0.0, 1)))
+    data[telemetry.FRAME_SIZE - 1] ^= 0xFF
+    decoded, _ = display.decode_telemetry(bytes(data))
+
+    assert list(decoded["position"]) == [20]
+
+
+def test_partial_frame_is_left_for_the_next_buffer():
+    data = frames((1, 10, 0.0, 1), (2, 20, 0.0, 1))
+    split = telemetry.FRAME_SIZE + 5
+    decoded, consumed = display.decode_telemetry(data[:split])
+
+    assert list(decoded["position"]) == [10]
+    assert consumed == telemetry.FRAME_SIZE
+
+    decoded, consumed = display.decode_telemetry(data[consumed:])
+    assert list(decoded["position"]) == [20]
+
+
+def test_trailing_first_sync_byte_is_kept():
+    data = frames((1, 10, 0.0, 1)) + bytes((telemetry.SYNC_1,))
+    _, consumed = display.decode_telemetry(data)
+
+    assert consumed == telemetry.FRAME_SIZE
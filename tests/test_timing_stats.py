@@ -0,0 +1,142 @@
+import timing_stats
+from sim_clock import clock
+
+
+def test_total_past_small_int_range_stays_exact():
+    # A long session in the timer interrupt sums past 2 ** 30; every part of
+    # the sum must stay a small integer so recording never allocates
+    stats = timing_stats.TimingStats(10, 20)
+    value = 123457
+    count = 20000
+    for _ in range(count):
+        stats.add(value)
+
+    assert stats.total() == value * count
+    assert stats.total() > 1 << 30
+    assert stats.mean() == value
+    assert stats._TimingStats__total_low < 1 << timing_stats.TOTAL_SHIFT
+    assert stats._TimingStats__total_chunks < 1 << 30
+
+
+def test_total_of_negative_values():
+    stats = timing_stats.TimingStats(10, 20)
+    for value in (5, -3000000, 7, -2):
+        stats.add(value)
+
+    assert stats.total() == 5 - 3000000 + 7 - 2
+    assert stats.minimum == -3000000
+
+
+def test_reset_clears_total():
+    stats = timing_stats.TimingStats(10, 20)
+    stats.add(1 << 25)
+    stats.reset()
+
+    assert stats.total() == 0
+    assert stats.mean() == 0
+
+
+def test_histogram_counts_each_bin_and_the_last_bin_holds_the_rest():
+    stats = timing_stats.TimingStats(10, 3)
+    for value in (0, 9, 10, 25, 1000):
+        stats.add(value)
+
+    assert list(stats.histogram) == [2, 1, 2]
+    assert stats.maximum == 1000
+
+
+def test_start_latency_is_measured_from_each_release():
+    stats = timing_stats.TaskStats("task", 10)
+    stats.record(1000, 1100)
+    stats.record(11300, 11400)
+    stats.record(21000, 21100)
+
+    assert stats.latency.count == 3
+    assert stats.latency.maximum == 300
+    assert stats.latency.minimum == 0
+    assert stats.next_release() == 31000
+
+
+def test_run_past_the_next_release_is_a_miss():
+    stats = timing_stats.TaskStats("task", 10)
+    stats.record(0, 2000)
+    stats.record(18000, 20500)
+
+    assert stats.misses == 1
+
+
+def test_run_before_the_expected_release_moves_the_phase():
+    stats = timing_stats.TaskStats("task", 10)
+    stats.record(5000, 5100)
+    stats.record(12000, 12100)
+
+    assert stats.latency.maximum == 0
+    assert stats.next_release() == 22000
+
+
+def test_triggered_task_records_only_run_time():
+    stats = timing_stats.TaskStats("task", None)
+    stats.record(0, 700)
+    stats.record(100000, 100300)
+
+    assert stats.run_time.count == 2
+    assert stats.latency.count == 0
+    assert stats.next_release() is None
+
+
+def test_timed_task_records_every_resume():
+    stats = timing_stats.TaskStats("task", 10)
+
+    def task_function(shares):
+        while True:
+            clock.advance(shares)
+            yield 0
+
+    task = timing_stats.timed(task_function, stats)(250)
+    for _ in range(3):
+        next(task)
+
+    assert stats.run_time.count == 3
+    assert stats.run_time.minimum >= 250
+
+
+class FakeGc:
+    """Heap whose allocated bytes are read from a list, one value per call"""
+
+    def __init__(self, readings):
+        self.readings = list(readings)
+
+    def mem_alloc(self):
+        return self.readings.pop(0)
+
+
+def test_allocation_of_each_resume_is_recorded(monkeypatch):
+    monkeypatch.setattr(timing_stats, "gc", FakeGc([1000, 1064, 1064, 1064, 1064, 200]))
+    monkeypatch.setattr(timing_stats, "track_allocations", True)
+    stats = timing_stats.TaskStats("allocating", 10)
+
+    def task_function():
+        while True:
+            yield 0
+
+    task = timing_stats.timed(task_function, stats)()
+    for _ in range(3):
+        next(task)
+
+    assert stats.allocated.count == 2
+    assert stats.allocated.maximum == 64
+    assert stats.collections == 1
+
+
+def test_allocation_report_lists_the_worst_task_first(monkeypatch):
+    monkeypatch.setattr(timing_stats, "task_stats_list", [])
+    assert "No allocations recorded" in timing_stats.allocation_report()
+
+    quiet = timing_stats.TaskStats("quiet", 10)
+    busy = timing_stats.TaskStats("busy", 10)
+    timing_stats.TaskStats("clean", 10)
+    quiet.record_allocation(16)
+    busy.record_allocation(256)
+
+    lines = timing_stats.allocation_report().splitlines()
+    assert [line.split()[0] for line in lines] == ["busy", "quiet"]